@@ -0,0 +1,156 @@
+import asyncio
+import inspect
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Optional
+import database
+from config import old_database_path_v0210, new_database_path_v0171
+from tag_index import TagIndex, load_tag_index
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+MIGRATOR_PATH = Path(__file__).resolve().parent / "migrate_v0210_to_v0171.py"
+
+
+async def call_handler(handler: Optional[Callable], *args):
+    """调用界面组件的回调，回调为 async 函数时等待它完成。"""
+    if handler is None:
+        return None
+    result = handler(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class AsyncDataLayer:
+    """
+    界面使用的异步数据层
+
+    memo / resource 的读写都在一个专用线程中执行，数据库连接只属于该线程，事件循环不会被数据库 I/O 阻塞；
+    重新加载标签、迁移等耗时操作在后台线程或子进程中执行，进度通过回调在事件循环中通知。
+    """
+
+    def __init__(
+        self,
+        old_db_path: str = old_database_path_v0210,
+        new_db_path: str = new_database_path_v0171,
+        submit_queue=None,
+        search_index=None,
+        background_workers: int = 2,
+    ):
+        """
+        :param old_db_path: 旧数据库 (v0.21.0) 的路径，默认为 old_database_path_v0210。
+        :param new_db_path: 新数据库 (v0.17.1) 的路径，默认为 new_database_path_v0171。
+        :param submit_queue: submit_queue.SubmitQueue 对象，默认为 None；给出时 submit_memo 经队列写入。
+        :param search_index: memo_search.MemoSearchIndex 对象，默认为 None；给出时可搜索 memo，直接写入时同步更新索引。
+        :param background_workers: 执行耗时操作的线程数，默认为 2。
+        """
+        self.submit_queue = submit_queue
+        self.search_index = search_index
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="data_layer")
+        self._background_executor = ThreadPoolExecutor(
+            max_workers=background_workers, thread_name_prefix="data_layer_background"
+        )
+        # 连接在专用线程中首次使用时打开
+        self._connections = database.ConnectionRegistry({
+            "v0210": lambda: database.open_connection(old_db_path, "read_only"),
+            "v0171": lambda: database.open_connection(new_db_path, "default"),
+        })
+
+    async def _run_db(self, function: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, partial(function, *args, **kwargs))
+
+    # memo / resource
+    async def confirmed_memo_id(self, memo_id: int, operation: str = "gte") -> int:
+        return await self._run_db(
+            lambda: database.confirmed_memo_id(memo_id, self._connections.get("v0210"), operation)
+        )
+
+    async def get_memo_record(self, memo_id: int) -> dict:
+        return await self._run_db(
+            lambda: database.get_memo_record(memo_id, self._connections.get("v0210"))
+        )
+
+    async def get_resource_record(self, memo_id: int, version: str = "v0171") -> List[dict]:
+        return await self._run_db(
+            lambda: database.get_resource_record(
+                memo_id,
+                version,
+                db_connection=self._connections.get(version),
+                another_db_connection=self._connections.get("v0210"),
+            )
+        )
+
+    async def upsert_memo_record(self, memo_id: int, created_ts: int, updated_ts: int, content: str, **kwargs) -> None:
+        await self._run_db(
+            lambda: database.upsert_memo_record(
+                memo_id, created_ts, updated_ts, content, db_connection=self._connections.get("v0171"), **kwargs
+            )
+        )
+
+    async def insert_resource_record(self, memo_id: int, created_ts: int, updated_ts: int, filename: str, **kwargs) -> None:
+        await self._run_db(
+            lambda: database.insert_resource_record(
+                memo_id, created_ts, updated_ts, filename, db_connection=self._connections.get("v0171"), **kwargs
+            )
+        )
+
+    async def submit_memo(self, memo_id: int, created_ts: int, updated_ts: int, content: str, **kwargs) -> None:
+        """提交 memo：有提交队列时写入队列的日志文件后立即返回，否则直接写入新数据库。"""
+        if self.submit_queue is not None:
+            await self._run_db(self.submit_queue.submit, memo_id, created_ts, updated_ts, content, **kwargs)
+        else:
+            await self.upsert_memo_record(memo_id, created_ts, updated_ts, content, **kwargs)
+            if self.search_index is not None:
+                await self._run_db(self.search_index.update_many, [(memo_id, content)])
+
+    async def search_memos(self, query: str, limit: int = 50) -> List[tuple]:
+        """在全文索引中搜索 memo，没有索引时返回空列表。"""
+        if self.search_index is None:
+            return []
+        return await self.run_in_background(self.search_index.search, query, limit)
+
+    async def flush_submits(self, timeout: Optional[float] = None) -> bool:
+        if self.submit_queue is None:
+            return True
+        return await self.run_in_background(self.submit_queue.flush, timeout)
+
+    # 耗时操作
+    async def run_in_background(self, function: Callable, *args, **kwargs):
+        """在后台线程中执行任意阻塞函数，如 MemoCursor.next / prev。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._background_executor, partial(function, *args, **kwargs))
+
+    async def load_tag_index(self) -> TagIndex:
+        return await self.run_in_background(load_tag_index)
+
+    async def run_migration(self, progress: Optional[Callable[[str], None]] = None) -> None:
+        """
+        在子进程中运行 migrate_v0210_to_v0171.py，迁移期间事件循环不受影响
+
+        :param progress: 每输出一行日志（即迁移进度和指标）时调用，参数为该行内容
+        """
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(MIGRATOR_PATH),
+            cwd=str(MIGRATOR_PATH.parent),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        async for line in process.stderr:
+            if progress is not None:
+                await call_handler(progress, line.decode("utf-8", errors="replace").rstrip())
+        return_code = await process.wait()
+        if return_code != 0:
+            log.error(f"迁移失败，退出码：{return_code}")
+            raise RuntimeError("Migration failed.")
+
+    def close(self):
+        """关闭连接并停止线程。"""
+        self._db_executor.submit(self._connections.close_all).result()
+        self._db_executor.shutdown(wait=True)
+        self._background_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,321 @@
+"""
+迁移性能基准测试
+
+按参数生成 v0.21.0 结构（assets/memos_0210_struct.sql）的合成数据库，
+分别用各个 migrate_mode 运行 migrate_v0210_to_v0171.py，记录用时、速率、峰值内存和目标文件大小，
+结果追加到 JSON 文件中，并与上一次相同数据集、相同模式的结果比较。全程离线运行。
+
+用法示例：
+    python benchmark.py --memos 100000 --resources 5000 --modes bulk,parallel,attach
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+REPO_DIR = Path(__file__).resolve().parent
+SOURCE_SCHEMA_PATH = REPO_DIR / "assets" / "memos_0210_struct.sql"
+TARGET_SCHEMA_PATH = REPO_DIR / "assets" / "memos_0171_struct.sql"
+MIGRATOR_PATH = REPO_DIR / "migrate_v0210_to_v0171.py"
+MODES = ("row", "bulk", "parallel", "attach", "sharded", "delta")
+
+# 生成内容用的词表，包含中英文和 #标签，让内容接近真实的 memo
+WORDS = (
+    "今天", "会议", "记录", "想法", "读书", "笔记", "项目", "进度", "问题", "解决",
+    "memo", "note", "todo", "python", "sqlite", "migrate", "flet", "release", "bug", "fix",
+    "#工作", "#工作/会议", "#读书/笔记", "#生活", "#Tag1/Tag1-1", "\n", "。", "，", "- [ ]", "```",
+)
+# 在子进程中运行迁移脚本并记录用时和峰值内存；cwd 下的 config.py 会先于仓库里的 config.py 被导入
+# 分片模式的工作进程是迁移进程的子进程，峰值内存取迁移进程与已结束的工作进程中较大的一个
+RUNNER = """
+import json, resource, runpy, sys, time
+start = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="__main__")
+wall_s = time.perf_counter() - start
+self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+with open(sys.argv[2], "w", encoding="utf-8") as f:
+    json.dump({"wall_s": wall_s, "peak_rss_kb": max(self_kb, children_kb), "children_peak_rss_kb": children_kb}, f)
+"""
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="生成合成的 v0.21.0 数据库并测试各迁移模式的性能。")
+    parser.add_argument("--memos", type=int, default=10000, help="memo 数量")
+    parser.add_argument("--content-median", type=int, default=200, help="memo 内容长度（字符）的中位数")
+    parser.add_argument("--content-sigma", type=float, default=1.0, help="memo 内容长度对数正态分布的 sigma")
+    parser.add_argument("--content-max", type=int, default=20000, help="memo 内容长度上限")
+    parser.add_argument("--gap-ratio", type=float, default=0.05, help="相邻 memo id 之间出现空洞的概率")
+    parser.add_argument("--max-gap", type=int, default=100, help="id 空洞的最大跨度")
+    parser.add_argument("--resources", type=int, default=1000, help="resource 数量")
+    parser.add_argument("--blob-median", type=int, default=64 * 1024, help="blob 大小（字节）的中位数")
+    parser.add_argument("--blob-sigma", type=float, default=1.0, help="blob 大小对数正态分布的 sigma")
+    parser.add_argument("--blob-max", type=int, default=8 * 1024 * 1024, help="blob 大小上限")
+    parser.add_argument("--external-ratio", type=float, default=0.1, help="外链 resource（不带 blob）的比例")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子，相同参数生成相同的数据库")
+    parser.add_argument("--modes", default="bulk,parallel,attach", help=f"逗号分隔的迁移模式，可选 {','.join(MODES)}")
+    parser.add_argument("--work-dir", default="./benchmark_data/", help="存放合成数据库和迁移结果的目录")
+    parser.add_argument("--output", default="./benchmark_data/results.json", help="追加保存结果的 JSON 文件")
+    parser.add_argument("--regenerate", action="store_true", help="即使已有相同参数的合成数据库也重新生成")
+    args = parser.parse_args(argv)
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    invalid_modes = [mode for mode in modes if mode not in MODES]
+    if invalid_modes or not modes:
+        parser.error(f"无效的迁移模式：{args.modes}")
+    args.modes = modes
+    return args
+
+
+def dataset_params(args: argparse.Namespace) -> dict:
+    """决定合成数据库内容的参数，相同参数对应同一个数据集。"""
+    return {
+        "memos": args.memos,
+        "content_median": args.content_median,
+        "content_sigma": args.content_sigma,
+        "content_max": args.content_max,
+        "gap_ratio": args.gap_ratio,
+        "max_gap": args.max_gap,
+        "resources": args.resources,
+        "blob_median": args.blob_median,
+        "blob_sigma": args.blob_sigma,
+        "blob_max": args.blob_max,
+        "external_ratio": args.external_ratio,
+        "seed": args.seed,
+    }
+
+
+def dataset_key(params: dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def _lognormal_size(rng: random.Random, median: int, sigma: float, upper: int) -> int:
+    """中位数为 median 的对数正态分布，截断到 [1, upper]。"""
+    return max(1, min(upper, int(rng.lognormvariate(math.log(max(median, 1)), sigma))))
+
+
+def _chunked(rows: Iterator[tuple], size: int = 5000) -> Iterator[List[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_memo_rows(params: dict, rng: random.Random, memo_ids: List[int]) -> Iterator[tuple]:
+    # 先生成一段足够长的文本，每条 memo 截取其中的一段，避免逐字随机
+    text_pool = " ".join(rng.choice(WORDS) for _ in range(200000))
+    memo_id = 0
+    for _ in range(params["memos"]):
+        memo_id += rng.randint(2, params["max_gap"]) if rng.random() < params["gap_ratio"] else 1
+        memo_ids.append(memo_id)
+        length = _lognormal_size(rng, params["content_median"], params["content_sigma"], params["content_max"])
+        start = rng.randrange(max(len(text_pool) - length, 1))
+        content = text_pool[start:start + length]
+        created_ts = 1600000000 + memo_id * 60
+        updated_ts = created_ts + rng.randint(0, 86400)
+        yield memo_id, 1, created_ts, updated_ts, content, f"bench-memo-{memo_id}"
+
+
+def _iter_resource_rows(params: dict, rng: random.Random, memo_ids: List[int]) -> Iterator[tuple]:
+    for resource_id in range(1, params["resources"] + 1):
+        memo_id = rng.choice(memo_ids) if memo_ids and rng.random() < 0.9 else None
+        created_ts = 1600000000 + resource_id * 60
+        if rng.random() < params["external_ratio"]:
+            blob, storage_type, reference = None, "", f"https://example.com/bench/{resource_id}.png"
+            size = 0
+        else:
+            size = _lognormal_size(rng, params["blob_median"], params["blob_sigma"], params["blob_max"])
+            blob = b"\x89PNG\r\n\x1a\n" + rng.randbytes(max(size - 8, 0))
+            storage_type, reference = "DATABASE", ""
+            size = len(blob)
+        yield (
+            resource_id, 1, created_ts, created_ts, f"bench_{resource_id}.png", blob, "image/png",
+            size, memo_id, f"bench-resource-{resource_id}", storage_type, reference,
+        )
+
+
+def generate_source_database(db_path: Path, params: dict) -> None:
+    """
+    按参数生成合成的 v0.21.0 数据库
+
+    :param db_path: 数据库文件路径，已存在时覆盖
+    :param params: dataset_params() 返回的参数
+    """
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    rng = random.Random(params["seed"])
+    memo_ids: List[int] = []
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SOURCE_SCHEMA_PATH.read_text(encoding="utf-8"))
+        conn.commit()
+        for chunk in _chunked(_iter_memo_rows(params, rng, memo_ids)):
+            with conn:
+                conn.executemany(
+                    "INSERT INTO memo (id, creator_id, created_ts, updated_ts, content, uid) VALUES (?, ?, ?, ?, ?, ?)",
+                    chunk,
+                )
+        for chunk in _chunked(_iter_resource_rows(params, rng, memo_ids), size=100):
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO resource (id, creator_id, created_ts, updated_ts, filename, blob, type,
+                                          size, memo_id, uid, storage_type, reference)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    chunk,
+                )
+    finally:
+        conn.close()
+
+
+def _file_size(db_path: Path) -> int:
+    return sum(Path(f"{db_path}{suffix}").stat().st_size
+               for suffix in ("", "-wal") if Path(f"{db_path}{suffix}").exists())
+
+
+def _count_rows(db_path: Path, table: str) -> int:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_migration(mode: str, source_path: Path, run_dir: Path) -> dict:
+    """
+    在子进程中以指定模式迁移一次，目标数据库每次重新创建
+
+    :param mode: migrate_mode
+    :param source_path: 合成的 v0.21.0 数据库路径
+    :param run_dir: 本次运行的目录，存放目标数据库、config.py、日志和指标
+    :return dict: 本次运行的结果
+    """
+    run_dir.mkdir(parents=True, exist_ok=True)
+    target_path = run_dir / "memos_prod_v0171.db"
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{target_path}{suffix}").unlink(missing_ok=True)
+    metrics_path = run_dir / "metrics.json"
+    timing_path = run_dir / "timing.json"
+
+    # 以 config_template.py 为基础，只覆盖路径和模式，结果不受本地 config.py 影响
+    (run_dir / "config.py").write_text(
+        "from config_template import *\n"
+        f"log_path = {str(run_dir / 'log')!r}\n"
+        f"old_database_path_v0210 = {str(source_path)!r}\n"
+        f"new_database_path_v0171 = {str(target_path)!r}\n"
+        f"new_database_schema_path_v0171 = {str(TARGET_SCHEMA_PATH)!r}\n"
+        "resource_dedup_dir = ''\n"
+        f"migrate_mode = {mode!r}\n"
+        f"metrics_json_path = {str(metrics_path)!r}\n",
+        encoding="utf-8",
+    )
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get("PYTHONPATH", "")]))
+    completed = subprocess.run(
+        [sys.executable, "-c", RUNNER, str(MIGRATOR_PATH), str(timing_path)],
+        cwd=run_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        print(completed.stderr[-4000:], file=sys.stderr)
+        raise RuntimeError(f"Migration failed in mode {mode}.")
+
+    timing = json.loads(timing_path.read_text(encoding="utf-8"))
+    memo_rows = _count_rows(target_path, "memo")
+    resource_rows = _count_rows(target_path, "resource")
+    wall_s = timing["wall_s"]
+    return {
+        "mode": mode,
+        "wall_s": round(wall_s, 3),
+        "memo_rows": memo_rows,
+        "resource_rows": resource_rows,
+        "memo_rows_per_sec": round(memo_rows / wall_s, 1) if wall_s else None,
+        "rows_per_sec": round((memo_rows + resource_rows) / wall_s, 1) if wall_s else None,
+        "peak_rss_mb": round(timing["peak_rss_kb"] / 1024, 1),
+        "children_peak_rss_mb": round(timing["children_peak_rss_kb"] / 1024, 1),
+        "target_size_bytes": _file_size(target_path),
+        "metrics": json.loads(metrics_path.read_text(encoding="utf-8")) if metrics_path.exists() else None,
+    }
+
+
+def load_results(output_path: Path) -> list:
+    if not output_path.exists():
+        return []
+    return json.loads(output_path.read_text(encoding="utf-8"))
+
+
+def find_previous(results: list, key: str, mode: str) -> Optional[dict]:
+    """找到上一次相同数据集、相同模式的结果。"""
+    for run in reversed(results):
+        if run["dataset_key"] != key:
+            continue
+        for result in run["results"]:
+            if result["mode"] == mode:
+                return result
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    params = dataset_params(args)
+    key = dataset_key(params)
+    work_dir = Path(args.work_dir).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    output_path = Path(args.output).resolve()
+
+    source_path = work_dir / f"source_{key}.db"
+    if args.regenerate or not source_path.exists():
+        print(f"生成合成数据库 {source_path} ...")
+        start = time.perf_counter()
+        generate_source_database(source_path, params)
+        print(f"生成完成，用时 {time.perf_counter() - start:.2f} 秒。")
+
+    results = load_results(output_path)
+    run = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "dataset_key": key,
+        "dataset": params,
+        "source_size_bytes": _file_size(source_path),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "results": [],
+    }
+    for mode in args.modes:
+        result = run_migration(mode, source_path, work_dir / f"run_{key}" / mode)
+        previous = find_previous(results, key, mode)
+        line = (
+            f"[{mode}] {result['wall_s']:.2f} 秒，{result['rows_per_sec']:.0f} 行/秒，"
+            f"峰值内存 {result['peak_rss_mb']} MiB，目标文件 {result['target_size_bytes'] / 1024 / 1024:.1f} MiB"
+        )
+        if previous is not None and previous["wall_s"]:
+            line += f"，用时为上次的 {result['wall_s'] / previous['wall_s']:.2f} 倍"
+        print(line)
+        run["results"].append(result)
+
+    results.append(run)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(temp_path, output_path)
+    print(f"结果已保存到 {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+from typing import Optional
+from config import migrate_blob_chunk_size
+from database import iter_resource_blob
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+
+class BlobStore:
+    """
+    按内容去重的 resource 文件存储。
+
+    每个 blob 以 sha256 命名写入 root_dir/<前两位>/<sha256><扩展名>，相同内容只写一次；
+    哈希索引保存在新数据库的 memos_rollback_blob 表中，与 resource 记录在同一个事务内提交，中断后可继续使用。
+    文件名由内容决定，索引中没有而文件已存在（如分片迁移的其他分片或上一次运行已写入）时不再写入。
+    临时文件名带有进程号，多个分片迁移进程同时写入相同内容时互不干扰。
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        db_connection: sqlite3.Connection,
+    ):
+        """
+        :param root_dir: 存放 resource 文件的目录，需能被 v0.17.1 读取。
+        :param db_connection: 已连接的新数据库 (v0.17.1) 对象，用于保存哈希索引。
+        """
+        self.root_dir = Path(root_dir).resolve()
+        self.db_connection = db_connection
+        self.total_blobs = 0
+        self.unique_blobs = 0
+        self.total_bytes = 0
+        self.unique_bytes = 0
+
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        with self.db_connection:
+            self.db_connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memos_rollback_blob (
+                    sha256 TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    ref_count INTEGER NOT NULL DEFAULT 0
+                );
+                """
+            )
+
+    @property
+    def dedup_ratio(self) -> float:
+        """去重比：读取的总字节数 / 实际写入的字节数，没有写入时为 1。"""
+        return self.total_bytes / self.unique_bytes if self.unique_bytes else 1.0
+
+    def _lookup(self, sha256: str, size: int) -> Optional[str]:
+        """已写入过时增加引用计数并返回文件路径，否则返回 None。"""
+        self.total_blobs += 1
+        self.total_bytes += size
+        result = self.db_connection.execute(
+            "SELECT path FROM memos_rollback_blob WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        if result is None:
+            return None
+        self.db_connection.execute(
+            "UPDATE memos_rollback_blob SET ref_count = ref_count + 1 WHERE sha256 = ?", (sha256,)
+        )
+        return result[0]
+
+    def _register(self, sha256: str, size: int, path: Path, written: bool = True) -> str:
+        if written:
+            self.unique_blobs += 1
+            self.unique_bytes += size
+        self.db_connection.execute(
+            "INSERT INTO memos_rollback_blob (sha256, path, size, ref_count) VALUES (?, ?, ?, 1)",
+            (sha256, str(path), size)
+        )
+        return str(path)
+
+    def _get_path(self, sha256: str, filename: str) -> Path:
+        path = self.root_dir / sha256[:2] / f"{sha256}{Path(filename).suffix.lower()}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def store_resource_blob(
+        self,
+        db_connection: sqlite3.Connection,
+        resource_id: int,
+        blob_size: int,
+        filename: str = "",
+        chunk_size: int = migrate_blob_chunk_size,
+        sha256: Optional[str] = None,
+    ) -> str:
+        """
+        分块读取旧数据库中一条 resource 的 blob 并按内容去重写入文件。
+
+        先分块计算 sha256，只有未写入过的内容才再次分块读取并写入文件，重复内容不产生写入。
+        需在调用方的事务内调用，哈希索引随该事务提交。
+
+        :param db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+        :param resource_id: resource 的 id。
+        :param blob_size: blob 的字节数。
+        :param filename: 文件名，用于确定扩展名，默认为 ""
+        :param chunk_size: 每块的字节数，默认在 config.py 给出。
+        :param sha256: 已分块计算好的 sha256 十六进制字符串，默认为 None；给出时省去计算哈希的一次读取。
+        :return path: 保存该内容的文件路径。
+        """
+        if sha256 is None:
+            hasher = hashlib.sha256()
+            for data in iter_resource_blob(db_connection, resource_id, blob_size, chunk_size):
+                hasher.update(data)
+            digest = hasher.hexdigest()
+        else:
+            digest = sha256
+
+        path = self._lookup(digest, blob_size)
+        if path is not None:
+            return path
+
+        path = self._get_path(digest, filename)
+        if path.is_file():
+            return self._register(digest, blob_size, path, written=False)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            for data in iter_resource_blob(db_connection, resource_id, blob_size, chunk_size):
+                f.write(data)
+        os.replace(temp_path, path)
+        return self._register(digest, blob_size, path)
+
+    def store_bytes(
+        self,
+        blob: bytes,
+        sha256: str,
+        filename: str = "",
+    ) -> str:
+        """
+        按内容去重写入已在内存中的 blob，用于已计算过 sha256 的并行迁移。需在调用方的事务内调用。
+
+        :param blob: 二进制数据
+        :param sha256: blob 的 sha256 十六进制字符串
+        :param filename: 文件名，用于确定扩展名，默认为 ""
+        :return path: 保存该内容的文件路径。
+        """
+        path = self._lookup(sha256, len(blob))
+        if path is not None:
+            return path
+
+        path = self._get_path(sha256, filename)
+        if path.is_file():
+            return self._register(sha256, len(blob), path, written=False)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(blob)
+        os.replace(temp_path, path)
+        return self._register(sha256, len(blob), path)
+
+    def counts(self) -> dict:
+        """返回可累加的去重计数，用于汇总分片迁移各工作进程的统计。"""
+        return {
+            "total_blobs": self.total_blobs,
+            "unique_blobs": self.unique_blobs,
+            "total_bytes": self.total_bytes,
+            "unique_bytes": self.unique_bytes,
+        }
+
+    def add_counts(self, counts: dict) -> None:
+        """累加其他 BlobStore 的 counts()。"""
+        self.total_blobs += counts["total_blobs"]
+        self.unique_blobs += counts["unique_blobs"]
+        self.total_bytes += counts["total_bytes"]
+        self.unique_bytes += counts["unique_bytes"]
+
+    def report(self) -> dict:
+        """记录并返回去重统计。"""
+        stats = {**self.counts(), "dedup_ratio": self.dedup_ratio}
+        log.info(
+            f"resource 去重：{self.total_blobs} 个 blob 中新写入 {self.unique_blobs} 个，"
+            f"{self.total_bytes} 字节中新写入 {self.unique_bytes} 字节，去重比 {self.dedup_ratio:.2f}。"
+        )
+        return stats
@@ -1,14 +1,48 @@
 # **** 文件地址配置 **** #
 log_path = "./log/"
+# 日志由后台线程写入文件，不阻塞迁移循环
+log_enqueue = True
+# 逐条记录的日志（如每条 memo 的进度）两次输出之间的最短间隔（秒），为 0 时不限流
+log_sample_interval_s = 5
 old_database_path_v0210 = ""
 new_database_path_v0171 = ""
 new_database_schema_path_v0171 = "./assets/memos_0171_struct.sql"
+old_resource_dir_v0210 = ""  # v0.21.0 的数据目录，用于把本地存储 resource 的相对路径解析为本地文件路径
+resource_dedup_dir = ""  # 非空时按内容去重，把 resource 的 blob 写入该目录并以 internal_path 引用，需能被 v0.17.1 读取；"attach" 模式不支持
 
 # **** 用户配置 **** #
 creator_id = 1  # 暂时只支持一个用户的操作
 
+# **** 迁移配置 **** #
+migrate_mode = "bulk"  # "row" - 逐条迁移 "bulk" - 分块批量迁移 "attach" - ATTACH 后在 SQLite 内部迁移 "parallel" - 多线程读取 resource "sharded" - 多进程分片转换后合并 "delta" - 增量同步
+migrate_chunk_size = 1000  # 批量迁移时每个事务写入的记录数
+migrate_blob_chunk_size = 1024 * 1024  # 复制 resource blob 时每块的字节数
+migrate_batch_bytes = 64 * 1024 * 1024  # 并行迁移时每批 blob 的最大总字节数；大于 migrate_blob_chunk_size 的 blob 不整体读入内存，分块复制
+source_connection_profile = "read_only"  # 读取旧数据库的连接配置，见 database.CONNECTION_PROFILES
+target_connection_profile = "bulk_load"  # 写入新数据库的连接配置，"default" 为 SQLite 默认设置
+resource_workers = 4  # 并行迁移 resource 时的读取线程数
+resource_queue_size = 64  # 读取线程与写入线程之间队列的最大长度
+metrics_interval_s = 10  # 迁移指标（速率、阶段延迟、预计剩余时间）的输出间隔，单位秒
+metrics_json_path = ""  # 非空时同时把迁移指标写入该 JSON 文件
+migrate_tags = True  # 是否从 memo 中提取 #标签 写入 v0.17.1 的 tag 表
+shard_workers = 4  # "sharded" 模式的进程数即分片数，最多 10（SQLite 最多同时 ATTACH 10 个数据库）
+shard_temp_dir = ""  # "sharded" 模式存放分片临时数据库的目录，为空时使用新数据库所在的目录
+# 除 memo 和 resource 以外按 table_mapping.TABLE_MAPPINGS 迁移的表，为空时不迁移
+migrate_tables = ["system_setting", "user", "user_setting", "memo_organizer", "memo_relation", "activity", "storage"]
+
+# **** 界面配置 **** #
+memo_prefetch_count = 20  # 浏览 memo 时后台预读的条数
+memo_cache_size = 200  # 浏览 memo 时缓存的最大条数，须大于 memo_prefetch_count
+thumbnail_cache_dir = "./cache/thumbnails/"  # 图片缩略图的缓存目录
+thumbnail_size = 200  # 缩略图的高度（像素），与图片栏的高度一致
+thumbnail_workers = 2  # 生成缩略图的线程数
+submit_journal_path = "./log/submit_journal.jsonl"  # 提交队列的日志文件，保存尚未写入数据库的 memo
+submit_flush_interval_s = 2  # 提交的 memo 最多等待该秒数后合并写入数据库
+submit_max_batch = 50  # 提交队列达到该条数时立即写入
+memo_search_index_path = ""  # 非空时在迁移结束后建立 memo 内容的全文索引（单独的数据库文件），供界面搜索
+
 # **** 标签配置 **** #
-tags_dict = {  # 暂不支持三级标签
+tags_dict = {  # 值为字符串时是标签，为字典时是下一级分组，支持任意层级
     "Tag1": {
         "Tag1-1": "#Tag1/Tag1-1 ",
         "Tag1-2": "#Tag1/Tag1-2 ",
@@ -1,15 +1,83 @@
+import atexit
+import re
 import sqlite3
+import threading
+import time
+from pathlib import Path
 from config import old_database_path_v0210, new_database_path_v0171, new_database_schema_path_v0171, creator_id
+from config import migrate_chunk_size, migrate_blob_chunk_size, migrate_batch_bytes
+from config import source_connection_profile, target_connection_profile
+from memo_tags import TagCollector
 from utils import is_file_exists, ensure_directory_exists_for_file, get_configured_logger
-from typing import Optional, List
+from typing import Optional, List, Iterator, Callable, Dict
 
 log = get_configured_logger()
 
+# v0.21.0 resource 的 storage_type/reference 到 v0.17.1 external_link/internal_path 的映射：
+# LOCAL 的 reference 是本地文件路径，DATABASE 的数据在 blob 中，其余（S3、外部链接）的 reference 是链接。
+RESOURCE_EXTERNAL_LINK_SQL = "CASE WHEN storage_type IN ('LOCAL', 'DATABASE') THEN '' ELSE reference END"
+RESOURCE_INTERNAL_PATH_SQL = "CASE WHEN storage_type = 'LOCAL' THEN reference ELSE '' END"
+
+# 不读取 blob 的 resource 元数据列，blob 只给出长度，由 copy_resource_blob 分块复制
+RESOURCE_METADATA_COLUMNS_SQL = (
+    "id, created_ts, updated_ts, filename, length(blob), "
+    f"{RESOURCE_EXTERNAL_LINK_SQL}, type, size, {RESOURCE_INTERNAL_PATH_SQL}, memo_id"
+)
+
+# 连接配置：pragmas 在打开连接时设置，restore_pragmas 在 finish_connection 时恢复。
+# bulk_load 用于迁移时写入新数据库：WAL 保证进程崩溃时数据库不会损坏，synchronous=OFF 省去 fsync，
+#   结束时执行 checkpoint 并恢复为 synchronous=FULL 和 DELETE 日志模式；
+# read_only 用于读取旧数据库：以 mode=ro 打开，使用 mmap 读取；
+# read_only_worker 用于并行读取的多个线程或进程：每个连接的页缓存和 mmap 都单独计入内存，
+#   大 blob 只顺序读取一次，缓存几乎没有作用，因此不使用 mmap、只保留很小的页缓存。
+CONNECTION_PROFILES = {
+    "default": {
+        "read_only": False,
+        "pragmas": {},
+        "restore_pragmas": {},
+    },
+    "bulk_load": {
+        "read_only": False,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -256 * 1024,  # 负数单位为 KiB，即 256 MiB
+            "temp_store": "MEMORY",
+        },
+        "restore_pragmas": {
+            "synchronous": "FULL",
+            "journal_mode": "DELETE",
+        },
+    },
+    "read_only": {
+        "read_only": True,
+        "pragmas": {
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64 * 1024,
+            "query_only": "ON",
+        },
+        "restore_pragmas": {},
+    },
+    "read_only_worker": {
+        "read_only": True,
+        "pragmas": {
+            "mmap_size": 0,
+            "cache_size": -4 * 1024,
+            "query_only": "ON",
+        },
+        "restore_pragmas": {},
+    },
+}
+
+# Connection.blobopen 需要 Python 3.11+，更早的版本读取时退回到 substr，复制时整体读写一次 blob
+HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
 
 def create_database(
         db_path: str = new_database_path_v0171,
         schema_path: str = new_database_schema_path_v0171,
         overwrite: bool = False,  # 是否覆盖已存在的数据库文件
+        defer_indexes: bool = False,  # 是否推迟建立 UNIQUE 约束（索引）
 ) -> None:
     """
     创建一个新的 SQLite 数据库，并使用给定的 SQL 文件初始化它。
@@ -17,6 +85,8 @@ def create_database(
     :param db_path: 新数据库的路径，默认为 new_database_path_v0171。
     :param schema_path: 包含 SQL 初始化脚本的文件，默认为 new_database_schema_path_v0171。
     :param overwrite: 如果数据库文件已存在，是否覆盖，默认为 False。
+    :param defer_indexes: 是否只创建不带 UNIQUE 约束的表，默认为 False；
+        为 True 时，批量写入完成后需调用 build_deferred_indexes 建立约束。
     """
     if is_file_exists(db_path) and not overwrite:
         log.info(f"数据库文件 {db_path} 已存在，继续使用。")
@@ -24,44 +94,308 @@ def create_database(
     ensure_directory_exists_for_file(db_path)
 
     try:
-        with sqlite3.connect(db_path) as conn:
+        if defer_indexes:
+            sql_script = "\n".join(split_schema(schema_path)[0])
+        else:
             with open(schema_path, 'r') as f:
                 sql_script = f.read()
-            conn.executescript(sql_script)
-            log.info(f"新数据库已创建：{db_path}")
+        conn = sqlite3.connect(db_path)
+        try:
+            with conn:
+                conn.executescript(sql_script)
+        finally:
+            conn.close()
+        log.info(f"新数据库已创建：{db_path}" + ("（推迟建立索引）" if defer_indexes else ""))
     except sqlite3.Error as e:
         log.error(f"创建数据库时发生错误：{e}")
 
 
+def split_schema(
+        schema_path: str = new_database_schema_path_v0171,
+) -> tuple[List[str], Dict[str, str]]:
+    """
+    把 SQL 初始化脚本拆分为不带 UNIQUE 约束的建表语句和需要推迟建立的原始建表语句。
+
+    UNIQUE 约束会隐式建立索引，批量写入时逐行维护索引很慢；拆分后先建立不带约束的表，
+    写入完成后再由 build_deferred_indexes 按原始语句重建。
+
+    :param schema_path: 包含 SQL 初始化脚本的文件，默认为 new_database_schema_path_v0171。
+    :return (statements, deferred): 可直接执行的语句列表，以及表名到原始建表语句的字典（仅含带 UNIQUE 约束的表）。
+    """
+    with open(schema_path, 'r') as f:
+        lines = f.read().splitlines(keepends=True)
+
+    statements = []
+    deferred = {}
+    buffer = ""
+    for line in lines:
+        buffer += line
+        if not sqlite3.complete_statement(buffer):
+            continue
+        statement = buffer.strip()
+        buffer = ""
+        if re.match(r"(BEGIN|COMMIT|END)\b", statement, re.IGNORECASE):
+            continue
+
+        match = re.match(r'CREATE TABLE (?:IF NOT EXISTS )?"?(\w+)"?', statement, re.IGNORECASE)
+        if match and re.search(r"\bUNIQUE\b", statement, re.IGNORECASE):
+            deferred[match.group(1)] = statement
+            # 先去掉表级约束 ,UNIQUE(...)，再去掉列级约束 UNIQUE
+            statement = re.sub(r",\s*UNIQUE\s*\([^)]*\)", "", statement, flags=re.IGNORECASE)
+            statement = re.sub(r"\s+UNIQUE\b", "", statement, flags=re.IGNORECASE)
+        statements.append(statement)
+
+    return statements, deferred
+
+
+def _get_schema_objects(db_connection: sqlite3.Connection) -> Dict[str, tuple]:
+    cursor = db_connection.execute(
+        "SELECT name, type, tbl_name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_sequence'"
+    )
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def _get_reference_schema(schema_path: str) -> Dict[str, tuple]:
+    """在内存数据库中执行原始 SQL 初始化脚本，返回其中的全部对象。"""
+    reference_connection = sqlite3.connect(":memory:")
+    try:
+        with open(schema_path, 'r') as f:
+            reference_connection.executescript(f.read())
+        return _get_schema_objects(reference_connection)
+    finally:
+        reference_connection.close()
+
+
+def build_deferred_indexes(
+        db_connection: sqlite3.Connection,
+        schema_path: str = new_database_schema_path_v0171,
+) -> int:
+    """
+    为以 defer_indexes=True 创建的数据库建立推迟的 UNIQUE 约束（索引）。
+
+    对表结构与原始建表语句不同的表，在一个事务内：改名、按原始语句建表、
+    以 INSERT OR IGNORE 一次性导入（重复记录保留先写入的一条）、删除旧表。可以重复调用。
+
+    :param db_connection: 已连接的新数据库对象，调用时不能处于事务中。
+    :param schema_path: 包含 SQL 初始化脚本的文件，默认为 new_database_schema_path_v0171。
+    :return rebuilt: 重建的表数量。
+    """
+    deferred = split_schema(schema_path)[1]
+    reference = _get_reference_schema(schema_path)
+    current = _get_schema_objects(db_connection)
+
+    rebuilt = 0
+    with db_connection:
+        for table, statement in deferred.items():
+            if table not in current or current[table] == reference[table]:
+                continue
+            staging_table = f"{table}__deferred"
+            db_connection.execute(f'ALTER TABLE "{table}" RENAME TO "{staging_table}"')
+            db_connection.execute(statement)
+            db_connection.execute(f'INSERT OR IGNORE INTO "{table}" SELECT * FROM "{staging_table}"')
+            db_connection.execute(f'DROP TABLE "{staging_table}"')
+            rebuilt += 1
+            log.debug(f"已建立表 {table} 的约束。")
+
+    log.info(f"已建立 {rebuilt} 张表的推迟约束。")
+    return rebuilt
+
+
+def verify_schema(
+        db_connection: sqlite3.Connection,
+        schema_path: str = new_database_schema_path_v0171,
+) -> bool:
+    """
+    检查数据库中的表和索引是否与 SQL 初始化脚本创建的完全一致。
+
+    :param db_connection: 已连接的新数据库对象。
+    :param schema_path: 包含 SQL 初始化脚本的文件，默认为 new_database_schema_path_v0171。
+    :return bool: 一致时返回 True；否则记录差异并返回 False。
+    """
+    reference = _get_reference_schema(schema_path)
+    current = _get_schema_objects(db_connection)
+    # 迁移工具自己的表（如 memos_rollback）不参与比较
+    current = {name: value for name, value in current.items() if not value[1].startswith("memos_rollback")}
+
+    if current == reference:
+        return True
+    for name in sorted(set(reference) | set(current)):
+        if reference.get(name) != current.get(name):
+            log.error(f"数据库结构与 {schema_path} 不一致：{name}")
+    return False
+
+
+def _get_connection_profile(profile: str) -> dict:
+    if profile not in CONNECTION_PROFILES:
+        log.error(f"Invalid connection profile: {profile}")
+        raise ValueError("Invalid connection profile.")
+    return CONNECTION_PROFILES[profile]
+
+
+def open_connection(
+        db_path: str,
+        profile: str = "default",
+        check_same_thread: bool = True,
+) -> sqlite3.Connection:
+    """
+    按连接配置打开 SQLite 数据库。
+
+    :param db_path: 数据库的路径。
+    :param profile: 连接配置名称，见 CONNECTION_PROFILES，默认为 "default"。
+    :param check_same_thread: 是否只允许在创建连接的线程中使用，默认为 True。
+    :return conn: 已设置好 pragma 的连接对象。
+    """
+    connection_profile = _get_connection_profile(profile)
+    if connection_profile["read_only"]:
+        uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        db_connection = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    else:
+        db_connection = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+
+    for name, value in connection_profile["pragmas"].items():
+        db_connection.execute(f"PRAGMA {name} = {value}")
+    return db_connection
+
+
+def finish_connection(
+        db_connection: sqlite3.Connection,
+        profile: str = "default",
+) -> None:
+    """
+    结束按连接配置打开的连接：WAL 模式下先执行 checkpoint，再恢复安全的 pragma。连接本身不会关闭。
+
+    :param db_connection: 由 open_connection 打开的连接对象。
+    :param profile: 打开时使用的连接配置名称，默认为 "default"。
+    """
+    connection_profile = _get_connection_profile(profile)
+    if not connection_profile["restore_pragmas"]:
+        return
+
+    db_connection.commit()
+    journal_mode = db_connection.execute("PRAGMA journal_mode").fetchone()[0]
+    if journal_mode.lower() == "wal":
+        db_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    for name, value in connection_profile["restore_pragmas"].items():
+        try:
+            db_connection.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.OperationalError as e:
+            # 还有其他连接打开同一个数据库时无法切换日志模式，数据此时已完成 checkpoint
+            log.warning(f"恢复 PRAGMA {name} = {value} 失败：{e}")
+    log.info(f"已完成连接配置 {profile} 的收尾。")
+
+
 def connect_database(
         old_db_path: str = old_database_path_v0210,
         new_db_path: str = new_database_path_v0171,
+        old_profile: str = source_connection_profile,
+        new_profile: str = target_connection_profile,
 ) -> tuple[sqlite3.Connection, sqlite3.Connection]:
     """
     连接到两个 SQLite 数据库。
 
     :param old_db_path: 旧数据库的路径，默认为 old_database_path_v0210。
     :param new_db_path: 新数据库的路径，默认为 new_database_path_v0171。
+    :param old_profile: 旧数据库的连接配置，默认在 config.py 给出。
+    :param new_profile: 新数据库的连接配置，默认在 config.py 给出；用完后应调用 finish_connection。
     :return (old_conn, new_conn): 一个包含两个连接对象的元组(old_conn, new_conn)。如果连接失败，返回 None。
     """
-    old_conn_v0210 = sqlite3.connect(old_db_path)
-    new_conn_v0171 = sqlite3.connect(new_db_path)
+    old_conn_v0210 = open_connection(old_db_path, old_profile)
+    new_conn_v0171 = open_connection(new_db_path, new_profile)
     return old_conn_v0210, new_conn_v0171
 
 
+def connect_read_only(
+        db_path: str = old_database_path_v0210,
+        profile: str = "read_only",
+) -> sqlite3.Connection:
+    """
+    以只读的连接配置连接 SQLite 数据库，可在其他线程中使用。
+
+    :param db_path: 数据库的路径，默认为 old_database_path_v0210。
+    :param profile: 连接配置名称，默认为 "read_only"；多个线程或进程并行读取时使用 "read_only_worker"。
+    :return conn: 只读的连接对象。
+    """
+    return open_connection(db_path, profile, check_same_thread=False)
+
+
+class ConnectionRegistry:
+    """
+    按名称管理可复用的数据库连接。
+
+    连接在首次 get 时才打开，之后复用同一个连接，close / close_all 时确定性地关闭；
+    导入模块时不会打开任何连接。连接以 check_same_thread=False 打开，可以在 Flet 的事件线程中使用。
+    """
+
+    def __init__(self, openers: Dict[str, Callable[[], sqlite3.Connection]]):
+        """
+        :param openers: 连接名称到打开函数的映射。
+        """
+        self._openers = openers
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> sqlite3.Connection:
+        """获取名为 name 的连接，不存在时打开。"""
+        with self._lock:
+            if name not in self._connections:
+                if name not in self._openers:
+                    log.error(f"Invalid connection name: {name}")
+                    raise ValueError("Invalid connection name.")
+                self._connections[name] = self._openers[name]()
+                log.debug(f"已打开数据库连接：{name}")
+            return self._connections[name]
+
+    def close(self, name: str) -> None:
+        """关闭名为 name 的连接，未打开时什么也不做。"""
+        with self._lock:
+            db_connection = self._connections.pop(name, None)
+        if db_connection is not None:
+            db_connection.close()
+            log.debug(f"已关闭数据库连接：{name}")
+
+    def close_all(self) -> None:
+        """关闭所有已打开的连接。"""
+        for name in list(self._connections):
+            self.close(name)
+
+    def __enter__(self) -> "ConnectionRegistry":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close_all()
+
+
+def _open_configured_database(db_path: str, profile: str) -> sqlite3.Connection:
+    """打开 config.py 中配置的数据库，路径为空时报错，而不是打开一个临时数据库。"""
+    if not db_path:
+        log.error("数据库路径为空，请在 config.py 中配置。")
+        raise ValueError("Database path is not configured.")
+    return open_connection(db_path, profile, check_same_thread=False)
+
+
+# 默认的连接：v0210 为旧数据库，只读；v0171 为新数据库，供界面等逐条读写使用，保持默认的安全设置
+connections = ConnectionRegistry({
+    "v0210": lambda: _open_configured_database(old_database_path_v0210, "read_only"),
+    "v0171": lambda: _open_configured_database(new_database_path_v0171, "default"),
+})
+atexit.register(connections.close_all)
+
+
 def confirmed_memo_id(
         memo_id: int,
-        db_connection: sqlite3.Connection = connect_database()[0],
+        db_connection: Optional[sqlite3.Connection] = None,
         operation: str = "gte",  # "gte" - 大于等于 "lte" - 小于等于
 ) -> int:
     """
     检查 memo_id 是否存在于数据库的 memo 表中。如果不存在，则返回下一个存在的 memo_id。
 
     :param memo_id: memo_id
-    :param db_connection: 已连接的 SQLite 数据库对象，默认为 old_conn_v0210。
+    :param db_connection: 已连接的 SQLite 数据库对象，默认为 connections 中的 v0210 连接。
     :param operation: 操作符，默认为 "gte"，表示大于等于。可选值有 "lte"，表示小于等于
     :return memo_id: 如果 memo_id 存在，返回原 memo_id；如果不存在，返回下一个存在的 memo_id；找不到就报错。
     """
+    if db_connection is None:
+        db_connection = connections.get("v0210")
 
     cursor = db_connection.cursor()
 
@@ -104,15 +438,17 @@ def confirmed_memo_id(
 
 def get_memo_record(
     memo_id: int,
-    db_connection: sqlite3.Connection = connect_database()[0],
+    db_connection: Optional[sqlite3.Connection] = None,
 ) -> dict:
     """
     获取指定 memo_id 的 memo 记录。
 
     :param memo_id: memo_id
-    :param db_connection: 已连接的 SQLite 数据库对象，默认为 old_conn_v0210。
+    :param db_connection: 已连接的 SQLite 数据库对象，默认为 connections 中的 v0210 连接。
     :return memo_record: 包含 memo 记录的字典。
     """
+    if db_connection is None:
+        db_connection = connections.get("v0210")
     memo_id = confirmed_memo_id(memo_id, db_connection)
 
     cursor = db_connection.cursor()
@@ -135,6 +471,122 @@ def get_memo_record(
     }
 
 
+def iter_memo_records(
+    db_connection: sqlite3.Connection,
+    after_memo_id: int = 0,
+    batch_size: int = migrate_chunk_size,
+) -> Iterator[dict]:
+    """
+    按 id 升序遍历 memo 记录，每个存在的 memo 只产出一次。
+
+    使用 keyset 分页（WHERE id > ? ORDER BY id LIMIT n），不需要预先知道 id 的上下界，
+    也不需要对每个 id 调用 confirmed_memo_id。
+
+    :param db_connection: 已连接的 SQLite 数据库对象。
+    :param after_memo_id: 从大于该 id 的 memo 开始遍历，默认为 0，即从头开始；断点续传时传入最后完成的 memo_id。
+    :param batch_size: 每次查询读取的记录数，默认在 config.py 给出。
+    :return memo_record: 逐条产出与 get_memo_record 格式相同的字典。
+    """
+    if batch_size <= 0:
+        log.error(f"Invalid batch_size: {batch_size}")
+        raise ValueError("Invalid batch_size.")
+
+    cursor = db_connection.cursor()
+    while True:
+        cursor.execute(
+            """
+            SELECT id, creator_id, created_ts, updated_ts, content
+            FROM memo
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (after_memo_id, batch_size)
+        )
+        result = cursor.fetchall()
+        if not result:
+            return
+
+        for row in result:
+            yield {
+                "memo_id": row[0],
+                "creator_id": row[1],
+                "created_ts": row[2],
+                "updated_ts": row[3],
+                "content": row[4],
+            }
+        after_memo_id = result[-1][0]
+
+
+def iter_memo_resource_groups(
+    db_connection: sqlite3.Connection,
+    after_memo_id: int = 0,
+    batch_size: int = migrate_chunk_size,
+) -> Iterator[tuple]:
+    """
+    按 memo_id 升序同时遍历 memo 和 resource（归并连接），每个 memo 与它的 resource 一起产出。
+
+    resource.memo_id 上没有索引，逐个 memo 查询 resource 每次都要扫描全表；
+    这里只对 resource 的元数据（不含 blob）按 memo_id 排序一次，再与按 id 升序的 memo 并行前进，总工作量与数据量成线性。
+
+    :param db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param after_memo_id: 从大于该 id 的 memo 开始遍历，默认为 0，即从头开始；为 0 时还会产出 memo_id 为 NULL 的 resource。
+    :param batch_size: 每次查询读取的记录数，默认在 config.py 给出。
+    :return (memo_record, resource_rows): memo_record 与 iter_memo_records 产出的相同，
+        resource_rows 为以 RESOURCE_METADATA_COLUMNS_SQL 读取的行的列表，可交给 write_resource_rows；
+        memo_id 为 NULL 或对应的 memo 不存在的 resource 以 memo_record 为 None 的组产出，每组最多 batch_size 行。
+    """
+    resource_cursor = db_connection.cursor()
+    resource_cursor.execute(
+        f"""
+        SELECT {RESOURCE_METADATA_COLUMNS_SQL}
+        FROM resource
+        WHERE memo_id > ? OR (? = 0 AND memo_id IS NULL)
+        ORDER BY memo_id ASC, id ASC
+        """,
+        (after_memo_id, after_memo_id)
+    )
+
+    def iter_resource_rows():
+        while True:
+            chunk = resource_cursor.fetchmany(batch_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    resource_rows = iter_resource_rows()
+    pending = next(resource_rows, None)
+
+    for memo_record in iter_memo_records(db_connection, after_memo_id, batch_size):
+        memo_id = memo_record["memo_id"]
+        # 排在当前 memo 之前的 resource 没有对应的 memo（NULL 排在最前）
+        orphans = []
+        while pending is not None and (pending[9] is None or pending[9] < memo_id):
+            orphans.append(pending)
+            pending = next(resource_rows, None)
+            if len(orphans) >= batch_size:
+                yield None, orphans
+                orphans = []
+        if orphans:
+            yield None, orphans
+
+        group = []
+        while pending is not None and pending[9] == memo_id:
+            group.append(pending)
+            pending = next(resource_rows, None)
+        yield memo_record, group
+
+    orphans = []
+    while pending is not None:
+        orphans.append(pending)
+        pending = next(resource_rows, None)
+        if len(orphans) >= batch_size:
+            yield None, orphans
+            orphans = []
+    if orphans:
+        yield None, orphans
+
+
 def upsert_memo_record(
     memo_id: int,
     created_ts: int,
@@ -143,7 +595,8 @@ def upsert_memo_record(
     creator_id: int = creator_id,
     row_status: str = "NORMAL",
     visibility: str = "PRIVATE",
-    db_connection: sqlite3.Connection = connect_database()[1],
+    db_connection: Optional[sqlite3.Connection] = None,
+    commit: bool = True,
 ) -> None:
     """
     插入或更新 memo 记录。
@@ -155,8 +608,11 @@ def upsert_memo_record(
     :param creator_id: 创建者 ID，默认在 config.py 给出。
     :param row_status: 行状态，默认为 "NORMAL"
     :param visibility: 可见性，默认为 "PRIVATE"
-    :param db_connection: 已连接的 SQLite 数据库对象，默认为 new_conn_v0171。
+    :param db_connection: 已连接的 SQLite 数据库对象，默认为 connections 中的 v0171 连接。
+    :param commit: 是否立即提交，默认为 True；为 False 时由调用方在同一个事务内提交。
     """
+    if db_connection is None:
+        db_connection = connections.get("v0171")
     cursor = db_connection.cursor()
     cursor.execute(
         """
@@ -165,24 +621,29 @@ def upsert_memo_record(
         """,
         (memo_id, created_ts, updated_ts, creator_id, row_status, visibility, content)
     )
-    db_connection.commit()
+    if commit:
+        db_connection.commit()
 
 
 def get_resource_record(
     memo_id: int,
     version: str = "v0171",
-    db_connection: sqlite3.Connection = connect_database()[1],
-    another_db_connection: sqlite3.Connection = connect_database()[0],
+    db_connection: Optional[sqlite3.Connection] = None,
+    another_db_connection: Optional[sqlite3.Connection] = None,
 ) -> List[dict]:
     """
     获取指定 memo_id 的 resource 记录。
 
     :param memo_id: memo_id
     :param version: 数据库版本，默认为 "v0171"，注意与传入的 db_connection 对象相对应。
-    :param db_connection: 已连接的 SQLite 数据库对象，默认为 new_conn_v0171。
-    :param another_db_connection: 另一个数据库连接对象，默认为 old_conn_v0210，用于确认 memo_id 是否存在。
+    :param db_connection: 已连接的 SQLite 数据库对象，默认为 connections 中的 v0171 连接。
+    :param another_db_connection: 另一个数据库连接对象，默认为 connections 中的 v0210 连接，用于确认 memo_id 是否存在。
     :return resource_record_list: 包含 resource 记录的字典的列表。
     """
+    if db_connection is None:
+        db_connection = connections.get("v0171")
+    if another_db_connection is None:
+        another_db_connection = connections.get("v0210")
     memo_id = confirmed_memo_id(memo_id, another_db_connection)
 
     cursor = db_connection.cursor()
@@ -254,7 +715,7 @@ def insert_resource_record(
     size: int = 0,
     internal_path: str = "",
     version: str = "v0171",
-    db_connection: sqlite3.Connection = connect_database()[1],
+    db_connection: Optional[sqlite3.Connection] = None,
 ) -> None:
     """
     插入 resource 记录。
@@ -269,11 +730,13 @@ def insert_resource_record(
     :param size: 文件大小，默认为 0
     :param internal_path: 本地文件地址，默认为 ""
     :param version: 数据库版本，默认为 "v0171"，暂不支持 "v0210"。
-    :param db_connection: 已连接的 SQLite 数据库对象，默认为 new_conn_v0171。
+    :param db_connection: 已连接的 SQLite 数据库对象，默认为 connections 中的 v0171 连接。
     """
     if version != "v0171":
         log.error(f"Invalid version: {version}")
         raise ValueError("Invalid version.")
+    if db_connection is None:
+        db_connection = connections.get("v0171")
 
     cursor = db_connection.cursor()
     cursor.execute(
@@ -284,3 +747,648 @@ def insert_resource_record(
         (memo_id, created_ts, updated_ts, filename, blob, external_link, resource_type, size, internal_path)
     )
     db_connection.commit()
+
+
+def migrate_memo_records(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    chunk_size: int = migrate_chunk_size,
+    after_memo_id: int = 0,
+    creator_id: int = creator_id,
+    row_status: str = "NORMAL",
+    visibility: str = "PRIVATE",
+    process=None,
+    metrics=None,
+) -> dict:
+    """
+    批量迁移 memo 记录。
+
+    从旧数据库以 fetchmany 分块流式读取 memo，每块在一个事务内用 executemany 写入新数据库，
+    避免逐条读取和逐条提交（每次提交都会触发一次 fsync）。
+
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param chunk_size: 每个事务写入的 memo 数量，默认在 config.py 给出。
+    :param after_memo_id: 只迁移 id 大于该值的 memo，默认为 0；断点续传时传入最后完成的 memo_id。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param row_status: 行状态，默认为 "NORMAL"
+    :param visibility: 可见性，默认为 "PRIVATE"
+    :param process: process.Process 对象，默认为 None；给出时每块的断点与该块在同一个事务内提交，
+        其连接须为 new_db_connection。
+    :param metrics: metrics.MigrationMetrics 对象，默认为 None；给出时记录速率和各阶段耗时。
+    :return stats: 包含迁移行数 rows、最后迁移的 last_memo_id（未迁移时等于 after_memo_id）、
+        耗时 elapsed_s（秒）和速率 rows_per_sec 的字典。
+    """
+    if chunk_size <= 0:
+        log.error(f"Invalid chunk_size: {chunk_size}")
+        raise ValueError("Invalid chunk_size.")
+    if process is not None and process.db_connection is not new_db_connection:
+        log.error("process 的连接与 new_db_connection 不同，无法在同一个事务内记录断点。")
+        raise ValueError("process must use new_db_connection.")
+
+    start_time = time.perf_counter()
+    rows = 0
+    last_memo_id = after_memo_id
+
+    if metrics is not None:
+        total_rows, source_max_id = old_db_connection.execute(
+            "SELECT COUNT(*), IFNULL(MAX(id), 0) FROM memo WHERE id > ?", (after_memo_id,)
+        ).fetchone()
+        metrics.set_target("memo", total_rows, source_max_id)
+
+    # 常量列直接在 SELECT 中给出，读出的行即可原样交给 executemany
+    read_cursor = old_db_connection.cursor()
+    read_cursor.execute(
+        """
+        SELECT id, created_ts, updated_ts, ?, ?, ?, content
+        FROM memo
+        WHERE id > ?
+        ORDER BY id ASC
+        """,
+        (creator_id, row_status, visibility, after_memo_id)
+    )
+    while True:
+        read_start = time.perf_counter()
+        chunk = read_cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        write_start = time.perf_counter()
+        with new_db_connection:
+            new_db_connection.executemany(
+                """
+                INSERT OR REPLACE INTO memo (id, created_ts, updated_ts, creator_id, row_status, visibility, content)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                chunk
+            )
+            if process is not None:
+                process.checkpoint(chunk[-1][0])
+        rows += len(chunk)
+        last_memo_id = chunk[-1][0]
+
+        if metrics is not None:
+            metrics.record_stage("read", write_start - read_start)
+            metrics.record_stage("write", time.perf_counter() - write_start)
+            metrics.add("memo", len(chunk), sum(len(row[6]) for row in chunk), last_memo_id)
+            metrics.maybe_emit()
+
+    elapsed_s = time.perf_counter() - start_time
+    rows_per_sec = rows / elapsed_s if elapsed_s > 0 else 0
+    log.info(f"批量迁移 memo 完成：{rows} 条，用时 {elapsed_s:.2f} 秒，{rows_per_sec:.0f} 条/秒。")
+
+    return {
+        "rows": rows,
+        "last_memo_id": last_memo_id,
+        "elapsed_s": elapsed_s,
+        "rows_per_sec": rows_per_sec,
+    }
+
+
+def migrate_tag_records(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    batch_size: int = migrate_chunk_size,
+    creator_id: int = creator_id,
+) -> dict:
+    """
+    从旧数据库的 memo 中提取标签，写入新数据库的 tag 表。
+
+    优先使用 v0.21.0 memo.tags 列中已解析好的标签，为空时再扫描 content 中的 #标签；
+    标签在内存中去重，最后在一个事务内用 INSERT OR IGNORE 一次性写入，可重复执行。
+
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param batch_size: 每次从旧数据库读取的 memo 数量，默认在 config.py 给出。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :return stats: 包含扫描的 memo 数量 memos、标签数量 tags 和耗时 elapsed_s（秒）的字典。
+    """
+    if batch_size <= 0:
+        log.error(f"Invalid batch_size: {batch_size}")
+        raise ValueError("Invalid batch_size.")
+
+    start_time = time.perf_counter()
+    collector = TagCollector()
+    cursor = old_db_connection.cursor()
+    cursor.execute("SELECT content, tags FROM memo")
+    while True:
+        chunk = cursor.fetchmany(batch_size)
+        if not chunk:
+            break
+        for content, tags_json in chunk:
+            collector.add_memo(content, tags_json)
+
+    with new_db_connection:
+        new_db_connection.executemany(
+            "INSERT OR IGNORE INTO tag (name, creator_id) VALUES (?, ?)",
+            ((name, creator_id) for name in sorted(collector.names)),
+        )
+
+    elapsed_s = time.perf_counter() - start_time
+    log.info(f"标签提取完成：扫描 {collector.memo_count} 条 memo，{len(collector)} 个标签，用时 {elapsed_s:.2f} 秒。")
+
+    return {
+        "memos": collector.memo_count,
+        "tags": len(collector),
+        "elapsed_s": elapsed_s,
+    }
+
+
+def migrate_records_by_attach(
+    new_db_connection: sqlite3.Connection,
+    old_db_path: str = old_database_path_v0210,
+    creator_id: int = creator_id,
+    row_status: str = "NORMAL",
+    visibility: str = "PRIVATE",
+    include_resources: bool = True,
+) -> dict:
+    """
+    以 ATTACH 方式迁移 memo 和 resource 记录。
+
+    将旧数据库 ATTACH 到新数据库的连接上，用 INSERT ... SELECT 在 SQLite 内部完成复制，
+    记录不会经过 Python 对象。与 migrate_memo_records 并列，可互相对比性能。
+
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象，调用时不能处于事务中。
+    :param old_db_path: 旧数据库的路径，默认为 old_database_path_v0210。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param row_status: memo 行状态，默认为 "NORMAL"
+    :param visibility: memo 可见性，默认为 "PRIVATE"
+    :param include_resources: 是否同时迁移 resource 记录，默认为 True。
+    :return stats: 包含 memo 行数 rows、resource 行数 resource_rows、耗时 elapsed_s（秒）和速率 rows_per_sec 的字典。
+    """
+    start_time = time.perf_counter()
+    new_db_connection.execute("ATTACH DATABASE ? AS old_v0210", (old_db_path,))
+    try:
+        with new_db_connection:
+            cursor = new_db_connection.execute(
+                """
+                INSERT OR REPLACE INTO main.memo (id, created_ts, updated_ts, creator_id, row_status, visibility, content)
+                SELECT id, created_ts, updated_ts, ?, ?, ?, content
+                FROM old_v0210.memo
+                ORDER BY id ASC
+                """,
+                (creator_id, row_status, visibility)
+            )
+            rows = cursor.rowcount
+
+            resource_rows = 0
+            if include_resources:
+                cursor = new_db_connection.execute(
+                    f"""
+                    INSERT OR REPLACE INTO main.resource (
+                        id, creator_id, created_ts, updated_ts, filename, blob,
+                        external_link, type, size, internal_path, memo_id
+                    )
+                    SELECT id, ?, created_ts, updated_ts, filename, blob,
+                        {RESOURCE_EXTERNAL_LINK_SQL}, type, size, {RESOURCE_INTERNAL_PATH_SQL}, memo_id
+                    FROM old_v0210.resource
+                    ORDER BY id ASC
+                    """,
+                    (creator_id,)
+                )
+                resource_rows = cursor.rowcount
+    finally:
+        new_db_connection.execute("DETACH DATABASE old_v0210")
+
+    elapsed_s = time.perf_counter() - start_time
+    rows_per_sec = (rows + resource_rows) / elapsed_s if elapsed_s > 0 else 0
+    log.info(
+        f"ATTACH 迁移完成：{rows} 条 memo，{resource_rows} 条 resource，"
+        f"用时 {elapsed_s:.2f} 秒，{rows_per_sec:.0f} 条/秒。"
+    )
+
+    return {
+        "rows": rows,
+        "resource_rows": resource_rows,
+        "elapsed_s": elapsed_s,
+        "rows_per_sec": rows_per_sec,
+    }
+
+
+def iter_limited_batches(
+    cursor: sqlite3.Cursor,
+    batch_size: int = migrate_chunk_size,
+    max_bytes: int = migrate_batch_bytes,
+    size_of: Callable[[tuple], int] = lambda row: 0,
+) -> Iterator[List[tuple]]:
+    """
+    从游标逐行读取并分批，每批最多 batch_size 行，且各行 size_of 之和达到 max_bytes 时提前结束这一批。
+
+    :param cursor: 已执行查询的游标。
+    :param batch_size: 每批的最大行数，默认在 config.py 给出。
+    :param max_bytes: 每批的最大字节数，默认在 config.py 给出；单行超过该值时单独成一批。
+    :param size_of: 返回一行字节数的函数，默认为 0，即只按行数分批。
+    :return batch: 逐批产出的行列表。
+    """
+    batch = []
+    batch_bytes = 0
+    for row in cursor:
+        batch.append(row)
+        batch_bytes += size_of(row)
+        if len(batch) >= batch_size or batch_bytes >= max_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def iter_resource_blob(
+    db_connection: sqlite3.Connection,
+    resource_id: int,
+    blob_size: int,
+    chunk_size: int = migrate_blob_chunk_size,
+) -> Iterator[bytes]:
+    """
+    分块读取一条 resource 的 blob，有 Connection.blobopen 时用增量 BLOB I/O，否则用 substr。
+
+    没有 blobopen 时 SQLite 每次 substr 都要读取整个 blob，读取的总量约为 blob_size ** 2 / chunk_size，
+    只适合校验、哈希等不能整体读入内存的场合。
+
+    :param db_connection: 已连接的 SQLite 数据库对象。
+    :param resource_id: resource 的 id。
+    :param blob_size: blob 的字节数。
+    :param chunk_size: 每块的字节数，默认在 config.py 给出。
+    :return data: 逐块产出的 bytes。
+    """
+    if HAS_BLOBOPEN:
+        with db_connection.blobopen("resource", "blob", resource_id, readonly=True) as reader:
+            while True:
+                data = reader.read(chunk_size)
+                if not data:
+                    break
+                yield data
+        return
+
+    for offset in range(0, blob_size, chunk_size):
+        yield db_connection.execute(
+            "SELECT substr(blob, ?, ?) FROM resource WHERE id = ?",
+            (offset + 1, chunk_size, resource_id)
+        ).fetchone()[0]
+
+
+def copy_resource_blob(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    resource_id: int,
+    blob_size: int,
+    chunk_size: int = migrate_blob_chunk_size,
+) -> None:
+    """
+    复制一条 resource 的 blob。
+
+    有 Connection.blobopen 时，目标行需已用 zeroblob(blob_size) 预留空间，数据按块直接写入，
+    内存占用只与 chunk_size 有关，与 blob 大小无关。
+    否则整体读取一次、写入一次，I/O 与 blob 大小成正比，但内存占用也与 blob 大小成正比；
+    此时目标行的 blob 可以是任意占位值（如空 blob），会被整体替换。
+
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param resource_id: resource 的 id，新旧数据库中相同。
+    :param blob_size: blob 的字节数。
+    :param chunk_size: 有 blobopen 时每次复制的字节数，默认在 config.py 给出。
+    """
+    if HAS_BLOBOPEN:
+        with new_db_connection.blobopen("resource", "blob", resource_id) as writer:
+            for data in iter_resource_blob(old_db_connection, resource_id, blob_size, chunk_size):
+                writer.write(data)
+        return
+
+    # 用拼接分块追加时 SQLite 每块都要读写整个已写入的部分，I/O 与 blob_size ** 2 / chunk_size 成正比
+    blob = old_db_connection.execute("SELECT blob FROM resource WHERE id = ?", (resource_id,)).fetchone()[0]
+    new_db_connection.execute("UPDATE resource SET blob = ? WHERE id = ?", (blob, resource_id))
+
+
+def write_resource_rows(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    rows: List[tuple],
+    creator_id: int,
+    blob_chunk_size: int,
+    blob_store=None,
+) -> int:
+    """
+    在调用方的事务内写入以 RESOURCE_METADATA_COLUMNS_SQL 读取的 resource 行，返回读取的 blob 字节数。
+
+    blob_store 为 None 时把 blob 分块复制到新数据库；否则交给 blob_store 按内容去重写入文件，
+    新数据库中 blob 为 NULL，internal_path 指向该文件。
+    """
+    blob_bytes = 0
+    for row in rows:
+        resource_id, blob_size, internal_path = row[0], row[4], row[8]
+        stored_path = None
+        if blob_size and blob_store is not None:
+            stored_path = blob_store.store_resource_blob(
+                old_db_connection, resource_id, blob_size, row[3], blob_chunk_size
+            )
+            internal_path = stored_path
+
+        # 有 blobopen 时预留 blob_size 字节，否则先写入空 blob，复制时整体替换
+        new_db_connection.execute(
+            """
+            INSERT OR REPLACE INTO resource (
+                id, creator_id, created_ts, updated_ts, filename, blob,
+                external_link, type, size, internal_path, memo_id
+            )
+            VALUES (?, ?, ?, ?, ?, CASE WHEN ? IS NULL THEN NULL ELSE zeroblob(?) END, ?, ?, ?, ?, ?)
+            """,
+            (
+                resource_id, creator_id, row[1], row[2], row[3],
+                None if stored_path else blob_size, blob_size if HAS_BLOBOPEN else 0,
+                row[5], row[6], row[7], internal_path, row[9],
+            )
+        )
+        if blob_size and stored_path is None:
+            copy_resource_blob(
+                old_db_connection=old_db_connection,
+                new_db_connection=new_db_connection,
+                resource_id=resource_id,
+                blob_size=blob_size,
+                chunk_size=blob_chunk_size,
+            )
+        blob_bytes += blob_size or 0
+    return blob_bytes
+
+
+def migrate_resource_records(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    after_resource_id: int = 0,
+    batch_size: int = migrate_chunk_size,
+    blob_chunk_size: int = migrate_blob_chunk_size,
+    creator_id: int = creator_id,
+    blob_store=None,
+    metrics=None,
+) -> dict:
+    """
+    以流式 blob 复制的方式迁移 resource 记录。
+
+    元数据按 id 分批读取（不读取 blob），blob 通过 copy_resource_blob 分块复制，
+    峰值内存与附件大小无关。每批记录在一个事务内写入，resource 的 id 保持不变。
+
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param after_resource_id: 只迁移 id 大于该值的 resource，默认为 0。
+    :param batch_size: 每个事务写入的 resource 数量，默认在 config.py 给出。
+    :param blob_chunk_size: 复制 blob 时每块的字节数，默认在 config.py 给出。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param blob_store: blob_store.BlobStore 对象，默认为 None；给出时按内容去重，把 blob 写入文件。
+    :param metrics: metrics.MigrationMetrics 对象，默认为 None；给出时记录速率和各阶段耗时。
+    :return stats: 包含迁移行数 rows、blob 字节数 blob_bytes、最后迁移的 last_resource_id、
+        耗时 elapsed_s（秒）和速率 rows_per_sec 的字典。
+    """
+    if batch_size <= 0 or blob_chunk_size <= 0:
+        log.error(f"Invalid batch_size: {batch_size} or blob_chunk_size: {blob_chunk_size}")
+        raise ValueError("Invalid batch_size or blob_chunk_size.")
+
+    start_time = time.perf_counter()
+    rows = 0
+    blob_bytes = 0
+    last_resource_id = after_resource_id
+
+    if metrics is not None:
+        total_rows, source_max_id = old_db_connection.execute(
+            "SELECT COUNT(*), IFNULL(MAX(id), 0) FROM resource WHERE id > ?", (after_resource_id,)
+        ).fetchone()
+        metrics.set_target("resource", total_rows, source_max_id)
+
+    cursor = old_db_connection.cursor()
+    while True:
+        read_start = time.perf_counter()
+        cursor.execute(
+            f"""
+            SELECT {RESOURCE_METADATA_COLUMNS_SQL}
+            FROM resource
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (last_resource_id, batch_size)
+        )
+        result = cursor.fetchall()
+        if not result:
+            break
+
+        write_start = time.perf_counter()
+        with new_db_connection:
+            batch_blob_bytes = write_resource_rows(
+                old_db_connection, new_db_connection, result, creator_id, blob_chunk_size, blob_store
+            )
+
+        rows += len(result)
+        blob_bytes += batch_blob_bytes
+        last_resource_id = result[-1][0]
+
+        if metrics is not None:
+            # blob 边读边写，复制 blob 的时间计入写入阶段
+            metrics.record_stage("read", write_start - read_start)
+            metrics.record_stage("write", time.perf_counter() - write_start)
+            metrics.add("resource", len(result), batch_blob_bytes, last_resource_id)
+            metrics.maybe_emit()
+
+    elapsed_s = time.perf_counter() - start_time
+    rows_per_sec = rows / elapsed_s if elapsed_s > 0 else 0
+    log.info(
+        f"迁移 resource 完成：{rows} 条，{blob_bytes} 字节，"
+        f"用时 {elapsed_s:.2f} 秒，{rows_per_sec:.0f} 条/秒。"
+    )
+
+    return {
+        "rows": rows,
+        "blob_bytes": blob_bytes,
+        "last_resource_id": last_resource_id,
+        "elapsed_s": elapsed_s,
+        "rows_per_sec": rows_per_sec,
+    }
+
+
+def get_sync_watermark(
+    db_connection: sqlite3.Connection,
+) -> dict:
+    """
+    读取旧数据库当前的高水位：memo 和 resource 的最大 updated_ts 与最大 id。
+
+    :param db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :return watermark: 包含 memo_updated_ts、memo_id、resource_updated_ts、resource_id 的字典，空表时为 0。
+    """
+    memo_updated_ts, memo_id = db_connection.execute(
+        "SELECT IFNULL(MAX(updated_ts), 0), IFNULL(MAX(id), 0) FROM memo"
+    ).fetchone()
+    resource_updated_ts, resource_id = db_connection.execute(
+        "SELECT IFNULL(MAX(updated_ts), 0), IFNULL(MAX(id), 0) FROM resource"
+    ).fetchone()
+    return {
+        "memo_updated_ts": memo_updated_ts,
+        "memo_id": memo_id,
+        "resource_updated_ts": resource_updated_ts,
+        "resource_id": resource_id,
+    }
+
+
+def _delete_missing_records(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    table: str,
+    batch_size: int,
+) -> int:
+    """
+    删除新数据库 table 中、旧数据库里已不存在的记录，返回删除的行数。
+
+    新数据库在同步后包含旧数据库的全部记录，行数相同时说明没有被删除的记录，直接跳过；
+    否则把旧数据库的 id 分批写入临时表，再一次性删除不在其中的记录。
+    """
+    old_count = old_db_connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    new_count = new_db_connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    if old_count == new_count:
+        return 0
+
+    with new_db_connection:
+        new_db_connection.execute("CREATE TEMP TABLE IF NOT EXISTS sync_ids (id INTEGER PRIMARY KEY)")
+        new_db_connection.execute("DELETE FROM temp.sync_ids")
+        cursor = old_db_connection.execute(f"SELECT id FROM {table}")
+        while True:
+            chunk = cursor.fetchmany(batch_size)
+            if not chunk:
+                break
+            new_db_connection.executemany("INSERT INTO temp.sync_ids (id) VALUES (?)", chunk)
+        deleted = new_db_connection.execute(
+            f"DELETE FROM main.{table} WHERE id NOT IN (SELECT id FROM temp.sync_ids)"
+        ).rowcount
+        new_db_connection.execute("DROP TABLE temp.sync_ids")
+    return deleted
+
+
+def sync_delta_records(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    watermark: dict,
+    batch_size: int = migrate_chunk_size,
+    blob_chunk_size: int = migrate_blob_chunk_size,
+    creator_id: int = creator_id,
+    row_status: str = "NORMAL",
+    visibility: str = "PRIVATE",
+    blob_store=None,
+    include_tags: bool = False,
+    metrics=None,
+) -> dict:
+    """
+    增量同步：只复制上次同步以来新建或修改的 memo 和 resource，并删除旧数据库中已删除的记录。
+
+    新建或修改的判断依据是 updated_ts 不小于上次的最大 updated_ts（updated_ts 精确到秒，
+    同一秒内的修改也能同步到），或 id 大于上次的最大 id。
+
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param watermark: 上次同步开始时由 get_sync_watermark 读取的高水位。
+    :param batch_size: 每个事务写入的记录数，默认在 config.py 给出。
+    :param blob_chunk_size: 复制 blob 时每块的字节数，默认在 config.py 给出。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param row_status: memo 行状态，默认为 "NORMAL"
+    :param visibility: memo 可见性，默认为 "PRIVATE"
+    :param blob_store: blob_store.BlobStore 对象，默认为 None；给出时按内容去重，把 blob 写入文件。
+    :param include_tags: 是否从同步的 memo 中提取 #标签 写入 tag 表，默认为 False；只扫描本次同步的 memo。
+    :param metrics: metrics.MigrationMetrics 对象，默认为 None；给出时按批记录速率、各阶段耗时和预计剩余时间。
+    :return stats: 包含同步的 memo 行数 rows、resource 行数 resource_rows、删除的 memo 行数 deleted_rows、
+        删除的 resource 行数 deleted_resource_rows、标签数量 tags 和耗时 elapsed_s（秒）的字典。
+    """
+    start_time = time.perf_counter()
+    rows = 0
+    resource_rows = 0
+    collector = TagCollector()
+    memo_args = (watermark["memo_updated_ts"], watermark["memo_id"])
+    resource_args = (watermark["resource_updated_ts"], watermark["resource_id"])
+
+    cursor = old_db_connection.cursor()
+    if metrics is not None:
+        for table, args in (("memo", memo_args), ("resource", resource_args)):
+            total_rows, source_max_id = cursor.execute(
+                f"SELECT COUNT(*), IFNULL(MAX(id), 0) FROM {table} WHERE updated_ts >= ? OR id > ?", args
+            ).fetchone()
+            metrics.set_target(table, total_rows, source_max_id)
+
+    cursor.execute(
+        """
+        SELECT id, created_ts, updated_ts, ?, ?, ?, content, tags
+        FROM memo
+        WHERE updated_ts >= ? OR id > ?
+        ORDER BY id ASC
+        """,
+        (creator_id, row_status, visibility, *memo_args)
+    )
+    while True:
+        read_start = time.perf_counter()
+        chunk = cursor.fetchmany(batch_size)
+        if not chunk:
+            break
+        write_start = time.perf_counter()
+        with new_db_connection:
+            new_db_connection.executemany(
+                """
+                INSERT OR REPLACE INTO memo (id, created_ts, updated_ts, creator_id, row_status, visibility, content)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (row[:7] for row in chunk)
+            )
+        if include_tags:
+            for row in chunk:
+                collector.add_memo(row[6], row[7])
+        rows += len(chunk)
+        if metrics is not None:
+            metrics.record_stage("read", write_start - read_start)
+            metrics.record_stage("write", time.perf_counter() - write_start)
+            metrics.add("memo", len(chunk), sum(len(row[6]) for row in chunk), chunk[-1][0])
+            metrics.maybe_emit()
+
+    if include_tags:
+        # 首次同步时 tag 表的 UNIQUE 约束可能被推迟建立，已有的标签不再写入
+        with new_db_connection:
+            new_db_connection.executemany(
+                """
+                INSERT OR IGNORE INTO tag (name, creator_id)
+                SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM tag WHERE name = ? AND creator_id = ?)
+                """,
+                ((name, creator_id, name, creator_id) for name in sorted(collector.names)),
+            )
+
+    cursor.execute(
+        f"""
+        SELECT {RESOURCE_METADATA_COLUMNS_SQL}
+        FROM resource
+        WHERE updated_ts >= ? OR id > ?
+        ORDER BY id ASC
+        """,
+        resource_args
+    )
+    while True:
+        read_start = time.perf_counter()
+        chunk = cursor.fetchmany(batch_size)
+        if not chunk:
+            break
+        write_start = time.perf_counter()
+        with new_db_connection:
+            blob_bytes = write_resource_rows(
+                old_db_connection, new_db_connection, chunk, creator_id, blob_chunk_size, blob_store
+            )
+        resource_rows += len(chunk)
+        if metrics is not None:
+            metrics.record_stage("read", write_start - read_start)
+            metrics.record_stage("write", time.perf_counter() - write_start)
+            metrics.add("resource", len(chunk), blob_bytes, chunk[-1][0])
+            metrics.maybe_emit()
+
+    deleted_rows = _delete_missing_records(old_db_connection, new_db_connection, "memo", batch_size)
+    deleted_resource_rows = _delete_missing_records(old_db_connection, new_db_connection, "resource", batch_size)
+
+    elapsed_s = time.perf_counter() - start_time
+    log.info(
+        f"增量同步完成：{rows} 条 memo，{resource_rows} 条 resource，"
+        f"删除 {deleted_rows} 条 memo、{deleted_resource_rows} 条 resource，{len(collector)} 个标签，用时 {elapsed_s:.2f} 秒。"
+    )
+
+    return {
+        "rows": rows,
+        "resource_rows": resource_rows,
+        "deleted_rows": deleted_rows,
+        "deleted_resource_rows": deleted_resource_rows,
+        "tags": len(collector),
+        "elapsed_s": elapsed_s,
+    }
@@ -0,0 +1,300 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from config import old_database_path_v0210, memo_prefetch_count, memo_cache_size
+from database import connect_read_only
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+
+class MemoCursor:
+    """
+    在旧数据库 (v0.21.0) 的 memo 之间前后移动的游标，供界面逐条浏览使用
+
+    读取 memo 和它的 resource 元数据（不含 blob），结果放入有上限的 LRU 缓存；
+    每次移动后在后台线程预读接下来的 prefetch_count 条，界面线程上的 prev / next 多数时候只读缓存。
+    所有数据库访问都在同一个后台线程中进行，连接只属于该线程。
+    """
+
+    def __init__(
+        self,
+        db_path: str = old_database_path_v0210,
+        start_memo_id: int = 1,
+        prefetch_count: int = memo_prefetch_count,
+        cache_size: int = memo_cache_size,
+    ):
+        """
+        :param db_path: 旧数据库的路径，默认为 old_database_path_v0210。
+        :param start_memo_id: 起始 memo_id，不存在时从下一个存在的 memo 开始，默认为 1。
+        :param prefetch_count: 每次预读的 memo 数量，默认在 config.py 给出。
+        :param cache_size: 缓存的 memo 数量上限，默认在 config.py 给出，须大于 prefetch_count。
+        """
+        if prefetch_count <= 0 or cache_size <= prefetch_count:
+            log.error(f"Invalid prefetch_count: {prefetch_count} or cache_size: {cache_size}")
+            raise ValueError("Invalid prefetch_count or cache_size.")
+
+        self.db_path = db_path
+        self.prefetch_count = prefetch_count
+        self.cache_size = cache_size
+        self.current_memo_id: Optional[int] = None
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memo_cursor")
+        self._db_connection: Optional[sqlite3.Connection] = None
+        # memo_id -> resource id 列表；resource.memo_id 上没有索引，首次使用时扫描一次
+        self._resource_ids_by_memo: Optional[Dict[int, List[int]]] = None
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[int, dict]" = OrderedDict()
+        # 已知的相邻关系：memo_id -> 下一个 / 上一个 memo_id，None 表示已到尽头
+        self._next_ids: Dict[int, Optional[int]] = {}
+        self._prev_ids: Dict[int, Optional[int]] = {}
+        # 每次 invalidate 加一，丢弃失效前发起的预读结果
+        self._generation = 0
+        self._prefetching: Optional[Future] = None
+
+        records = self._run(self._fetch_after, start_memo_id - 1, 1)
+        if not records:
+            log.error(f"No memo found from memo_id: {start_memo_id}")
+            raise ValueError("No memo found.")
+        self.current_memo_id = records[0]["memo_id"]
+        self._prefetch(self.current_memo_id)
+
+    # 后台线程中执行的数据库访问
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._db_connection is None:
+            self._db_connection = connect_read_only(self.db_path)
+        return self._db_connection
+
+    def _load_resource_index(self) -> Dict[int, List[int]]:
+        if self._resource_ids_by_memo is None:
+            index: Dict[int, List[int]] = {}
+            cursor = self._get_connection().execute(
+                "SELECT memo_id, id FROM resource WHERE memo_id IS NOT NULL ORDER BY id ASC"
+            )
+            for memo_id, resource_id in cursor:
+                index.setdefault(memo_id, []).append(resource_id)
+            self._resource_ids_by_memo = index
+        return self._resource_ids_by_memo
+
+    def _fetch_records(self, rows: List[tuple]) -> List[dict]:
+        """把 memo 行补上 resource 元数据，转换为记录字典。"""
+        resource_index = self._load_resource_index()
+        resource_ids = [resource_id for row in rows for resource_id in resource_index.get(row[0], [])]
+        resources: Dict[int, List[dict]] = {}
+        if resource_ids:
+            placeholders = ", ".join("?" * len(resource_ids))
+            cursor = self._get_connection().execute(
+                f"""
+                SELECT id, memo_id, created_ts, updated_ts, filename, type, size, storage_type, reference
+                FROM resource
+                WHERE id IN ({placeholders})
+                ORDER BY id ASC
+                """,
+                resource_ids,
+            )
+            for row in cursor:
+                resources.setdefault(row[1], []).append({
+                    "resource_id": row[0],
+                    "memo_id": row[1],
+                    "created_ts": row[2],
+                    "updated_ts": row[3],
+                    "filename": row[4],
+                    "type": row[5],
+                    "size": row[6],
+                    "storage_type": row[7],
+                    "reference": row[8],
+                })
+        return [
+            {
+                "memo_id": row[0],
+                "creator_id": row[1],
+                "created_ts": row[2],
+                "updated_ts": row[3],
+                "content": row[4],
+                "resources": resources.get(row[0], []),
+            } for row in rows
+        ]
+
+    def _fetch_after(self, memo_id: int, limit: int) -> List[dict]:
+        rows = self._get_connection().execute(
+            """
+            SELECT id, creator_id, created_ts, updated_ts, content
+            FROM memo
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (memo_id, limit),
+        ).fetchall()
+        return self._fetch_records(rows)
+
+    def _fetch_before(self, memo_id: int, limit: int) -> List[dict]:
+        rows = self._get_connection().execute(
+            """
+            SELECT id, creator_id, created_ts, updated_ts, content
+            FROM memo
+            WHERE id < ?
+            ORDER BY id DESC
+            LIMIT ?
+            """,
+            (memo_id, limit),
+        ).fetchall()
+        return self._fetch_records(rows)
+
+    def _run(self, function, *args):
+        """在后台线程中执行并等待结果，保证连接只在该线程中使用。"""
+        return self._executor.submit(function, *args).result()
+
+    # 缓存
+    def _store(self, anchor_memo_id: int, records: List[dict], forward: bool, limit: int, generation: int):
+        """
+        把从 anchor_memo_id 向前或向后连续读到的记录放入缓存，并记录相邻关系
+
+        读到的记录少于 limit 时说明已到尽头，最后一条的下一个（或上一个）记为 None。
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            next_ids, prev_ids = (self._next_ids, self._prev_ids) if forward else (self._prev_ids, self._next_ids)
+            previous_id = anchor_memo_id
+            for record in records:
+                memo_id = record["memo_id"]
+                next_ids[previous_id] = memo_id
+                prev_ids[memo_id] = previous_id
+                self._cache[memo_id] = record
+                self._cache.move_to_end(memo_id)
+                previous_id = memo_id
+            if len(records) < limit:
+                next_ids[previous_id] = None
+
+            while len(self._cache) > self.cache_size:
+                evicted_id, _ = self._cache.popitem(last=False)
+                self._next_ids.pop(evicted_id, None)
+                self._prev_ids.pop(evicted_id, None)
+
+    def _prefetch(self, memo_id: int):
+        """缓存中 memo_id 之后已知的记录不足一半时，在后台预读接下来的 prefetch_count 条。"""
+        with self._lock:
+            if self._prefetching is not None and not self._prefetching.done():
+                return
+            last_id = memo_id
+            for _ in range(self.prefetch_count // 2 + 1):
+                if last_id not in self._next_ids:
+                    break
+                next_id = self._next_ids[last_id]
+                if next_id is None:
+                    return
+                if next_id not in self._cache:
+                    break
+                last_id = next_id
+            else:
+                return
+            generation = self._generation
+
+        def task():
+            records = self._fetch_after(last_id, self.prefetch_count)
+            self._store(last_id, records, True, self.prefetch_count, generation)
+
+        self._prefetching = self._executor.submit(task)
+
+    def _move(self, forward: bool) -> Optional[dict]:
+        neighbors = self._next_ids if forward else self._prev_ids
+        with self._lock:
+            memo_id = self.current_memo_id
+            known = memo_id in neighbors and (neighbors[memo_id] is None or neighbors[memo_id] in self._cache)
+            target_id = neighbors.get(memo_id) if known else None
+            generation = self._generation
+
+        if not known:
+            fetch = self._fetch_after if forward else self._fetch_before
+            records = self._run(fetch, memo_id, self.prefetch_count)
+            self._store(memo_id, records, forward, self.prefetch_count, generation)
+            target_id = records[0]["memo_id"] if records else None
+
+        if target_id is None:
+            return None
+        self.current_memo_id = target_id
+        if forward:
+            self._prefetch(target_id)
+        return self.current()
+
+    # 公开接口
+    def current(self) -> dict:
+        """
+        获取当前 memo 的记录
+
+        :return memo_record: 与 get_memo_record 格式相同的字典，另有 resources 键，为 resource 元数据的列表（不含 blob）。
+        """
+        with self._lock:
+            record = self._cache.get(self.current_memo_id)
+            if record is not None:
+                self._cache.move_to_end(self.current_memo_id)
+                return record
+            generation = self._generation
+        records = self._run(self._fetch_after, self.current_memo_id - 1, 1)
+        if not records:
+            log.error(f"No memo found with memo_id: {self.current_memo_id}")
+            raise ValueError("No memo found.")
+        self._store(self.current_memo_id - 1, records, True, 1, generation)
+        return records[0]
+
+    def next(self) -> Optional[dict]:
+        """移动到下一条 memo，返回它的记录；已是最后一条时不移动，返回 None。"""
+        return self._move(forward=True)
+
+    def prev(self) -> Optional[dict]:
+        """移动到上一条 memo，返回它的记录；已是第一条时不移动，返回 None。"""
+        return self._move(forward=False)
+
+    def jump_to(self, memo_id: int) -> dict:
+        """移动到指定的 memo（如搜索结果），不存在时移动到下一个存在的 memo，返回它的记录。"""
+        with self._lock:
+            record = self._cache.get(memo_id)
+            generation = self._generation
+        if record is None:
+            records = self._run(self._fetch_after, memo_id - 1, 1)
+            if not records:
+                log.error(f"No memo found from memo_id: {memo_id}")
+                raise ValueError("No memo found.")
+            self._store(memo_id - 1, records, True, 1, generation)
+            record = records[0]
+        self.current_memo_id = record["memo_id"]
+        self._prefetch(self.current_memo_id)
+        return record
+
+    def invalidate(self, memo_id: Optional[int] = None):
+        """
+        使缓存失效，提交 memo 后调用
+
+        :param memo_id: 只使该 memo 的缓存失效，默认为 None，即清空全部缓存和相邻关系。
+        """
+        with self._lock:
+            self._generation += 1
+            if memo_id is None:
+                self._cache.clear()
+                self._next_ids.clear()
+                self._prev_ids.clear()
+            else:
+                self._cache.pop(memo_id, None)
+        if memo_id is None:
+            # resource 也可能有变化，下次使用时重新建立
+            self._executor.submit(setattr, self, "_resource_ids_by_memo", None)
+
+    def close(self):
+        """停止后台线程并关闭连接。"""
+        def close_connection():
+            if self._db_connection is not None:
+                self._db_connection.close()
+                self._db_connection = None
+
+        self._executor.submit(close_connection)
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "MemoCursor":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
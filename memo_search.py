@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+from config import new_database_path_v0171, memo_search_index_path
+from database import open_connection, finish_connection
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+# trigram 分词器按三个字符切分，不依赖空格，中文也能检索；要求 SQLite 3.34 以上并启用 FTS5
+FTS_TABLE_SQL = "CREATE VIRTUAL TABLE IF NOT EXISTS memo_fts USING fts5(content, tokenize = 'trigram')"
+# trigram 能用于 MATCH 的最短查询长度，更短的查询退回到在索引表上 LIKE
+MIN_MATCH_LENGTH = 3
+
+
+def build_search_index(
+    index_path: str = memo_search_index_path,
+    db_path: str = new_database_path_v0171,
+) -> int:
+    """
+    从新数据库 (v0.17.1) 的 memo 表一次性重建全文索引
+
+    索引保存在单独的数据库文件中，不改变 v0.17.1 的结构。迁移结束后调用。
+
+    :param index_path: 索引数据库的路径，默认在 config.py 给出。
+    :param db_path: 新数据库的路径，默认为 new_database_path_v0171。
+    :return int: 写入索引的 memo 数量。
+    """
+    start_time = time.perf_counter()
+    index_connection = open_connection(index_path, "bulk_load")
+    try:
+        index_connection.execute("ATTACH DATABASE ? AS source", (db_path,))
+        try:
+            with index_connection:
+                index_connection.execute("DROP TABLE IF EXISTS main.memo_fts")
+                index_connection.execute(FTS_TABLE_SQL)
+                rows = index_connection.execute(
+                    "INSERT INTO main.memo_fts (rowid, content) SELECT id, content FROM source.memo"
+                ).rowcount
+                # 合并写入过程中产生的多个 b-tree 段，查询时只需读一个
+                index_connection.execute("INSERT INTO main.memo_fts (memo_fts) VALUES ('optimize')")
+        finally:
+            index_connection.execute("DETACH DATABASE source")
+        finish_connection(index_connection, "bulk_load")
+    finally:
+        index_connection.close()
+
+    log.info(f"全文索引已建立：{rows} 条 memo，用时 {time.perf_counter() - start_time:.2f} 秒。")
+    return rows
+
+
+class MemoSearchIndex:
+    """
+    memo 内容的全文索引（FTS5 trigram），供界面搜索
+
+    连接可在多个线程中使用（提交队列的写入线程、界面的后台线程），内部用锁串行化。
+    """
+
+    def __init__(self, index_path: str = memo_search_index_path):
+        """
+        :param index_path: 索引数据库的路径，默认在 config.py 给出；不存在时创建空索引。
+        """
+        if not index_path:
+            log.error("全文索引路径为空，请在 config.py 中配置 memo_search_index_path。")
+            raise ValueError("Search index path is not configured.")
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self.db_connection = open_connection(index_path, "default", check_same_thread=False)
+        try:
+            with self.db_connection:
+                self.db_connection.execute(FTS_TABLE_SQL)
+        except sqlite3.OperationalError as e:
+            self.db_connection.close()
+            log.error(f"当前 SQLite 不支持 FTS5 trigram 分词器：{e}")
+            raise ValueError("FTS5 trigram tokenizer is not available.") from e
+
+    def search(self, query: str, limit: int = 50) -> List[Tuple[int, str]]:
+        """
+        搜索内容中包含 query 的 memo
+
+        :param query: 搜索的文本，按整体匹配（不拆分成多个词），可以是 #标签
+        :param limit: 最多返回的条数，默认为 50
+        :return list: (memo_id, 摘要) 的列表，按 memo_id 倒序（最新的在前）；
+            按 rowid 排序时 FTS5 不必为所有匹配计算相关度，匹配很多时也能很快返回。
+        """
+        query = query.strip()
+        if not query:
+            return []
+        with self._lock:
+            if len(query) >= MIN_MATCH_LENGTH:
+                phrase = '"' + query.replace('"', '""') + '"'
+                cursor = self.db_connection.execute(
+                    """
+                    SELECT rowid, snippet(memo_fts, 0, '[', ']', '…', 16)
+                    FROM memo_fts
+                    WHERE memo_fts MATCH ?
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                    """,
+                    (phrase, limit),
+                )
+            else:
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                cursor = self.db_connection.execute(
+                    r"""
+                    SELECT rowid, substr(content, 1, 64)
+                    FROM memo_fts
+                    WHERE content LIKE ? ESCAPE '\'
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                    """,
+                    (pattern, limit),
+                )
+            return cursor.fetchall()
+
+    def update_many(self, memos: Iterable[Tuple[int, str]]) -> None:
+        """
+        在一个事务内更新多条 memo 的索引，提交 memo 后调用
+
+        :param memos: (memo_id, content) 的可迭代对象
+        """
+        with self._lock, self.db_connection:
+            for memo_id, content in memos:
+                self.db_connection.execute("DELETE FROM memo_fts WHERE rowid = ?", (memo_id,))
+                self.db_connection.execute(
+                    "INSERT INTO memo_fts (rowid, content) VALUES (?, ?)", (memo_id, content)
+                )
+
+    def delete(self, memo_id: int) -> None:
+        with self._lock, self.db_connection:
+            self.db_connection.execute("DELETE FROM memo_fts WHERE rowid = ?", (memo_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self.db_connection.close()
+
+
+def open_search_index(index_path: str = memo_search_index_path) -> Optional[MemoSearchIndex]:
+    """打开配置的全文索引；未配置或 SQLite 不支持时返回 None，界面不显示搜索结果。"""
+    if not index_path:
+        return None
+    try:
+        return MemoSearchIndex(index_path)
+    except ValueError:
+        return None
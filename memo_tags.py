@@ -0,0 +1,55 @@
+import json
+import re
+from typing import Iterable, Optional, Set
+
+# 一次扫描完成：先匹配代码块和行内代码并跳过，其余位置匹配 #标签（标签前须为行首或空白）
+# 未闭合的代码块一直延续到内容结尾
+TAG_SCANNER = re.compile(
+    r"```.*?(?:```|\Z)|`[^`\n]*`|(?:^|(?<=\s))#([^\s#,]+)",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+def extract_tags(content: str) -> Set[str]:
+    """
+    从 memo 内容中提取 #标签（如 #Tag/Sub），忽略代码块和行内代码中的内容
+
+    :param content: memo 内容
+    :return set: 去掉 # 的标签名集合
+    """
+    # 绝大多数 memo 没有标签，先用 in 判断，省去正则扫描
+    if "#" not in content:
+        return set()
+    return {match.group(1) for match in TAG_SCANNER.finditer(content) if match.group(1)}
+
+
+class TagCollector:
+    """在内存中收集并去重 memo 的标签，最后一次性写入 v0.17.1 的 tag 表。"""
+
+    def __init__(self):
+        self.names: Set[str] = set()
+        self.memo_count = 0
+
+    def add_memo(self, content: str, tags_json: Optional[str] = None):
+        """
+        收集一条 memo 的标签
+
+        :param content: memo 内容
+        :param tags_json: v0.21.0 memo.tags 列（JSON 数组），非空时直接使用，不再扫描内容
+        """
+        self.memo_count += 1
+        if tags_json and tags_json != "[]":
+            try:
+                tags = json.loads(tags_json)
+            except ValueError:
+                tags = None
+            if isinstance(tags, list) and tags:
+                self.names.update(tag.lstrip("#") for tag in tags if isinstance(tag, str) and tag.strip("#"))
+                return
+        self.names.update(extract_tags(content))
+
+    def add_names(self, names: Iterable[str]):
+        self.names.update(names)
+
+    def __len__(self) -> int:
+        return len(self.names)
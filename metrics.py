@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+from config import metrics_interval_s, metrics_json_path
+from utils import get_configured_logger, ensure_directory_exists_for_file
+
+log = get_configured_logger()
+
+STAGES = ("read", "transform", "write")
+KINDS = ("memo", "resource")
+
+
+class LatencyHistogram:
+    """按 2 的幂划分桶（单位毫秒）的延迟直方图，只保存计数，占用固定内存。"""
+
+    BUCKET_COUNT = 24  # 最后一个桶约为 2 ** 22 毫秒，约 70 分钟
+
+    def __init__(self):
+        self.buckets = [0] * self.BUCKET_COUNT
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, seconds: float):
+        milliseconds = seconds * 1000
+        index = 0 if milliseconds < 1 else min(int(milliseconds).bit_length(), self.BUCKET_COUNT - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_s += seconds
+        self.max_s = max(self.max_s, seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """返回 fraction 分位所在桶的上界（毫秒），没有记录时为 0。"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return float(2 ** index)
+        return float(2 ** (self.BUCKET_COUNT - 1))
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_s * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_s * 1000,
+            "buckets_ms": {str(2 ** i): c for i, c in enumerate(self.buckets) if c},
+        }
+
+
+class MigrationMetrics:
+    """
+    迁移过程的指标：memo 和 resource 的滚动 行/秒 与 字节/秒、读取/转换/写入各阶段（只报告记录过的阶段）的延迟直方图、
+    与旧数据库最大 id 的差距和预计剩余时间。
+
+    指标按 interval_s 周期性输出，而不是每条记录输出一次：写入日志，给出 process 时保存到 memos_rollback，
+    给出 json_path 时同时写入 JSON 文件。可以在多个线程中同时记录。
+    """
+
+    def __init__(
+        self,
+        process=None,
+        interval_s: float = metrics_interval_s,
+        json_path: str = metrics_json_path,
+        window_s: float = 60,
+    ):
+        """
+        :param process: process.Process 对象，默认为 None；给出时把指标保存到 memos_rollback。
+        :param interval_s: 输出间隔（秒），默认在 config.py 给出。
+        :param json_path: JSON 文件路径，默认在 config.py 给出；为空时不写入文件。
+        :param window_s: 计算滚动速率的时间窗口（秒），默认为 60。
+        """
+        self.process = process
+        self.interval_s = interval_s
+        self.json_path = json_path
+        self.window_s = window_s
+
+        self._lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self._last_emit_time = self.start_time
+        self.rows = {kind: 0 for kind in KINDS}
+        self.bytes = {kind: 0 for kind in KINDS}
+        self.total_rows = {kind: None for kind in KINDS}
+        self.current_id = {kind: 0 for kind in KINDS}
+        self.source_max_id = {kind: 0 for kind in KINDS}
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        # (时间, 各类型行数, 各类型字节数) 的样本，用于计算滚动速率
+        self._samples = deque([(self.start_time, dict(self.rows), dict(self.bytes))])
+
+    def set_target(self, kind: str, total_rows: int, source_max_id: int):
+        """设置本次需要迁移的总行数和旧数据库中的最大 id，用于计算差距和预计剩余时间。"""
+        with self._lock:
+            self.total_rows[kind] = total_rows
+            self.source_max_id[kind] = source_max_id
+
+    def record_stage(self, stage: str, seconds: float):
+        """记录一次读取/转换/写入的耗时。"""
+        with self._lock:
+            self.stages[stage].record(seconds)
+
+    def add(self, kind: str, rows: int, size: int = 0, current_id: Optional[int] = None):
+        """记录已完成的行数、字节数和当前 id。"""
+        with self._lock:
+            self.rows[kind] += rows
+            self.bytes[kind] += size
+            if current_id is not None:
+                self.current_id[kind] = max(self.current_id[kind], current_id)
+
+    def _rolling_rates(self, now: float) -> dict:
+        self._samples.append((now, dict(self.rows), dict(self.bytes)))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window_s:
+            self._samples.popleft()
+        since, rows, size = self._samples[0]
+        elapsed = now - since
+        return {
+            kind: {
+                "rows_per_sec": (self.rows[kind] - rows[kind]) / elapsed if elapsed > 0 else 0.0,
+                "bytes_per_sec": (self.bytes[kind] - size[kind]) / elapsed if elapsed > 0 else 0.0,
+            }
+            for kind in KINDS
+        }
+
+    def snapshot(self) -> dict:
+        """返回当前指标的字典。"""
+        with self._lock:
+            now = time.monotonic()
+            rates = self._rolling_rates(now)
+            kinds = {}
+            for kind in KINDS:
+                total = self.total_rows[kind]
+                rate = rates[kind]["rows_per_sec"]
+                remaining = max(total - self.rows[kind], 0) if total is not None else None
+                kinds[kind] = {
+                    "rows": self.rows[kind],
+                    "bytes": self.bytes[kind],
+                    "total_rows": total,
+                    "current_id": self.current_id[kind],
+                    "lag_ids": max(self.source_max_id[kind] - self.current_id[kind], 0),
+                    "eta_s": remaining / rate if remaining is not None and rate > 0 else None,
+                    **rates[kind],
+                }
+            return {
+                "elapsed_s": now - self.start_time,
+                "kinds": kinds,
+                # 只包含记录过的阶段：bulk / row 模式的转换在读取的 SELECT 中完成，没有单独的 transform 阶段
+                "stages": {
+                    stage: histogram.to_dict() for stage, histogram in self.stages.items() if histogram.count
+                },
+            }
+
+    def maybe_emit(self):
+        """距上次输出超过 interval_s 时输出一次。"""
+        if time.monotonic() - self._last_emit_time >= self.interval_s:
+            self.emit()
+
+    def emit(self) -> dict:
+        """立即输出一次指标，不能在写入数据的事务内调用。"""
+        self._last_emit_time = time.monotonic()
+        snapshot = self.snapshot()
+
+        for kind, values in snapshot["kinds"].items():
+            if not values["rows"] and values["total_rows"] is None:
+                continue
+            eta = f"{values['eta_s']:.0f} 秒" if values["eta_s"] is not None else "未知"
+            log.info(
+                f"[{kind}] 已完成 {values['rows']} 条，{values['rows_per_sec']:.0f} 条/秒，"
+                f"{values['bytes_per_sec'] / 1024 / 1024:.2f} MiB/秒，"
+                f"距最大 id 还差 {values['lag_ids']}，预计剩余 {eta}。"
+            )
+        log.info(
+            "阶段延迟 p50/p95(ms)：" + "，".join(
+                f"{stage} {values['p50_ms']:.0f}/{values['p95_ms']:.0f}"
+                for stage, values in snapshot["stages"].items()
+            )
+        )
+
+        if self.process is not None:
+            self.process.record_metrics(json.dumps(snapshot, ensure_ascii=False))
+        if self.json_path:
+            ensure_directory_exists_for_file(self.json_path)
+            temp_path = Path(self.json_path).with_suffix(".tmp")
+            temp_path.write_text(json.dumps(snapshot, ensure_ascii=False, indent=2), encoding="utf-8")
+            temp_path.replace(self.json_path)
+        return snapshot
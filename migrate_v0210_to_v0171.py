@@ -1,25 +1,254 @@
-from database import connect_database, get_memo_record, upsert_memo_record
+import sqlite3
+import time
+from database import (
+    create_database,
+    connect_database,
+    finish_connection,
+    build_deferred_indexes,
+    verify_schema,
+    get_sync_watermark,
+    sync_delta_records,
+    iter_memo_resource_groups,
+    write_resource_rows,
+    upsert_memo_record,
+    migrate_memo_records,
+    migrate_resource_records,
+    migrate_records_by_attach,
+    migrate_tag_records,
+)
+from config import old_database_path_v0210, migrate_mode, migrate_chunk_size, target_connection_profile
+from config import migrate_blob_chunk_size, creator_id
+from config import resource_dedup_dir, migrate_tags, migrate_tables, memo_search_index_path
+from blob_store import BlobStore
+from memo_search import build_search_index
+from metrics import MigrationMetrics
+from process import Process
+from resource_pipeline import migrate_resource_records_parallel
+from shard_migration import migrate_sharded
+from table_mapping import migrate_mapped_tables
 from utils import get_configured_logger
 
 log = get_configured_logger()
-old_conn_v0210, new_conn_v0171 = connect_database()
 
-for memo_id in range(1,5508):
-    memo_record = get_memo_record(
-        memo_id=memo_id,
-        db_connection=old_conn_v0210
+
+def migrate_row_wise(
+    old_conn_v0210: sqlite3.Connection,
+    new_conn_v0171: sqlite3.Connection,
+) -> None:
+    """逐条迁移 memo 及其 resource，每条 memo 单独写入、单独提交，从 Process 记录的断点继续。"""
+    process = Process(new_conn_v0171)
+    start_memo_id = process.start()
+    metrics = MigrationMetrics(process)
+    blob_store = BlobStore(resource_dedup_dir, new_conn_v0171) if resource_dedup_dir else None
+    total_rows, source_max_id = old_conn_v0210.execute(
+        "SELECT COUNT(*), IFNULL(MAX(id), 0) FROM memo WHERE id >= ?", (start_memo_id,)
+    ).fetchone()
+    metrics.set_target("memo", total_rows, source_max_id)
+
+    read_start = time.perf_counter()
+    for memo_record, resource_rows in iter_memo_resource_groups(
+        db_connection=old_conn_v0210,
+        after_memo_id=start_memo_id - 1,
+        batch_size=migrate_chunk_size,
+    ):
+        write_start = time.perf_counter()
+        metrics.record_stage("read", write_start - read_start)
+
+        # memo、它的 resource 与断点在同一个事务内提交；没有对应 memo 的 resource 单独提交
+        with new_conn_v0171:
+            if memo_record is not None:
+                upsert_memo_record(
+                    memo_id=memo_record["memo_id"],
+                    created_ts=memo_record["created_ts"],
+                    updated_ts=memo_record["updated_ts"],
+                    content=memo_record["content"],
+                    db_connection=new_conn_v0171,
+                    commit=False,
+                )
+            blob_bytes = write_resource_rows(
+                old_conn_v0210, new_conn_v0171, resource_rows, creator_id, migrate_blob_chunk_size, blob_store
+            )
+            if memo_record is not None:
+                process.checkpoint(memo_record["memo_id"])
+
+        metrics.record_stage("write", time.perf_counter() - write_start)
+        if memo_record is not None:
+            metrics.add("memo", 1, len(memo_record["content"]), memo_record["memo_id"])
+        if resource_rows:
+            metrics.add("resource", len(resource_rows), blob_bytes, resource_rows[-1][0])
+        metrics.maybe_emit()
+        read_start = time.perf_counter()
+
+    if blob_store is not None:
+        blob_store.report()
+
+    metrics.emit()
+
+
+def migrate_bulk(
+    old_conn_v0210: sqlite3.Connection,
+    new_conn_v0171: sqlite3.Connection,
+    parallel_resources: bool = False,
+) -> None:
+    """
+    分块批量迁移 memo 和 resource，从 Process 记录的断点继续。
+
+    :param parallel_resources: 是否用多个读取线程并行迁移 resource，默认为 False，即流式复制 blob。
+    """
+    process = Process(new_conn_v0171)
+    start_memo_id = process.start()
+    metrics = MigrationMetrics(process)
+
+    stats = migrate_memo_records(
+        old_db_connection=old_conn_v0210,
+        new_db_connection=new_conn_v0171,
+        chunk_size=migrate_chunk_size,
+        after_memo_id=start_memo_id - 1,
+        process=process,
+        metrics=metrics,
     )
-    id = memo_record["memo_id"]
-    created_ts = memo_record["created_ts"]
-    updated_ts = memo_record["updated_ts"]
-    content = memo_record["content"]
-
-    upsert_memo_record(
-        memo_id=id,
-        created_ts=created_ts,
-        updated_ts=updated_ts,
-        content=content,
-        db_connection=new_conn_v0171
+
+    # 顺序迁移时 resource 按 id 升序分批提交，新数据库中的最大 id 即为断点；并行迁移另由 Process 记录各区间的断点
+    last_resource_id = new_conn_v0171.execute("SELECT IFNULL(MAX(id), 0) FROM resource").fetchone()[0]
+    blob_store = BlobStore(resource_dedup_dir, new_conn_v0171) if resource_dedup_dir else None
+    if parallel_resources:
+        resource_stats = migrate_resource_records_parallel(
+            new_db_connection=new_conn_v0171,
+            old_db_path=old_database_path_v0210,
+            after_resource_id=last_resource_id,
+            blob_store=blob_store,
+            process=process,
+            metrics=metrics,
+        )
+    else:
+        resource_stats = migrate_resource_records(
+            old_db_connection=old_conn_v0210,
+            new_db_connection=new_conn_v0171,
+            after_resource_id=last_resource_id,
+            batch_size=migrate_chunk_size,
+            blob_store=blob_store,
+            metrics=metrics,
+        )
+    if blob_store is not None:
+        blob_store.report()
+    metrics.emit()
+
+    log.info(
+        f"迁移完成，共 {stats['rows']} 条 memo，{stats['rows_per_sec']:.0f} 条/秒；"
+        f"{resource_stats['rows']} 条 resource，{resource_stats['blob_bytes']} 字节。"
+    )
+
+
+def migrate_sharded_records(
+    new_conn_v0171: sqlite3.Connection,
+) -> None:
+    """多进程分片转换 memo、resource 和标签，再一次性合并到新数据库，从 Process 记录的断点继续。"""
+    process = Process(new_conn_v0171)
+    start_memo_id = process.start()
+    metrics = MigrationMetrics(process)
+    last_resource_id = new_conn_v0171.execute("SELECT IFNULL(MAX(id), 0) FROM resource").fetchone()[0]
+    migrate_sharded(
+        new_db_connection=new_conn_v0171,
+        old_db_path=old_database_path_v0210,
+        after_memo_id=start_memo_id - 1,
+        after_resource_id=last_resource_id,
+        include_tags=migrate_tags,
+        dedup_dir=resource_dedup_dir,
+        process=process,
+        metrics=metrics,
     )
+    metrics.emit()
+
+
+def migrate_delta(
+    old_conn_v0210: sqlite3.Connection,
+    new_conn_v0171: sqlite3.Connection,
+) -> None:
+    """增量同步上次同步以来新建、修改和删除的 memo 与 resource；从未同步时等同于全量迁移。"""
+    process = Process(new_conn_v0171)
+    watermark = process.get_sync_watermark()
+    metrics = MigrationMetrics(process)
+    blob_store = BlobStore(resource_dedup_dir, new_conn_v0171) if resource_dedup_dir else None
+    stats = sync_delta_records(
+        old_db_connection=old_conn_v0210,
+        new_db_connection=new_conn_v0171,
+        watermark=watermark,
+        batch_size=migrate_chunk_size,
+        blob_store=blob_store,
+        include_tags=migrate_tags,
+        metrics=metrics,
+    )
+    if blob_store is not None:
+        blob_store.report()
+    metrics.emit()
+    log.info(f"同步完成，共 {stats['rows']} 条 memo，{stats['resource_rows']} 条 resource。")
+
+
+def main():
+    # attach 模式在 SQLite 内部复制 blob，无法按内容去重，在创建新数据库之前拒绝
+    if migrate_mode == "attach" and resource_dedup_dir:
+        log.error("migrate_mode 为 attach 时不支持 resource_dedup_dir，请清空 resource_dedup_dir 或改用其他模式。")
+        raise ValueError("resource_dedup_dir is not supported in attach mode.")
+
+    # 批量模式下先建立不带 UNIQUE 约束的表，写入完成后再一次性建立
+    defer_indexes = migrate_mode != "row"
+    create_database(defer_indexes=defer_indexes)
+
+    old_conn_v0210, new_conn_v0171 = connect_database()
+    try:
+        # 在复制之前读取高水位，复制期间旧数据库的修改会在下一次增量同步时补上
+        watermark = get_sync_watermark(old_conn_v0210)
+
+        if migrate_mode == "row":
+            migrate_row_wise(old_conn_v0210, new_conn_v0171)
+        elif migrate_mode == "bulk":
+            migrate_bulk(old_conn_v0210, new_conn_v0171)
+        elif migrate_mode == "parallel":
+            migrate_bulk(old_conn_v0210, new_conn_v0171, parallel_resources=True)
+        elif migrate_mode == "attach":
+            stats = migrate_records_by_attach(
+                new_db_connection=new_conn_v0171,
+                old_db_path=old_database_path_v0210,
+            )
+            log.info(f"迁移完成，共 {stats['rows']} 条 memo，{stats['resource_rows']} 条 resource。")
+        elif migrate_mode == "sharded":
+            migrate_sharded_records(new_conn_v0171)
+        elif migrate_mode == "delta":
+            migrate_delta(old_conn_v0210, new_conn_v0171)
+        else:
+            log.error(f"Invalid migrate_mode: {migrate_mode}")
+            raise ValueError("Invalid migrate_mode.")
+
+        # 分片迁移已在工作进程中提取标签，增量同步只从本次同步的 memo 中提取
+        if migrate_tags and migrate_mode not in ("sharded", "delta"):
+            migrate_tag_records(old_conn_v0210, new_conn_v0171, batch_size=migrate_chunk_size)
+
+        if migrate_tables:
+            migrate_mapped_tables(old_conn_v0210, new_conn_v0171, migrate_tables, batch_size=migrate_chunk_size)
+
+        Process(new_conn_v0171).record_sync_watermark(watermark)
+
+        if defer_indexes:
+            build_deferred_indexes(new_conn_v0171)
+        if not verify_schema(new_conn_v0171):
+            log.error("新数据库的结构与 v0.17.1 不一致。")
+    except BaseException:
+        # 出错时放弃未提交的事务，不能让收尾时的 commit 把它提交
+        new_conn_v0171.rollback()
+        raise
+    finally:
+        # 无论是否出错都恢复安全的 pragma，避免新数据库停留在 synchronous=OFF 和 WAL 模式
+        try:
+            finish_connection(new_conn_v0171, target_connection_profile)
+        except sqlite3.Error as e:
+            log.error(f"恢复新数据库的连接配置失败：{e}")
+        old_conn_v0210.close()
+        new_conn_v0171.close()
+
+    if memo_search_index_path:
+        build_search_index()
+
 
-    log.info(f"迁移 memo_id {memo_id} 完成。")
+# 分片模式的工作进程以 spawn 方式启动时会重新导入本文件，迁移只能在作为脚本运行时执行
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,20 @@
 import sqlite3
 from datetime import datetime
-from database import connect_database
-from utils import get_configured_logger
+from typing import Optional, List
+from database import connections
+from utils import get_configured_logger, SampledLogger
 
-new_conn_v0171 = connect_database()[1]
 log = get_configured_logger()
+sampled_log = SampledLogger(log=log)
 
 
 class Process:
     def __init__(
         self,
-        db_connection: sqlite3.Connection = new_conn_v0171,
+        db_connection: Optional[sqlite3.Connection] = None,
     ):
-        self.db_connection = db_connection
+        # 默认使用 connections 中的 v0171 连接
+        self.db_connection = db_connection if db_connection is not None else connections.get("v0171")
         self.start_time = None
         self.start_memo_id = None
 
@@ -35,6 +37,41 @@ class Process:
                 );
                 """
             )
+            # checkpointed = 1 表示 end_memo_id 与 memo 的写入在同一个事务内提交，是准确的断点
+            self._ensure_column("memos_rollback", "checkpointed", "INTEGER DEFAULT 0")
+            # 最近一次输出的迁移指标（JSON），见 metrics.MigrationMetrics
+            self._ensure_column("memos_rollback", "metrics", "TEXT")
+            # 按 id 区间并行迁移时，每个区间已提交的最后 id
+            self.db_connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memos_rollback_range (
+                    name TEXT NOT NULL,
+                    low_id INTEGER NOT NULL,
+                    high_id INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    PRIMARY KEY (name, low_id)
+                );
+                """
+            )
+            # 增量同步的高水位，每次同步记录一行
+            self.db_connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memos_rollback_sync (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sync_time DATETIME NOT NULL,
+                    memo_updated_ts INTEGER NOT NULL,
+                    memo_id INTEGER NOT NULL,
+                    resource_updated_ts INTEGER NOT NULL,
+                    resource_id INTEGER NOT NULL
+                );
+                """
+            )
+
+    def _ensure_column(self, table: str, column: str, definition: str):
+        """为早期版本创建的表补充新增的列。"""
+        columns = [row[1] for row in self.db_connection.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            self.db_connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
 
     def _get_last_memo_id(self) -> int:
         cursor = self.db_connection.cursor()
@@ -54,7 +91,7 @@ class Process:
         # 表不为空，获取最后一条记录的 start_memo_id 和 end_memo_id
         cursor.execute(
             """
-            SELECT start_memo_id, end_memo_id
+            SELECT start_memo_id, end_memo_id, checkpointed
             FROM memos_rollback
             ORDER BY id DESC
             LIMIT 1
@@ -62,7 +99,11 @@ class Process:
         )
         result = cursor.fetchone()
 
-        # 如果 start_memo_id 等于 end_memo_id，说明上一次并没有进行操作
+        # end_memo_id 与 memo 一起提交，就是最后完成的 memo_id
+        if result[2]:
+            return result[1]
+
+        # 早期版本的记录：如果 start_memo_id 等于 end_memo_id，说明上一次并没有进行操作
         if result[0] == result[1]:
             log.info("Last operation has not been completed. Returning start_memo_id - 1 as last end_memo_id.")
             return result[0] - 1
@@ -70,47 +111,149 @@ class Process:
             return result[1]
 
     def start(self) -> int:
-        """记录开始时间和开始 memo_id，初始化结束时间和结束 memo_id 为当前值。"""
+        """记录开始时间和开始 memo_id，结束 memo_id 初始化为上次完成的 memo_id。"""
         last_end_memo_id = self._get_last_memo_id()
         self.start_memo_id = last_end_memo_id + 1
         self.start_time = datetime.now()
-        self.end_mem_id = self.start_memo_id
+        self.end_memo_id = last_end_memo_id
         self.end_time = self.start_time
 
         with self.db_connection:
             self.db_connection.execute(
                 """
-                INSERT INTO memos_rollback (start_time, end_time, start_memo_id, end_memo_id)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO memos_rollback (start_time, end_time, start_memo_id, end_memo_id, checkpointed)
+                VALUES (?, ?, ?, ?, 1)
                 """,
-                (self.start_time, self.end_time, self.start_memo_id, self.end_mem_id),
+                (self.start_time, self.end_time, self.start_memo_id, self.end_memo_id),
             )
 
         log.info(f"Process started at {self.start_time} with memo_id: {self.start_memo_id}.")
 
         return self.start_memo_id
 
-    def update(self, end_memo_id: int):
-        """更新结束时间和结束 memo_id，并计算相关值。"""
+    def checkpoint(self, end_memo_id: int):
+        """
+        更新结束时间和结束 memo_id，并计算相关值，但不提交。
+
+        应在写入 memo 的同一个事务内调用，使断点与数据一起提交：进程在任何时刻被杀死，
+        下次都会从下一个未提交的 memo 开始，既不重复也不遗漏。
+        """
         self.end_time = datetime.now()
         self.end_memo_id = end_memo_id
 
         elapsed_time_h = (self.end_time - self.start_time).total_seconds() / 3600
-        progress = self.end_memo_id - self.start_memo_id
+        progress = self.end_memo_id - self.start_memo_id + 1
         efficiency = progress / elapsed_time_h if elapsed_time_h > 0 else 0
 
+        self.db_connection.execute(
+            """
+            UPDATE memos_rollback
+            SET end_time = ?, end_memo_id = ?, elapsed_time_h = ?, progress = ?, efficiency = ?, checkpointed = 1
+            WHERE id = (
+                SELECT id FROM memos_rollback
+                ORDER BY id DESC
+                LIMIT 1
+            )
+            """,
+            (self.end_time, self.end_memo_id, elapsed_time_h, progress, efficiency),
+        )
+        # 逐条迁移时每条 memo 调用一次，限流输出
+        sampled_log.debug(f"Checkpoint at {self.end_time} with memo_id: {self.end_memo_id}.", key="process_checkpoint")
+
+    def update(self, end_memo_id: int):
+        """更新结束时间和结束 memo_id，并计算相关值，单独提交。"""
+        with self.db_connection:
+            self.checkpoint(end_memo_id)
+
+    def record_metrics(self, metrics_json: str):
+        """把迁移指标（JSON）保存到最后一条记录，单独提交。"""
         with self.db_connection:
             self.db_connection.execute(
                 """
                 UPDATE memos_rollback
-                SET end_time = ?, end_memo_id = ?, elapsed_time_h = ?, progress = ?, efficiency = ?
+                SET metrics = ?
                 WHERE id = (
                     SELECT id FROM memos_rollback
                     ORDER BY id DESC
                     LIMIT 1
                 )
                 """,
-                (self.end_time, self.end_memo_id, elapsed_time_h, progress, efficiency),
+                (metrics_json,),
+            )
+
+    def get_ranges(self, name: str) -> List[tuple[int, int, int]]:
+        """获取名为 name 的任务已记录的 id 区间，按 low_id 排序，每项为 (low_id, high_id, last_id)。"""
+        cursor = self.db_connection.cursor()
+        cursor.execute(
+            """
+            SELECT low_id, high_id, last_id
+            FROM memos_rollback_range
+            WHERE name = ?
+            ORDER BY low_id ASC
+            """,
+            (name,)
+        )
+        return cursor.fetchall()
+
+    def add_ranges(self, name: str, id_ranges: List[tuple[int, int]]):
+        """记录名为 name 的任务新划分的 (low_id, high_id] 区间，last_id 初始化为 low_id。"""
+        with self.db_connection:
+            self.db_connection.executemany(
+                """
+                INSERT INTO memos_rollback_range (name, low_id, high_id, last_id)
+                VALUES (?, ?, ?, ?)
+                """,
+                [(name, low, high, low) for low, high in id_ranges],
+            )
+
+    def checkpoint_range(self, name: str, low_id: int, last_id: int):
+        """更新区间已提交的最后 id，但不提交，应在写入数据的同一个事务内调用。"""
+        self.db_connection.execute(
+            """
+            UPDATE memos_rollback_range
+            SET last_id = MAX(last_id, ?)
+            WHERE name = ? AND low_id = ?
+            """,
+            (last_id, name, low_id),
+        )
+        # 并行迁移 resource 时每条记录调用一次，限流输出
+        sampled_log.debug(f"Range {name} after {low_id} checkpoint at id: {last_id}.", key=f"range_checkpoint_{name}")
+
+    def get_sync_watermark(self) -> dict:
+        """获取上一次同步记录的高水位，从未同步时各项为 0。"""
+        cursor = self.db_connection.cursor()
+        cursor.execute(
+            """
+            SELECT memo_updated_ts, memo_id, resource_updated_ts, resource_id
+            FROM memos_rollback_sync
+            ORDER BY id DESC
+            LIMIT 1
+            """
+        )
+        result = cursor.fetchone() or (0, 0, 0, 0)
+        return {
+            "memo_updated_ts": result[0],
+            "memo_id": result[1],
+            "resource_updated_ts": result[2],
+            "resource_id": result[3],
+        }
+
+    def record_sync_watermark(self, watermark: dict):
+        """记录本次同步的高水位，应使用同步开始前读取的值，避免漏掉同步期间的修改。"""
+        sync_time = datetime.now()
+        with self.db_connection:
+            self.db_connection.execute(
+                """
+                INSERT INTO memos_rollback_sync (sync_time, memo_updated_ts, memo_id, resource_updated_ts, resource_id)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    sync_time,
+                    watermark["memo_updated_ts"],
+                    watermark["memo_id"],
+                    watermark["resource_updated_ts"],
+                    watermark["resource_id"],
+                ),
             )
 
-        log.info(f"Process updated at {self.end_time} with memo_id: {self.end_memo_id}.")
+        log.info(f"Sync watermark recorded at {sync_time}: {watermark}.")
@@ -0,0 +1,402 @@
+import hashlib
+import mimetypes
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+from config import old_database_path_v0210, old_resource_dir_v0210, creator_id
+from config import migrate_chunk_size, migrate_blob_chunk_size, migrate_batch_bytes, resource_workers, resource_queue_size
+from database import connect_read_only, iter_resource_blob, copy_resource_blob, HAS_BLOBOPEN
+from database import RESOURCE_EXTERNAL_LINK_SQL, RESOURCE_INTERNAL_PATH_SQL
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+# 常见文件头与 MIME 类型的对应关系，用于补全 type 为空的 resource
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+]
+
+_READER_DONE = object()  # 读取线程结束的标记
+RANGE_NAME = "resource"  # 在 Process 中记录区间进度时使用的名称
+
+
+def sniff_resource_type(blob: Optional[bytes], filename: str) -> str:
+    """
+    根据文件头或文件名推断 resource 的 MIME 类型。
+
+    :param blob: 二进制数据，可以为 None
+    :param filename: 文件名
+    :return resource_type: 推断出的 MIME 类型，无法推断时返回 ""。
+    """
+    if blob:
+        for magic, resource_type in MAGIC_NUMBERS:
+            if blob.startswith(magic):
+                return resource_type
+        if blob[:4] == b"RIFF" and blob[8:12] == b"WEBP":
+            return "image/webp"
+        if blob[4:8] == b"ftyp":
+            return "video/mp4"
+    return mimetypes.guess_type(filename)[0] or ""
+
+
+def resolve_internal_path(internal_path: str, resource_dir: str = old_resource_dir_v0210) -> str:
+    """
+    把本地存储 resource 的相对路径解析为本地文件路径。
+
+    :param internal_path: v0.21.0 中 reference 字段给出的路径
+    :param resource_dir: v0.21.0 的数据目录，默认在 config.py 给出；为空时不解析。
+    :return internal_path: 解析后的路径；已是绝对路径、路径为空或未配置数据目录时原样返回。
+    """
+    if not internal_path or not resource_dir or Path(internal_path).is_absolute():
+        return internal_path
+    return str(Path(resource_dir, internal_path).resolve())
+
+
+def prepare_resource_record(
+    row: tuple,
+    creator_id: int = creator_id,
+    head: Optional[bytes] = None,
+    sha256: Optional[str] = None,
+) -> dict:
+    """
+    把从 v0.21.0 读取的 resource 行转换为可写入 v0.17.1 的记录，并计算 blob 的 sha256。
+
+    :param row: (id, created_ts, updated_ts, filename, blob, external_link, type, size, internal_path, memo_id)
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param head: blob 没有读入内存（为 None）时，用于推断类型的开头若干字节，默认为 None。
+    :param sha256: blob 没有读入内存时已分块计算好的 sha256，默认为 None。
+    :return resource_record: 以 v0.17.1 resource 列名为键的字典，另含 sha256。
+    """
+    blob = row[4]
+    if sha256 is None:
+        sha256 = hashlib.sha256(blob).hexdigest() if blob is not None else ""
+    return {
+        "id": row[0],
+        "creator_id": creator_id,
+        "created_ts": row[1],
+        "updated_ts": row[2],
+        "filename": row[3],
+        "blob": blob,
+        "external_link": row[5],
+        "type": row[6] or sniff_resource_type(blob if blob is not None else head, row[3]),
+        "size": row[7],
+        "internal_path": resolve_internal_path(row[8]),
+        "memo_id": row[9],
+        "sha256": sha256,
+    }
+
+
+def split_id_ranges(
+    db_connection: sqlite3.Connection,
+    count: int,
+    after_resource_id: int = 0,
+    table: str = "resource",
+) -> List[tuple[int, int]]:
+    """
+    把 id 大于 after_resource_id 的记录按 id 均分为若干个左开右闭区间。
+
+    :param db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param count: 区间数量。
+    :param after_resource_id: 只考虑 id 大于该值的记录，默认为 0。
+    :param table: 表名，默认为 "resource"
+    :return id_ranges: (low, high] 区间的列表，没有记录时为空列表。
+    """
+    max_id = db_connection.execute(
+        f"SELECT MAX(id) FROM {table} WHERE id > ?", (after_resource_id,)
+    ).fetchone()[0]
+    if max_id is None:
+        return []
+
+    span = max(1, -(-(max_id - after_resource_id) // count))
+    return [
+        (low, min(low + span, max_id))
+        for low in range(after_resource_id, max_id, span)
+    ]
+
+
+def _read_resource_ranges(
+    db_path: str,
+    id_ranges: "queue.Queue[tuple[int, int, int]]",
+    records: "queue.Queue",
+    batch_size: int,
+    blob_chunk_size: int,
+    stop: threading.Event,
+    metrics=None,
+) -> None:
+    """
+    读取线程：使用独立的只读连接，逐个领取 (low, high, last_id) 区间，从 last_id 之后开始读取，
+    把准备好的记录（带有所属区间的 range_low）逐条放入 records 队列；区间读完后放入 ("range_done", low, high)。
+    stop 被设置（写入线程出错）时不再读取，直接结束；无论如何结束，最后都放入 _READER_DONE。
+
+    不超过 blob_chunk_size 的 blob 随记录一起放入队列；更大的 blob 只分块计算 sha256，记录中 blob 为 None，
+    由写入线程分块复制，读取线程和队列中的内存占用与 blob 的大小无关。
+    """
+    try:
+        db_connection = connect_read_only(db_path, "read_only_worker")
+        try:
+            cursor = db_connection.cursor()
+            while not stop.is_set():
+                try:
+                    low, high, last_id = id_ranges.get_nowait()
+                except queue.Empty:
+                    break
+                while True:
+                    read_s = 0.0
+                    transform_s = 0.0
+                    read_start = time.perf_counter()
+                    cursor.execute(
+                        f"""
+                        SELECT id, created_ts, updated_ts, filename, CASE WHEN length(blob) <= ? THEN blob END,
+                            {RESOURCE_EXTERNAL_LINK_SQL}, type, size, {RESOURCE_INTERNAL_PATH_SQL}, memo_id, length(blob)
+                        FROM resource
+                        WHERE id > ? AND id <= ?
+                        ORDER BY id ASC
+                        LIMIT ?
+                        """,
+                        (blob_chunk_size, last_id, high, batch_size)
+                    )
+                    rows = 0
+                    for row in cursor:
+                        transform_start = time.perf_counter()
+                        read_s += transform_start - read_start
+                        blob_size = row[10] or 0
+                        if row[4] is None and blob_size:
+                            hasher = hashlib.sha256()
+                            head = b""
+                            for data in iter_resource_blob(db_connection, row[0], blob_size, blob_chunk_size):
+                                head = head or data[:16]
+                                hasher.update(data)
+                            record = prepare_resource_record(row[:10], head=head, sha256=hasher.hexdigest())
+                        else:
+                            record = prepare_resource_record(row[:10])
+                        record["blob_size"] = blob_size
+                        record["range_low"] = low
+                        transform_s += time.perf_counter() - transform_start
+                        if stop.is_set():
+                            return
+                        records.put(record)
+                        rows += 1
+                        last_id = row[0]
+                        read_start = time.perf_counter()
+                    if metrics is not None and rows:
+                        metrics.record_stage("read", read_s)
+                        metrics.record_stage("transform", transform_s)
+                    if rows < batch_size:
+                        break
+                records.put(("range_done", low, high))
+        finally:
+            db_connection.close()
+    except Exception as e:
+        records.put(e)
+    finally:
+        records.put(_READER_DONE)
+
+
+def migrate_resource_records_parallel(
+    new_db_connection: sqlite3.Connection,
+    old_db_path: str = old_database_path_v0210,
+    after_resource_id: int = 0,
+    workers: int = resource_workers,
+    queue_size: int = resource_queue_size,
+    batch_size: int = migrate_chunk_size,
+    batch_bytes: int = migrate_batch_bytes,
+    blob_chunk_size: int = migrate_blob_chunk_size,
+    blob_store=None,
+    process=None,
+    metrics=None,
+) -> dict:
+    """
+    并行迁移 resource 记录。
+
+    多个读取线程各自持有旧数据库的只读连接，把准备好的记录（补全类型、解析本地路径、计算 sha256）
+    放入有界队列；当前线程作为唯一的写入者，按 batch_size 行或 batch_bytes 字节分批在一个事务内写入新数据库，
+    符合 SQLite 单写者的限制。大于 blob_chunk_size 的 blob 不经过队列，由写入线程从旧数据库分块复制（或分块写入文件），
+    因此内存中的 blob 最多约为 queue_size 个 blob_chunk_size 加上 batch_bytes，与 blob 的大小无关。
+
+    各区间的记录交错写入，新数据库中的最大 id 不能作为断点；给出 process 时，
+    每个区间已写入的最后 id 与该批记录在同一个事务内提交，中断后从各区间的断点继续。
+
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param old_db_path: 旧数据库的路径，默认为 old_database_path_v0210。
+    :param after_resource_id: 只迁移 id 大于该值的 resource，默认为 0。
+    :param workers: 读取线程数，默认在 config.py 给出。
+    :param queue_size: 队列的最大长度，默认在 config.py 给出。
+    :param batch_size: 每个事务写入的 resource 数量，默认在 config.py 给出。
+    :param batch_bytes: 每个事务写入的 blob 总字节数上限，默认在 config.py 给出。
+    :param blob_chunk_size: 超过该字节数的 blob 分块读取和复制，默认在 config.py 给出。
+    :param blob_store: blob_store.BlobStore 对象，默认为 None；给出时按内容去重，把 blob 写入文件。
+    :param process: process.Process 对象，默认为 None；给出时记录并恢复各区间的进度，其连接须为 new_db_connection。
+    :param metrics: metrics.MigrationMetrics 对象，默认为 None；给出时记录速率和各阶段耗时。
+    :return stats: 包含迁移行数 rows、blob 字节数 blob_bytes、耗时 elapsed_s（秒）和速率 rows_per_sec 的字典。
+    """
+    if workers <= 0 or queue_size <= 0 or batch_size <= 0 or batch_bytes <= 0 or blob_chunk_size <= 0:
+        log.error(
+            f"Invalid workers: {workers}, queue_size: {queue_size}, batch_size: {batch_size}, "
+            f"batch_bytes: {batch_bytes} or blob_chunk_size: {blob_chunk_size}"
+        )
+        raise ValueError("Invalid workers, queue_size, batch_size, batch_bytes or blob_chunk_size.")
+
+    start_time = time.perf_counter()
+    rows = 0
+    blob_bytes = 0
+
+    if process is not None and process.db_connection is not new_db_connection:
+        log.error("process 的连接与 new_db_connection 不同，无法在同一个事务内记录进度。")
+        raise ValueError("process must use new_db_connection.")
+
+    # 未完成的旧区间从断点继续，其后新增的 resource 划分为新区间
+    saved_ranges = process.get_ranges(RANGE_NAME) if process is not None else []
+    pending_ranges = [r for r in saved_ranges if r[2] < r[1]]
+    after_resource_id = max([after_resource_id] + [r[1] for r in saved_ranges])
+    db_connection = connect_read_only(old_db_path)
+    try:
+        new_ranges = split_id_ranges(db_connection, workers * 4, after_resource_id)
+        if metrics is not None:
+            source_count, source_max_id = db_connection.execute(
+                "SELECT COUNT(*), IFNULL(MAX(id), 0) FROM resource"
+            ).fetchone()
+            target_count = new_db_connection.execute("SELECT COUNT(*) FROM resource").fetchone()[0]
+            metrics.set_target("resource", max(source_count - target_count, 0), source_max_id)
+    finally:
+        db_connection.close()
+    if process is not None:
+        process.add_ranges(RANGE_NAME, new_ranges)
+    pending_ranges += [(low, high, low) for low, high in new_ranges]
+
+    id_ranges: "queue.Queue[tuple[int, int, int]]" = queue.Queue()
+    for id_range in pending_ranges:
+        id_ranges.put(id_range)
+
+    records: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_read_resource_ranges,
+            args=(old_db_path, id_ranges, records, batch_size, blob_chunk_size, stop, metrics),
+            name=f"resource-reader-{i}",
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    done_ranges = []  # 已读完、但完成标记尚未提交的区间
+    # 写入线程分块复制大 blob 时使用的只读连接
+    source_connection = connect_read_only(old_db_path, "read_only_worker")
+
+    def write_batch(batch: List[dict]) -> int:
+        """在一个事务内写入一批记录并更新区间进度，返回其中 blob 的字节数。"""
+        batch_blob_bytes = sum(r["blob_size"] for r in batch)
+        write_start = time.perf_counter()
+        streamed = []  # blob 未读入内存、写入记录后再分块复制的 resource
+        with new_db_connection:
+            for r in batch:
+                r["zeroblob_size"] = None
+                if r["blob"] is None and r["blob_size"]:
+                    if blob_store is not None:
+                        r["internal_path"] = blob_store.store_resource_blob(
+                            source_connection, r["id"], r["blob_size"], r["filename"], blob_chunk_size, r["sha256"]
+                        )
+                    else:
+                        # 有 blobopen 时预留 blob_size 字节，否则先写入空 blob，复制时整体替换
+                        r["zeroblob_size"] = r["blob_size"] if HAS_BLOBOPEN else 0
+                        streamed.append(r)
+                elif r["blob"] and blob_store is not None:
+                    r["internal_path"] = blob_store.store_bytes(r["blob"], r["sha256"], r["filename"])
+                    r["blob"] = None
+            new_db_connection.executemany(
+                """
+                INSERT OR REPLACE INTO resource (
+                    id, creator_id, created_ts, updated_ts, filename, blob,
+                    external_link, type, size, internal_path, memo_id
+                )
+                VALUES (
+                    :id, :creator_id, :created_ts, :updated_ts, :filename,
+                    CASE WHEN :zeroblob_size IS NULL THEN :blob ELSE zeroblob(:zeroblob_size) END,
+                    :external_link, :type, :size, :internal_path, :memo_id
+                )
+                """,
+                batch
+            )
+            for r in streamed:
+                copy_resource_blob(source_connection, new_db_connection, r["id"], r["blob_size"], blob_chunk_size)
+            if process is not None:
+                for r in batch:
+                    process.checkpoint_range(RANGE_NAME, r["range_low"], r["id"])
+                for low, high in done_ranges:
+                    process.checkpoint_range(RANGE_NAME, low, high)
+        done_ranges.clear()
+        if metrics is not None:
+            metrics.record_stage("write", time.perf_counter() - write_start)
+            metrics.add("resource", len(batch), batch_blob_bytes, max((r["id"] for r in batch), default=None))
+            metrics.maybe_emit()
+        return batch_blob_bytes
+
+    error = None
+    running = workers
+    batch = []
+    pending_bytes = 0
+    try:
+        while running:
+            record = records.get()
+            if record is _READER_DONE:
+                running -= 1
+                continue
+            if isinstance(record, Exception):
+                # 记录第一个错误并让其余读取线程停止，继续排空队列直到它们结束，避免阻塞在 put 上
+                error = error or record
+                stop.set()
+                continue
+            if error:
+                continue
+            if isinstance(record, tuple):
+                # 同一区间的记录先于完成标记入队，随下一批记录一起提交即可
+                done_ranges.append(record[1:])
+                continue
+            batch.append(record)
+            pending_bytes += record["blob_size"]
+            if len(batch) >= batch_size or pending_bytes >= batch_bytes:
+                blob_bytes += write_batch(batch)
+                rows += len(batch)
+                batch = []
+                pending_bytes = 0
+        if (batch or done_ranges) and not error:
+            blob_bytes += write_batch(batch)
+            rows += len(batch)
+    finally:
+        # 写入出错（包括 KeyboardInterrupt）时读取线程可能阻塞在 put 上：通知它们停止，
+        # 排空队列直到每个读取线程都放入了 _READER_DONE，再等待线程结束，不遗留线程和只读连接
+        stop.set()
+        while running:
+            if records.get() is _READER_DONE:
+                running -= 1
+        for thread in threads:
+            thread.join()
+        source_connection.close()
+
+    if error:
+        log.error(f"并行迁移 resource 时发生错误：{error}")
+        raise error
+
+    elapsed_s = time.perf_counter() - start_time
+    rows_per_sec = rows / elapsed_s if elapsed_s > 0 else 0
+    log.info(
+        f"并行迁移 resource 完成：{rows} 条，{blob_bytes} 字节，{workers} 个读取线程，"
+        f"用时 {elapsed_s:.2f} 秒，{rows_per_sec:.0f} 条/秒。"
+    )
+
+    return {
+        "rows": rows,
+        "blob_bytes": blob_bytes,
+        "elapsed_s": elapsed_s,
+        "rows_per_sec": rows_per_sec,
+    }
@@ -0,0 +1,385 @@
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
+from pathlib import Path
+from typing import List, Optional
+from config import old_database_path_v0210, creator_id
+from config import migrate_chunk_size, migrate_batch_bytes, migrate_blob_chunk_size, shard_workers, shard_temp_dir
+from blob_store import BlobStore
+from database import open_connection, finish_connection, connect_read_only
+from database import iter_limited_batches, iter_resource_blob, copy_resource_blob, HAS_BLOBOPEN
+from database import RESOURCE_EXTERNAL_LINK_SQL, RESOURCE_INTERNAL_PATH_SQL
+from memo_tags import TagCollector
+from resource_pipeline import prepare_resource_record, split_id_ranges
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+# SQLite 默认最多同时 ATTACH 10 个数据库，合并时所有分片在同一个事务内，分片数不能超过该值
+MAX_ATTACHED = 10
+
+# 分片数据库只保存转换后的记录，列与 v0.17.1 一致，不需要索引和约束
+SHARD_SCHEMA_SQL = """
+CREATE TABLE memo (
+    id INTEGER PRIMARY KEY, created_ts INTEGER, updated_ts INTEGER, creator_id INTEGER,
+    row_status TEXT, visibility TEXT, content TEXT
+);
+CREATE TABLE resource (
+    id INTEGER PRIMARY KEY, creator_id INTEGER, created_ts INTEGER, updated_ts INTEGER, filename TEXT,
+    blob BLOB, external_link TEXT, type TEXT, size INTEGER, internal_path TEXT, memo_id INTEGER
+);
+CREATE TABLE tag (name TEXT PRIMARY KEY);
+"""
+
+
+def _transform_shard(shard: dict) -> dict:
+    """
+    工作进程：读取旧数据库中一个分片的 memo 和 resource，转换后写入该分片自己的临时数据库。
+
+    memo 提取 #标签，resource 补全类型、解析本地路径、计算 sha256（配置了去重目录时把 blob 写入文件）。
+    每个进程写入不同的文件，不存在 SQLite 的写锁竞争。
+    每个事务最多 batch_size 行、约 batch_bytes 字节；超过 blob_chunk_size 的 blob 不读入内存，分块复制或写入文件。
+
+    :param shard: 由 migrate_sharded 生成的分片描述，只含可序列化的值。
+    :return stats: 包含分片序号 index、memo 行数 rows、内容字节数 content_bytes、最后的 last_memo_id、resource 行数 resource_rows、
+        最后的 last_resource_id、blob 字节数 blob_bytes 和耗时 elapsed_s（秒）的字典。
+    """
+    start_time = time.perf_counter()
+    stats = {
+        "index": shard["index"],
+        "rows": 0,
+        "content_bytes": 0,
+        "last_memo_id": None,
+        "resource_rows": 0,
+        "last_resource_id": None,
+        "blob_bytes": 0,
+        "dedup_counts": None,
+    }
+    batch_size = shard["batch_size"]
+    batch_bytes = shard["batch_bytes"]
+    blob_chunk_size = shard["blob_chunk_size"]
+    old_db_connection = connect_read_only(shard["old_db_path"], "read_only_worker")
+    shard_connection = open_connection(shard["path"], "bulk_load")
+    try:
+        shard_connection.executescript(SHARD_SCHEMA_SQL)
+        blob_store = BlobStore(shard["dedup_dir"], shard_connection) if shard["dedup_dir"] else None
+
+        if shard["memo_range"] is not None:
+            collector = TagCollector()
+            cursor = old_db_connection.execute(
+                "SELECT id, created_ts, updated_ts, content, tags FROM memo WHERE id > ? AND id <= ? ORDER BY id ASC",
+                shard["memo_range"],
+            )
+            for chunk in iter_limited_batches(cursor, batch_size, batch_bytes, size_of=lambda row: len(row[3])):
+                if shard["include_tags"]:
+                    for row in chunk:
+                        collector.add_memo(row[3], row[4])
+                with shard_connection:
+                    shard_connection.executemany(
+                        "INSERT INTO memo VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (row[0], row[1], row[2], shard["creator_id"], shard["row_status"], shard["visibility"], row[3])
+                            for row in chunk
+                        ),
+                    )
+                stats["rows"] += len(chunk)
+                stats["content_bytes"] += sum(len(row[3]) for row in chunk)
+                stats["last_memo_id"] = chunk[-1][0]
+            with shard_connection:
+                shard_connection.executemany("INSERT INTO tag (name) VALUES (?)", ((name,) for name in collector.names))
+
+        if shard["resource_range"] is not None:
+            cursor = old_db_connection.execute(
+                f"""
+                SELECT id, created_ts, updated_ts, filename, CASE WHEN length(blob) <= ? THEN blob END,
+                    {RESOURCE_EXTERNAL_LINK_SQL}, type, size, {RESOURCE_INTERNAL_PATH_SQL}, memo_id, length(blob)
+                FROM resource
+                WHERE id > ? AND id <= ?
+                ORDER BY id ASC
+                """,
+                (blob_chunk_size, *shard["resource_range"]),
+            )
+            for chunk in iter_limited_batches(cursor, batch_size, batch_bytes, size_of=lambda row: row[10] or 0):
+                records = []
+                streamed = []  # blob 未读入内存、写入记录后再分块复制的 resource
+                for row in chunk:
+                    blob_size = row[10] or 0
+                    if row[4] is None and blob_size:
+                        # 只读取开头若干字节用于推断类型
+                        head = next(iter_resource_blob(old_db_connection, row[0], blob_size, 16), b"")
+                        record = prepare_resource_record(row[:10], shard["creator_id"], head=head)
+                    else:
+                        record = prepare_resource_record(row[:10], shard["creator_id"])
+                    record["blob_size"] = blob_size
+                    records.append(record)
+                with shard_connection:
+                    for record in records:
+                        record["zeroblob_size"] = None
+                        stats["blob_bytes"] += record["blob_size"]
+                        if record["blob"] is None and record["blob_size"]:
+                            if blob_store is not None:
+                                record["internal_path"] = blob_store.store_resource_blob(
+                                    old_db_connection, record["id"], record["blob_size"], record["filename"],
+                                    blob_chunk_size,
+                                )
+                            else:
+                                # 有 blobopen 时预留 blob_size 字节，否则先写入空 blob，复制时整体替换
+                                record["zeroblob_size"] = record["blob_size"] if HAS_BLOBOPEN else 0
+                                streamed.append(record)
+                        elif record["blob"] and blob_store is not None:
+                            record["internal_path"] = blob_store.store_bytes(
+                                record["blob"], record["sha256"], record["filename"]
+                            )
+                            record["blob"] = None
+                    shard_connection.executemany(
+                        """
+                        INSERT INTO resource VALUES (
+                            :id, :creator_id, :created_ts, :updated_ts, :filename,
+                            CASE WHEN :zeroblob_size IS NULL THEN :blob ELSE zeroblob(:zeroblob_size) END,
+                            :external_link, :type, :size, :internal_path, :memo_id
+                        )
+                        """,
+                        records,
+                    )
+                    for record in streamed:
+                        copy_resource_blob(
+                            old_db_connection, shard_connection, record["id"], record["blob_size"], blob_chunk_size
+                        )
+                stats["resource_rows"] += len(chunk)
+                stats["last_resource_id"] = chunk[-1][0]
+        if blob_store is not None:
+            stats["dedup_counts"] = blob_store.counts()
+        finish_connection(shard_connection, "bulk_load")
+    finally:
+        shard_connection.close()
+        old_db_connection.close()
+
+    stats["elapsed_s"] = time.perf_counter() - start_time
+    return stats
+
+
+def _merge_shards(
+    new_db_connection: sqlite3.Connection,
+    shard_paths: List[str],
+    creator_id: int,
+    include_tags: bool,
+    include_blobs: bool,
+    process=None,
+    last_memo_id: Optional[int] = None,
+) -> None:
+    """把所有分片 ATTACH 到新数据库的连接上，在一个事务内用 INSERT ... SELECT 合并；ATTACH 不能在事务中执行。"""
+    schemas = []
+    try:
+        for index, shard_path in enumerate(shard_paths):
+            schema = f"shard_{index}"
+            new_db_connection.execute(f"ATTACH DATABASE ? AS {schema}", (shard_path,))
+            schemas.append(schema)
+
+        with new_db_connection:
+            for schema in schemas:
+                new_db_connection.execute(
+                    f"""
+                    INSERT OR REPLACE INTO main.memo (id, created_ts, updated_ts, creator_id, row_status, visibility, content)
+                    SELECT id, created_ts, updated_ts, creator_id, row_status, visibility, content
+                    FROM {schema}.memo
+                    """
+                )
+                new_db_connection.execute(
+                    f"""
+                    INSERT OR REPLACE INTO main.resource (
+                        id, creator_id, created_ts, updated_ts, filename, blob,
+                        external_link, type, size, internal_path, memo_id
+                    )
+                    SELECT id, creator_id, created_ts, updated_ts, filename, blob,
+                        external_link, type, size, internal_path, memo_id
+                    FROM {schema}.resource
+                    """
+                )
+                if include_blobs:
+                    # WHERE true 避免 ON CONFLICT 被解析为 SELECT 的连接条件
+                    new_db_connection.execute(
+                        f"""
+                        INSERT INTO main.memos_rollback_blob (sha256, path, size, ref_count)
+                        SELECT sha256, path, size, ref_count FROM {schema}.memos_rollback_blob WHERE true
+                        ON CONFLICT (sha256) DO UPDATE SET ref_count = ref_count + excluded.ref_count
+                        """
+                    )
+            if include_tags:
+                # tag 表的 UNIQUE 约束可能被推迟建立，跨分片去重后再写入
+                tag_names = " UNION ".join(f"SELECT name FROM {schema}.tag" for schema in schemas)
+                new_db_connection.execute(
+                    f"""
+                    INSERT OR IGNORE INTO main.tag (name, creator_id)
+                    SELECT name, ? FROM ({tag_names}) AS shard_tag
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM main.tag WHERE tag.name = shard_tag.name AND tag.creator_id = ?
+                    )
+                    """,
+                    (creator_id, creator_id),
+                )
+            if process is not None and last_memo_id is not None:
+                process.checkpoint(last_memo_id)
+    finally:
+        for schema in schemas:
+            new_db_connection.execute(f"DETACH DATABASE {schema}")
+
+
+def migrate_sharded(
+    new_db_connection: sqlite3.Connection,
+    old_db_path: str = old_database_path_v0210,
+    after_memo_id: int = 0,
+    after_resource_id: int = 0,
+    workers: int = shard_workers,
+    temp_dir: str = shard_temp_dir,
+    batch_size: int = migrate_chunk_size,
+    batch_bytes: int = migrate_batch_bytes,
+    blob_chunk_size: int = migrate_blob_chunk_size,
+    creator_id: int = creator_id,
+    row_status: str = "NORMAL",
+    visibility: str = "PRIVATE",
+    include_tags: bool = True,
+    dedup_dir: str = "",
+    process=None,
+    metrics=None,
+) -> dict:
+    """
+    以多进程分片的方式迁移 memo、resource 和标签。
+
+    把 memo 和 resource 的 id 分别均分为 workers 个区间，每个工作进程处理一对区间：以只读连接读取旧数据库，
+    转换后写入自己的临时数据库，转换不受 GIL 限制，写入也没有 SQLite 单写者的竞争。
+    全部分片完成后，当前进程把它们 ATTACH 到新数据库的连接上，在一个事务内合并，合并要么全部完成、要么全部不生效。
+    临时数据库中含有 resource 的 blob，temp_dir 需要有与旧数据库相当的空闲空间。
+
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象，调用时不能处于事务中。
+    :param old_db_path: 旧数据库的路径，默认为 old_database_path_v0210。
+    :param after_memo_id: 只迁移 id 大于该值的 memo，默认为 0。
+    :param after_resource_id: 只迁移 id 大于该值的 resource，默认为 0。
+    :param workers: 工作进程数即分片数，默认在 config.py 给出，不能超过 MAX_ATTACHED。
+    :param temp_dir: 存放临时数据库的目录，默认在 config.py 给出；为空时使用新数据库所在的目录。
+    :param batch_size: 工作进程每个事务写入的记录数，默认在 config.py 给出。
+    :param batch_bytes: 工作进程每个事务读入内存的 memo 内容或 blob 的字节数上限，默认在 config.py 给出。
+    :param blob_chunk_size: 超过该字节数的 blob 不读入内存，按该大小分块复制，默认在 config.py 给出。
+    :param creator_id: 创建者 ID，默认在 config.py 给出。
+    :param row_status: memo 行状态，默认为 "NORMAL"
+    :param visibility: memo 可见性，默认为 "PRIVATE"
+    :param include_tags: 是否同时提取 #标签 写入 tag 表，默认为 True。
+    :param dedup_dir: 非空时按内容去重，工作进程把 blob 写入该目录（文件已存在时不再写入），合并时汇总哈希索引，
+        结束时记录各分片合计的去重统计，默认为 ""
+    :param process: process.Process 对象，默认为 None；给出时最后的 memo_id 与合并在同一个事务内提交，
+        其连接须为 new_db_connection。
+    :param metrics: metrics.MigrationMetrics 对象，默认为 None；给出时记录速率和各阶段耗时。
+    :return stats: 包含 memo 行数 rows、resource 行数 resource_rows、blob 字节数 blob_bytes、
+        耗时 elapsed_s（秒）和速率 rows_per_sec 的字典。
+    """
+    if workers <= 0 or workers > MAX_ATTACHED or batch_size <= 0 or batch_bytes <= 0 or blob_chunk_size <= 0:
+        log.error(
+            f"Invalid workers: {workers} (1 - {MAX_ATTACHED}), batch_size: {batch_size}, "
+            f"batch_bytes: {batch_bytes} or blob_chunk_size: {blob_chunk_size}"
+        )
+        raise ValueError("Invalid workers, batch_size, batch_bytes or blob_chunk_size.")
+    if process is not None and process.db_connection is not new_db_connection:
+        log.error("process 的连接与 new_db_connection 不同，无法在同一个事务内记录断点。")
+        raise ValueError("process must use new_db_connection.")
+
+    start_time = time.perf_counter()
+    db_connection = connect_read_only(old_db_path)
+    try:
+        memo_ranges = split_id_ranges(db_connection, workers, after_memo_id, table="memo")
+        resource_ranges = split_id_ranges(db_connection, workers, after_resource_id)
+        if metrics is not None:
+            for table, after_id in (("memo", after_memo_id), ("resource", after_resource_id)):
+                total_rows, source_max_id = db_connection.execute(
+                    f"SELECT COUNT(*), IFNULL(MAX(id), 0) FROM {table} WHERE id > ?", (after_id,)
+                ).fetchone()
+                metrics.set_target(table, total_rows, source_max_id)
+    finally:
+        db_connection.close()
+
+    # 在新数据库中建立哈希索引表，合并时汇总各分片的索引；各工作进程的去重计数汇总到这里
+    blob_store = BlobStore(dedup_dir, new_db_connection) if dedup_dir else None
+    if temp_dir:
+        Path(temp_dir).mkdir(parents=True, exist_ok=True)
+    else:
+        # 与新数据库放在同一个磁盘上，合并时不必跨磁盘读取
+        new_db_path = new_db_connection.execute("PRAGMA database_list").fetchone()[2]
+        temp_dir = str(Path(new_db_path).resolve().parent)
+
+    with tempfile.TemporaryDirectory(prefix="memos_rollback_shards_", dir=temp_dir) as shard_dir:
+        shards = [
+            {
+                "index": index,
+                "path": str(Path(shard_dir, f"shard_{index}.db")),
+                "old_db_path": old_db_path,
+                "memo_range": memo_range,
+                "resource_range": resource_range,
+                "batch_size": batch_size,
+                "batch_bytes": batch_bytes,
+                "blob_chunk_size": blob_chunk_size,
+                "creator_id": creator_id,
+                "row_status": row_status,
+                "visibility": visibility,
+                "include_tags": include_tags,
+                "dedup_dir": dedup_dir,
+            }
+            for index, (memo_range, resource_range) in enumerate(zip_longest(memo_ranges, resource_ranges))
+        ]
+        if not shards:
+            log.info("没有需要迁移的 memo 和 resource。")
+            return {"rows": 0, "resource_rows": 0, "blob_bytes": 0, "elapsed_s": 0, "rows_per_sec": 0}
+
+        shard_stats = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            for stats in executor.map(_transform_shard, shards):
+                shard_stats.append(stats)
+                log.debug(
+                    f"分片 {stats['index']} 转换完成：{stats['rows']} 条 memo，{stats['resource_rows']} 条 resource，"
+                    f"用时 {stats['elapsed_s']:.2f} 秒。"
+                )
+                if blob_store is not None:
+                    blob_store.add_counts(stats["dedup_counts"])
+                if metrics is not None:
+                    metrics.record_stage("transform", stats["elapsed_s"])
+                    metrics.maybe_emit()
+
+        merge_start = time.perf_counter()
+        last_memo_id = max((s["last_memo_id"] for s in shard_stats if s["last_memo_id"] is not None), default=None)
+        _merge_shards(
+            new_db_connection=new_db_connection,
+            shard_paths=[shard["path"] for shard in shards],
+            creator_id=creator_id,
+            include_tags=include_tags,
+            include_blobs=bool(dedup_dir),
+            process=process,
+            last_memo_id=last_memo_id,
+        )
+        merge_s = time.perf_counter() - merge_start
+    if blob_store is not None:
+        blob_store.report()
+
+    rows = sum(s["rows"] for s in shard_stats)
+    resource_rows = sum(s["resource_rows"] for s in shard_stats)
+    blob_bytes = sum(s["blob_bytes"] for s in shard_stats)
+    if metrics is not None:
+        metrics.record_stage("write", merge_s)
+        metrics.add("memo", rows, sum(s["content_bytes"] for s in shard_stats), last_memo_id)
+        last_resource_id = max(
+            (s["last_resource_id"] for s in shard_stats if s["last_resource_id"] is not None), default=None
+        )
+        metrics.add("resource", resource_rows, blob_bytes, last_resource_id)
+
+    elapsed_s = time.perf_counter() - start_time
+    rows_per_sec = (rows + resource_rows) / elapsed_s if elapsed_s > 0 else 0
+    log.info(
+        f"分片迁移完成：{len(shards)} 个分片，{rows} 条 memo，{resource_rows} 条 resource，{blob_bytes} 字节，"
+        f"合并用时 {merge_s:.2f} 秒，总用时 {elapsed_s:.2f} 秒，{rows_per_sec:.0f} 条/秒。"
+    )
+
+    return {
+        "rows": rows,
+        "resource_rows": resource_rows,
+        "blob_bytes": blob_bytes,
+        "elapsed_s": elapsed_s,
+        "rows_per_sec": rows_per_sec,
+    }
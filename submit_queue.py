@@ -0,0 +1,223 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from config import new_database_path_v0171, creator_id
+from config import submit_journal_path, submit_flush_interval_s, submit_max_batch
+from database import open_connection, upsert_memo_record
+from utils import get_configured_logger, ensure_directory_exists_for_file
+
+log = get_configured_logger()
+
+
+class SubmitQueue:
+    """
+    界面提交 memo 的写入队列
+
+    submit 只把记录追加到日志文件（journal，写入后 fsync）并放入内存队列，立即返回；
+    后台写入线程每 flush_interval_s 秒、或队列达到 max_batch 条时，把队列中的记录合并到一个事务内写入新数据库，
+    提交成功后再从日志文件中移除。程序崩溃后重新创建队列时，会从日志文件恢复尚未写入的记录。
+    同一个 memo 在写入前被多次提交时，只写入最后一次。
+    """
+
+    def __init__(
+        self,
+        db_path: str = new_database_path_v0171,
+        journal_path: str = submit_journal_path,
+        flush_interval_s: float = submit_flush_interval_s,
+        max_batch: int = submit_max_batch,
+        on_flush: Optional[Callable[[List[int]], None]] = None,
+        search_index=None,
+    ):
+        """
+        :param db_path: 新数据库 (v0.17.1) 的路径，默认为 new_database_path_v0171。
+        :param journal_path: 日志文件的路径，默认在 config.py 给出。
+        :param flush_interval_s: 两次写入之间的最长间隔（秒），默认在 config.py 给出。
+        :param max_batch: 队列达到该条数时立即写入，默认在 config.py 给出。
+        :param on_flush: 每次写入提交后在写入线程中调用，参数为写入的 memo_id 列表。
+        :param search_index: memo_search.MemoSearchIndex 对象，默认为 None；给出时每次写入后同步更新全文索引。
+        """
+        if flush_interval_s <= 0 or max_batch <= 0:
+            log.error(f"Invalid flush_interval_s: {flush_interval_s} or max_batch: {max_batch}")
+            raise ValueError("Invalid flush_interval_s or max_batch.")
+        self.db_path = db_path
+        self.journal_path = Path(journal_path)
+        self.flush_interval_s = flush_interval_s
+        self.max_batch = max_batch
+        self.on_flush = on_flush
+        self.search_index = search_index
+
+        self._condition = threading.Condition()
+        # memo_id -> (序号, 记录)；序号用于判断写入期间是否又有新的提交
+        self._pending: Dict[int, tuple] = {}
+        self._sequence = 0
+        self._writing = False
+        self._flush_requested = False
+        self._closed = False
+
+        ensure_directory_exists_for_file(str(self.journal_path))
+        self._recover_journal()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+        self._writer = threading.Thread(target=self._run, name="submit_queue", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _recover_journal(self):
+        """读取上次未写入的记录；最后一行可能在崩溃时只写了一半，忽略无法解析的行。"""
+        if not self.journal_path.is_file():
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._sequence += 1
+                self._pending[record["memo_id"]] = (self._sequence, record)
+        if self._pending:
+            log.info(f"从 {self.journal_path} 恢复 {len(self._pending)} 条未写入的 memo。")
+
+    def _rewrite_journal(self):
+        """只保留仍在队列中的记录，调用时须持有 _condition。"""
+        self._journal.close()
+        temp_path = self.journal_path.with_suffix(".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for _, record in sorted(self._pending.values(), key=lambda item: item[0]):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def submit(
+        self,
+        memo_id: int,
+        created_ts: int,
+        updated_ts: int,
+        content: str,
+        creator_id: int = creator_id,
+        row_status: str = "NORMAL",
+        visibility: str = "PRIVATE",
+    ) -> None:
+        """
+        提交一条 memo，参数同 database.upsert_memo_record；只写日志文件，不等待数据库。
+        """
+        record = {
+            "memo_id": memo_id,
+            "created_ts": created_ts,
+            "updated_ts": updated_ts,
+            "content": content,
+            "creator_id": creator_id,
+            "row_status": row_status,
+            "visibility": visibility,
+        }
+        with self._condition:
+            if self._closed:
+                log.error("SubmitQueue is closed.")
+                raise ValueError("SubmitQueue is closed.")
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            # 只 flush 时记录在进程崩溃后仍在，fsync 之后断电或系统崩溃也不会丢失
+            os.fsync(self._journal.fileno())
+            self._sequence += 1
+            self._pending[memo_id] = (self._sequence, record)
+            if len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+    def _write_batch(self, db_connection: sqlite3.Connection, batch: Dict[int, tuple]) -> None:
+        with db_connection:
+            for _, record in batch.values():
+                upsert_memo_record(db_connection=db_connection, commit=False, **record)
+
+    def _run(self):
+        db_connection = None
+        try:
+            while True:
+                with self._condition:
+                    deadline = time.monotonic() + self.flush_interval_s
+                    while not (self._closed or self._flush_requested or len(self._pending) >= self.max_batch):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    if not self._pending:
+                        self._flush_requested = False
+                        self._condition.notify_all()
+                        if self._closed:
+                            return
+                        continue
+                    batch = dict(self._pending)
+                    self._writing = True
+
+                try:
+                    if db_connection is None:
+                        db_connection = open_connection(self.db_path, "default")
+                    self._write_batch(db_connection, batch)
+                except Exception as e:
+                    # 记录仍在队列和日志文件中，下一次再试
+                    log.error(f"写入 {len(batch)} 条提交的 memo 失败：{e}")
+                    with self._condition:
+                        self._writing = False
+                        self._flush_requested = False
+                        self._condition.notify_all()
+                        if self._closed:
+                            return
+                    continue
+
+                with self._condition:
+                    for memo_id, (sequence, _) in batch.items():
+                        # 写入期间又被提交的 memo 留在队列中
+                        if self._pending.get(memo_id, (None,))[0] == sequence:
+                            del self._pending[memo_id]
+                    self._rewrite_journal()
+                    self._writing = False
+                    self._condition.notify_all()
+                log.debug(f"已写入 {len(batch)} 条提交的 memo。")
+                if self.search_index is not None:
+                    try:
+                        self.search_index.update_many(
+                            (memo_id, record["content"]) for memo_id, (_, record) in batch.items()
+                        )
+                    except sqlite3.Error as e:
+                        log.error(f"更新全文索引失败：{e}")
+                if self.on_flush is not None:
+                    self.on_flush(list(batch))
+        finally:
+            if db_connection is not None:
+                db_connection.close()
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        立即写入队列中的记录并等待完成
+
+        :param timeout: 最长等待时间（秒），默认为 None，即一直等待
+        :return bool: 队列已清空时返回 True；超时或写入失败时返回 False。
+        """
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(
+                lambda: not self._writing and not self._flush_requested, timeout
+            ) and not self._pending
+
+    def close(self):
+        """写入剩余的记录，停止写入线程并关闭日志文件；程序退出时自动调用。"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        with self._condition:
+            self._journal.close()
+            if not self._pending:
+                self.journal_path.unlink(missing_ok=True)
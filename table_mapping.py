@@ -0,0 +1,306 @@
+import json
+import sqlite3
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from config import migrate_chunk_size, migrate_tables, creator_id
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _get_columns(db_connection: sqlite3.Connection, table: str) -> List[str]:
+    """表的列名列表，表不存在时为空列表。"""
+    return [row[1] for row in db_connection.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+class CompiledMapping:
+    """TableMapping 按两边实际的表结构编译出的批量读取与写入语句。"""
+
+    def __init__(
+        self,
+        select_sql: str,
+        insert_sql: str,
+        target_columns: List[str],
+        transforms: List[Tuple[int, Callable]],
+    ):
+        self.select_sql = select_sql
+        self.insert_sql = insert_sql
+        self.target_columns = target_columns
+        self.transforms = transforms
+
+
+class TableMapping:
+    """
+    一张表从 v0.21.0 到 v0.17.1 的声明式映射
+
+    两边同名的列自动对应（如 v0.21.0 user 多出的 description 列会被忽略），
+    columns 给出改名或需要 SQL 表达式的列，constants 给出常量列，transforms 给出在 Python 中对读出的值进行转换的函数，
+    row_transform 给出按整行转换的函数（可以把一行拆成多行或丢弃）。
+    常量在 SELECT 中以参数给出，没有 transforms 和 row_transform 时读出的行可原样交给 executemany。
+    """
+
+    def __init__(
+        self,
+        target_table: str,
+        source_table: Optional[str] = None,
+        columns: Optional[Dict[str, str]] = None,
+        constants: Optional[Dict[str, object]] = None,
+        transforms: Optional[Dict[str, Callable]] = None,
+        row_transform: Optional[Callable[[dict], Iterable[dict]]] = None,
+        replace_all: bool = False,
+    ):
+        """
+        :param target_table: v0.17.1 中的表名。
+        :param source_table: v0.21.0 中的表名，默认与 target_table 相同。
+        :param columns: 目标列名 -> 源表的列名或 SQL 表达式，默认为 None，即只使用同名的列。
+        :param constants: 目标列名 -> 常量，默认为 None。
+        :param transforms: 目标列名 -> 函数，参数为该列读出的值，返回写入的值，默认为 None。
+        :param row_transform: 在 transforms 之后调用，参数为以目标列名为键的字典，返回要写入的零到多个同样的字典，
+            默认为 None。
+        :param replace_all: 目标表没有 id 主键时设为 True，在同一个事务内清空目标表并重新写入，重复执行不会产生重复的行；
+            否则以 INSERT OR REPLACE 按主键覆盖，默认为 False。
+        """
+        self.target_table = target_table
+        self.source_table = source_table or target_table
+        self.columns = dict(columns or {})
+        self.constants = dict(constants or {})
+        self.transforms = dict(transforms or {})
+        self.row_transform = row_transform
+        self.replace_all = replace_all
+
+        overlap = (self.columns.keys() | self.transforms.keys()) & self.constants.keys()
+        if overlap:
+            log.error(f"表 {target_table} 的列 {sorted(overlap)} 同时被声明为常量和源列或转换。")
+            raise ValueError("A constant column cannot also be mapped or transformed.")
+
+    def compile(self, source_connection: sqlite3.Connection, target_connection: sqlite3.Connection) -> CompiledMapping:
+        """
+        按两边实际的表结构生成 SQL
+
+        :param source_connection: 已连接的旧数据库 (v0.21.0) 对象。
+        :param target_connection: 已连接的新数据库 (v0.17.1) 对象。
+        :return CompiledMapping: 读取语句按 rowid 分页，参数为常量之后加上 (上一页最后的 rowid, 条数)，每行第一列为 rowid。
+        """
+        source_columns = set(_get_columns(source_connection, self.source_table))
+        target_columns = _get_columns(target_connection, self.target_table)
+        if not source_columns or not target_columns:
+            log.error(f"表 {self.source_table} 或 {self.target_table} 不存在。")
+            raise ValueError("Source or target table does not exist.")
+
+        selected = []  # (目标列, SELECT 中的表达式)
+        for column in target_columns:
+            if column in self.constants:
+                selected.append((column, "?"))
+            elif column in self.columns:
+                selected.append((column, self.columns[column]))
+            elif column in source_columns:
+                selected.append((column, _quote(column)))
+        unmapped = (self.columns.keys() | self.transforms.keys()) - {column for column, _ in selected}
+        if unmapped:
+            log.error(f"表 {self.target_table} 中没有列 {sorted(unmapped)}。")
+            raise ValueError("Mapped column does not exist in target table.")
+
+        names = [column for column, _ in selected]
+        select_sql = (
+            f"SELECT rowid, {', '.join(expression for _, expression in selected)} "
+            f"FROM {_quote(self.source_table)} WHERE rowid > ? ORDER BY rowid ASC LIMIT ?"
+        )
+        insert_sql = (
+            f"INSERT OR REPLACE INTO {_quote(self.target_table)} ({', '.join(_quote(name) for name in names)}) "
+            f"VALUES ({', '.join('?' for _ in names)})"
+        )
+        transforms = [(names.index(column), function) for column, function in self.transforms.items()]
+        return CompiledMapping(select_sql, insert_sql, names, transforms)
+
+    def constant_params(self, compiled: CompiledMapping) -> tuple:
+        """SELECT 中常量参数的值，按出现的顺序。"""
+        return tuple(self.constants[column] for column in compiled.target_columns if column in self.constants)
+
+
+# v0.21.0 user_setting 的 key 到 v0.17.1 的 key；v0.17.1 的值是 JSON 编码的字符串，ACCESS_TOKENS 等没有对应的设置不迁移
+USER_SETTING_KEYS = {
+    "LOCALE": "locale",
+    "APPEARANCE": "appearance",
+    "MEMO_VISIBILITY": "memo-visibility",
+}
+# v0.21.0 STORAGE 设置的 storageType 到 v0.17.1 storage-service-id 的值，S3 的配置不在 storage 表中，不迁移
+STORAGE_SERVICE_IDS = {
+    "DATABASE": 0,
+    "LOCAL": -1,
+}
+
+
+def _convert_user_setting(row: dict) -> Iterator[dict]:
+    key = USER_SETTING_KEYS.get(row["key"])
+    if key is None:
+        return
+    value = row["value"]
+    # 兼容已经是 JSON 字符串的值
+    if not (value.startswith('"') and value.endswith('"')):
+        value = json.dumps(value)
+    yield {**row, "key": key, "value": value}
+
+
+def _convert_system_setting(row: dict) -> Iterator[dict]:
+    """
+    v0.21.0 把同类设置合并为一条 JSON（protojson，值为默认值的字段省略），v0.17.1 每个设置一行、值为 JSON。
+    BASIC（secretKey）等没有对应格式的设置不迁移，v0.17.1 启动时会自行生成。
+    """
+    try:
+        value = json.loads(row["value"])
+    except ValueError:
+        log.warning(f"无法解析系统设置 {row['name']} 的值，跳过。")
+        return
+    if not isinstance(value, dict):
+        return
+
+    settings = {}
+    if row["name"] == "GENERAL":
+        settings["allow-signup"] = not value.get("disallowSignup", False)
+        settings["disable-password-login"] = value.get("disallowPasswordLogin", False)
+        settings["additional-style"] = value.get("additionalStyle", "")
+        settings["additional-script"] = value.get("additionalScript", "")
+        if "customProfile" in value:
+            profile = value["customProfile"]
+            settings["customized-profile"] = {
+                "name": profile.get("title", ""),
+                "logoUrl": profile.get("logoUrl", ""),
+                "description": profile.get("description", ""),
+                "locale": profile.get("locale", ""),
+                "appearance": profile.get("appearance", ""),
+                "externalUrl": "",
+            }
+    elif row["name"] == "MEMO_RELATED":
+        settings["disable-public-memos"] = value.get("disallowPublicVisible", False)
+        settings["memo-display-with-updated-ts"] = value.get("displayWithUpdateTime", False)
+    elif row["name"] == "STORAGE":
+        if "uploadSizeLimitMb" in value:
+            settings["max-upload-size-mib"] = int(value["uploadSizeLimitMb"])
+        if "localStoragePathTemplate" in value:
+            settings["local-storage-path"] = value["localStoragePathTemplate"]
+        if value.get("storageType", "DATABASE") in STORAGE_SERVICE_IDS:
+            settings["storage-service-id"] = STORAGE_SERVICE_IDS[value.get("storageType", "DATABASE")]
+
+    for name, setting in settings.items():
+        yield {**row, "name": name, "value": json.dumps(setting, ensure_ascii=False), "description": ""}
+
+
+# 除 memo、resource 和 tag 以外两个版本共有、需要迁移的表；memo 和 resource 需要断点续传和 blob 分块复制，仍由专门的函数迁移
+TABLE_MAPPINGS: Dict[str, TableMapping] = {
+    mapping.target_table: mapping
+    for mapping in (
+        TableMapping("system_setting", row_transform=_convert_system_setting, replace_all=True),
+        TableMapping("user"),
+        TableMapping("user_setting", row_transform=_convert_user_setting, replace_all=True),
+        # memo 的 creator_id 统一为 config.py 中的 creator_id，置顶也归属于该用户
+        TableMapping("memo_organizer", constants={"user_id": creator_id}, replace_all=True),
+        TableMapping("memo_relation", replace_all=True),
+        TableMapping("activity"),
+        TableMapping("storage"),
+    )
+}
+
+
+def _iter_batches(
+    mapping: TableMapping,
+    compiled: CompiledMapping,
+    old_db_connection: sqlite3.Connection,
+    batch_size: int,
+) -> Iterator[List[tuple]]:
+    """按 rowid 分页读取并转换，每次产出一页要写入的行。"""
+    constants = mapping.constant_params(compiled)
+    names = compiled.target_columns
+    last_rowid = 0
+    while True:
+        result = old_db_connection.execute(compiled.select_sql, constants + (last_rowid, batch_size)).fetchall()
+        if not result:
+            return
+        last_rowid = result[-1][0]
+        if not compiled.transforms and mapping.row_transform is None:
+            yield [row[1:] for row in result]
+            continue
+        batch = []
+        for row in result:
+            values = list(row[1:])
+            for index, function in compiled.transforms:
+                values[index] = function(values[index])
+            if mapping.row_transform is None:
+                batch.append(values)
+            else:
+                for record in mapping.row_transform(dict(zip(names, values))):
+                    batch.append(tuple(record[name] for name in names))
+        yield batch
+
+
+def migrate_table(
+    mapping: TableMapping,
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    batch_size: int = migrate_chunk_size,
+) -> dict:
+    """
+    按映射流式迁移一张表
+
+    按 rowid 分页读取，每页在一个事务内用 executemany 写入；replace_all 的表清空与全部写入在同一个事务内，
+    失败时保留原有的行。
+
+    :param mapping: TableMapping 对象。
+    :param old_db_connection: 已连接的旧数据库 (v0.21.0) 对象。
+    :param new_db_connection: 已连接的新数据库 (v0.17.1) 对象。
+    :param batch_size: 每个事务写入的行数，默认在 config.py 给出。
+    :return stats: 包含迁移行数 rows 和耗时 elapsed_s（秒）的字典。
+    """
+    if batch_size <= 0:
+        log.error(f"Invalid batch_size: {batch_size}")
+        raise ValueError("Invalid batch_size.")
+
+    start_time = time.perf_counter()
+    compiled = mapping.compile(old_db_connection, new_db_connection)
+    rows = 0
+    if mapping.replace_all:
+        with new_db_connection:
+            new_db_connection.execute(f"DELETE FROM {_quote(mapping.target_table)}")
+            for batch in _iter_batches(mapping, compiled, old_db_connection, batch_size):
+                new_db_connection.executemany(compiled.insert_sql, batch)
+                rows += len(batch)
+    else:
+        for batch in _iter_batches(mapping, compiled, old_db_connection, batch_size):
+            with new_db_connection:
+                new_db_connection.executemany(compiled.insert_sql, batch)
+            rows += len(batch)
+
+    elapsed_s = time.perf_counter() - start_time
+    log.debug(f"表 {mapping.target_table} 迁移完成：{rows} 行，用时 {elapsed_s:.2f} 秒。")
+    return {"rows": rows, "elapsed_s": elapsed_s}
+
+
+def migrate_mapped_tables(
+    old_db_connection: sqlite3.Connection,
+    new_db_connection: sqlite3.Connection,
+    tables: Iterable[str] = migrate_tables,
+    batch_size: int = migrate_chunk_size,
+) -> Dict[str, int]:
+    """
+    按 TABLE_MAPPINGS 迁移多张表，旧数据库中不存在的表跳过
+
+    :param tables: 表名列表，默认在 config.py 给出。
+    :return dict: 表名 -> 迁移的行数。
+    """
+    unknown = [table for table in tables if table not in TABLE_MAPPINGS]
+    if unknown:
+        log.error(f"没有表 {unknown} 的映射，可在 table_mapping.TABLE_MAPPINGS 中添加。")
+        raise ValueError("Unknown table mapping.")
+
+    result = {}
+    for table in tables:
+        mapping = TABLE_MAPPINGS[table]
+        if not _get_columns(old_db_connection, mapping.source_table):
+            log.warning(f"旧数据库中没有表 {mapping.source_table}，跳过。")
+            continue
+        result[table] = migrate_table(mapping, old_db_connection, new_db_connection, batch_size)["rows"]
+    log.info("其他表迁移完成：" + "，".join(f"{table} {rows} 行" for table, rows in result.items()) + "。")
+    return result
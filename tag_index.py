@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+from importlib import reload
+from types import MappingProxyType
+from typing import Optional, Tuple
+import config
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+TagPath = Tuple[str, ...]
+ROOT_PATH: TagPath = ()
+
+
+class TagIndex:
+    """
+    tags_dict 编译后的只读索引，支持任意层级
+
+    tags_dict 的值为字符串时是标签（叶子），为字典时是下一级分组。
+    每个节点用从根开始的键组成的元组表示，如 ("Tag1", "Tag1-1")。
+    """
+
+    __slots__ = ("tags", "children")
+
+    def __init__(self, tags_dict: dict):
+        """
+        :param tags_dict: 标签字典，格式同 config.tags_dict
+        """
+        tags = {}
+        children = {}
+        stack = [(ROOT_PATH, tags_dict)]
+        while stack:
+            path, node = stack.pop()
+            names = []
+            for key, value in node.items():
+                child_path = path + (key,)
+                names.append(key)
+                if isinstance(value, str):
+                    tags[child_path] = value
+                elif isinstance(value, dict):
+                    stack.append((child_path, value))
+                else:
+                    log.error(f"Invalid tag value at {'/'.join(child_path)}: {value!r}")
+                    raise ValueError("Invalid tag value in tags_dict.")
+            children[path] = tuple(names)
+
+        # path -> 标签字符串；path -> 子节点的键（保持 tags_dict 中的顺序）
+        self.tags = MappingProxyType(tags)
+        self.children = MappingProxyType(children)
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def is_leaf(self, path: TagPath) -> bool:
+        return path in self.tags
+
+    def get_tag(self, path: TagPath) -> str:
+        return self.tags[path]
+
+    def get_children(self, path: TagPath = ROOT_PATH) -> Tuple[str, ...]:
+        """返回 path 下一级的键，path 为叶子或不存在时返回空元组。"""
+        return self.children.get(path, ())
+
+
+_cache_lock = threading.Lock()
+_cached_index: Optional[TagIndex] = None
+_cached_stat: Optional[Tuple[int, int]] = None
+_cached_digest: Optional[str] = None
+
+
+def load_tag_index() -> TagIndex:
+    """
+    获取 config.tags_dict 编译后的索引
+
+    只有 config.py 的修改时间或大小变化、并且内容的哈希也变化时，才重新加载 config 并重新编译；
+    否则返回同一个 TagIndex 对象，调用方可以用 is 判断标签是否有变化。
+
+    :return TagIndex: 标签索引
+    """
+    global _cached_index, _cached_stat, _cached_digest
+    config_path = config.__file__
+    with _cache_lock:
+        stat = os.stat(config_path)
+        current_stat = (stat.st_mtime_ns, stat.st_size)
+        if _cached_index is not None and current_stat == _cached_stat:
+            return _cached_index
+
+        with open(config_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _cached_stat = current_stat
+        if _cached_index is not None and digest == _cached_digest:
+            return _cached_index
+
+        if _cached_index is not None:
+            reload(config)
+            log.info("Reloaded tags_dict")
+        _cached_index = TagIndex(config.tags_dict)
+        _cached_digest = digest
+        return _cached_index
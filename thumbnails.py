@@ -0,0 +1,158 @@
+import base64
+import os
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Callable, Optional
+from config import old_database_path_v0210, thumbnail_cache_dir, thumbnail_size, thumbnail_workers
+from database import connect_read_only
+from resource_pipeline import resolve_internal_path
+from utils import get_configured_logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 是可选依赖，没有时界面直接显示原图
+    Image = None
+    ImageOps = None
+
+log = get_configured_logger()
+
+
+class ThumbnailCache:
+    """
+    resource 图片的缩略图缓存
+
+    从 resource 的 blob 或本地文件生成高度为 size 的缩略图，以 {resource_id}_{size}.jpg 保存在 cache_dir 中，
+    生成在后台线程池中进行。没有安装 Pillow 时不生成缩略图，get / request 返回 None。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = thumbnail_cache_dir,
+        size: int = thumbnail_size,
+        workers: int = thumbnail_workers,
+        db_path: str = old_database_path_v0210,
+    ):
+        """
+        :param cache_dir: 缩略图缓存目录，默认在 config.py 给出。
+        :param size: 缩略图的高度（像素），默认在 config.py 给出；宽度不超过高度的 3 倍。
+        :param workers: 生成缩略图的线程数，默认在 config.py 给出。
+        :param db_path: 读取 resource blob 的数据库 (v0.21.0) 路径，默认为 old_database_path_v0210。
+        """
+        if size <= 0 or workers <= 0:
+            log.error(f"Invalid size: {size} or workers: {workers}")
+            raise ValueError("Invalid size or workers.")
+        self.cache_dir = Path(cache_dir)
+        self.size = size
+        self.db_path = db_path
+        self.enabled = Image is not None
+        if not self.enabled:
+            log.warning("未安装 Pillow，不生成缩略图，将直接显示原图。")
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._local = threading.local()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def thumbnail_path(self, resource_id: int) -> Path:
+        return self.cache_dir / f"{resource_id}_{self.size}.jpg"
+
+    @staticmethod
+    def is_image(resource: dict) -> bool:
+        return str(resource.get("type", "")).startswith("image/")
+
+    @staticmethod
+    def local_path(resource: dict) -> str:
+        """resource 的本地文件路径，兼容 v0.17.1 的 internal_path 和 v0.21.0 的 storage_type / reference。"""
+        if resource.get("internal_path"):
+            return resource["internal_path"]
+        if resource.get("storage_type") == "LOCAL":
+            return resolve_internal_path(resource.get("reference", ""))
+        return ""
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # 每个工作线程使用自己的只读连接
+        if getattr(self._local, "db_connection", None) is None:
+            self._local.db_connection = connect_read_only(self.db_path)
+        return self._local.db_connection
+
+    def read_original(self, resource: dict) -> Optional[bytes]:
+        """读取 resource 的原图：优先使用记录中的 blob，其次本地文件，最后按 resource_id 从数据库读取。"""
+        if resource.get("blob"):
+            return resource["blob"]
+        local_path = self.local_path(resource)
+        if local_path:
+            try:
+                return Path(local_path).read_bytes()
+            except OSError as e:
+                log.warning(f"读取 resource {resource.get('resource_id')} 的本地文件失败：{e}")
+                return None
+        if resource.get("resource_id") is None:
+            return None
+        row = self._get_connection().execute(
+            "SELECT blob FROM resource WHERE id = ?", (resource["resource_id"],)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _generate(self, resource: dict) -> Optional[Path]:
+        resource_id = resource["resource_id"]
+        path = self.thumbnail_path(resource_id)
+        try:
+            if path.is_file():
+                return path
+            original = self.read_original(resource)
+            if not original:
+                return None
+            with Image.open(BytesIO(original)) as image:
+                # JPEG 解码时直接缩小，避免解码整张照片
+                image.draft("RGB", (self.size * 3, self.size))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.size * 3, self.size))
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = path.with_suffix(".tmp")
+                image.save(temp_path, "JPEG", quality=80)
+            os.replace(temp_path, path)
+            return path
+        except Exception as e:
+            log.warning(f"生成 resource {resource_id} 的缩略图失败：{e}")
+            return None
+        finally:
+            with self._pending_lock:
+                self._pending.pop(resource_id, None)
+
+    def get(self, resource: dict) -> Optional[Path]:
+        """返回已缓存的缩略图路径，未缓存时返回 None。"""
+        if not self.enabled or resource.get("resource_id") is None:
+            return None
+        path = self.thumbnail_path(resource["resource_id"])
+        return path if path.is_file() else None
+
+    def request(self, resource: dict, callback: Optional[Callable[[Optional[Path]], None]] = None) -> Optional[Future]:
+        """
+        在后台生成缩略图，生成后（或失败时以 None）调用 callback
+
+        :param resource: resource 记录，须含 resource_id 和 type，以及 blob、internal_path 或 storage_type / reference
+        :param callback: 在工作线程中调用，参数为缩略图路径
+        :return Future: 未安装 Pillow、不是图片或没有 resource_id 时返回 None。
+        """
+        if not self.enabled or not self.is_image(resource) or resource.get("resource_id") is None:
+            return None
+        resource_id = resource["resource_id"]
+        with self._pending_lock:
+            future = self._pending.get(resource_id)
+            if future is None:
+                future = self._executor.submit(self._generate, resource)
+                self._pending[resource_id] = future
+        if callback is not None:
+            future.add_done_callback(lambda done: callback(done.result()))
+        return future
+
+    @staticmethod
+    def to_base64(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,28 +1,30 @@
+import asyncio
 import flet as ft
-from importlib import reload
-import config
+from functools import partial
+from async_data import call_handler
+from tag_index import TagIndex, TagPath, ROOT_PATH, load_tag_index
+from thumbnails import ThumbnailCache
 from utils import get_configured_logger
 from typing import Optional, List
 
 log = get_configured_logger()
 
 
-def reload_tags_dict():
-    reload(config)
-    log.info("Reloaded tags_dict")
-    return config.tags_dict
-
-
 class tags_selector(ft.Column):
     def __init__(
             self,
-            tags_dict: dict = config.tags_dict,
-            on_change=None
+            tags_dict: Optional[dict] = None,
+            on_change=None,
+            data_layer=None,
     ):
         super().__init__()
         self.is_isolated = True
         self.on_change = on_change
-        self.tags_dict = tags_dict
+        self.data_layer = data_layer  # async_data.AsyncDataLayer，给出时在其后台线程中重新加载标签
+        # 给出 tags_dict 时使用固定的标签，否则使用 config.tags_dict 并支持重新加载
+        self.tag_index = TagIndex(tags_dict) if tags_dict is not None else load_tag_index()
+        self.reloadable = tags_dict is None
+        self.expanded_path: TagPath = ROOT_PATH
         self.edit_bool = True
 
     def build(self):
@@ -76,63 +78,88 @@ class tags_selector(ft.Column):
 
     def init_tags_add_view(self):
         """生成 tags_add_view"""
+        self.tags_reload_button = ft.IconButton(
+            icon=ft.icons.REFRESH,
+            tooltip="Reload tags",
+            on_click=self.reload_tags,
+            visible=self.reloadable,
+        )
         self.tags_add_view = ft.Column(
             controls=[
                 ft.Row(wrap=True),  # self.tags_add_view.controls[0]: root tags view
-                ft.Row(wrap=True),  # self.tags_add_view.controls[1]: child tags view
             ],
             visible=self.edit_bool,
         )
-        for key, value in self.tags_dict.items():
-            tag_button = ft.FilledButton(text=key, on_click=self.click_root_tag)
-            tag_button.tooltip = value if type(value) == str else "Expand/"
-            self.tags_add_view.controls[0].controls.append(tag_button)
-
-        tags_reload_button = ft.IconButton(
-            icon=ft.icons.REFRESH,
-            tooltip="Reload tags",
-            on_click=self.reload_tags,
-        )
-        self.tags_add_view.controls[0].controls.append(tags_reload_button)
+        self._sync_tag_rows()
+
+    def _tag_tooltip(self, path: TagPath) -> str:
+        return self.tag_index.get_tag(path) if self.tag_index.is_leaf(path) else "Expand/"
+
+    def _sync_tag_row(self, row: ft.Row, path: TagPath):
+        """让 row 显示 path 的下一级标签，保留没有变化的按钮，只增删有变化的按钮"""
+        existing_buttons = {control.data: control for control in row.controls if control.data is not None}
+        controls = []
+        for name in self.tag_index.get_children(path):
+            child_path = path + (name,)
+            tooltip = self._tag_tooltip(child_path)
+            tag_button = existing_buttons.get(child_path)
+            if tag_button is None or tag_button.tooltip != tooltip:
+                button_class = ft.FilledButton if path == ROOT_PATH else ft.FilledTonalButton
+                tag_button = button_class(text=name, data=child_path, on_click=self.click_tag)
+                tag_button.tooltip = tooltip
+            controls.append(tag_button)
+        if path == ROOT_PATH:
+            controls.append(self.tags_reload_button)
+
+        if [id(control) for control in controls] != [id(control) for control in row.controls]:
+            row.controls = controls
+
+    def _sync_tag_rows(self):
+        """根视图之后，为 expanded_path 的每一级显示一行子标签"""
+        # 标签重新加载后，展开的分组可能已不存在
+        while self.expanded_path and self.expanded_path not in self.tag_index.children:
+            self.expanded_path = self.expanded_path[:-1]
+
+        rows = self.tags_add_view.controls
+        level_count = len(self.expanded_path) + 1
+        del rows[level_count:]
+        while len(rows) < level_count:
+            rows.append(ft.Row(wrap=True))
+        for level, row in enumerate(rows):
+            self._sync_tag_row(row, self.expanded_path[:level])
 
     # Event Handlers
-    def click_root_tag(self, e):
-        if type(self.tags_dict[e.control.text]) == str:
-            self.tags_textfield.value += e.control.tooltip
-        elif type(self.tags_dict[e.control.text]) == dict:
-            self.tags_add_view.controls[1].controls = []
-            for key, value in self.tags_dict[e.control.text].items():
-                tag_button = ft.FilledTonalButton(text=key, on_click=self.click_child_tag)
-                tag_button.tooltip = value if type(value) == str else "暂不支持三级标签"
-                self.tags_add_view.controls[1].controls.append(tag_button)
-        self.update()
-
-    def click_child_tag(self, e):
-        if e.control.tooltip == "暂不支持三级标签":
-            log.error("暂不支持三级标签")
-            raise ValueError("暂不支持三级标签")
-        self.tags_textfield.value += e.control.tooltip
-        self.tags_add_view.controls[1].controls = []
+    def click_tag(self, e):
+        path = e.control.data
+        if self.tag_index.is_leaf(path):
+            self.tags_textfield.value += self.tag_index.get_tag(path)
+            self.expanded_path = ROOT_PATH
+        else:
+            self.expanded_path = path
+        self._sync_tag_rows()
         self.update()
 
-    def save_tags(self, e):
+    async def save_tags(self, e):
         self.edit_bool = False
         self._refresh()
         self.update()
-        if self.on_change:
-            self.on_change(self.tags_textfield.value)
+        await call_handler(self.on_change, self.tags_textfield.value)
 
     def edit_tags(self, e):
         self.edit_bool = True
         self._refresh()
         self.update()
 
-    def reload_tags(self, e):
-        """重新加载 tags_dict"""
-        reloaded_tags_dict = reload_tags_dict()
-        self.tags_dict = reloaded_tags_dict
-        self.init_tags_add_view()
-        self.controls[1] = self.tags_add_view
+    async def reload_tags(self, e):
+        """重新加载 tags_dict，config.py 没有变化时不做任何事"""
+        if self.data_layer is not None:
+            tag_index = await self.data_layer.load_tag_index()
+        else:
+            tag_index = await asyncio.to_thread(load_tag_index)
+        if tag_index is self.tag_index:
+            return
+        self.tag_index = tag_index
+        self._sync_tag_rows()
         self.update()
 
     def clear(self, e):
@@ -167,7 +194,7 @@ class content_editor(ft.TextField):
         self.read_only = not self.edit_bool
         self.update()
 
-    def to_submit(self, tags_text: str):
+    async def to_submit(self, tags_text: str):
         if self.edit_bool:
             log.error("Cannot submit when in edit mode.")
             raise ValueError("Cannot submit when in edit mode.")
@@ -178,16 +205,20 @@ class content_editor(ft.TextField):
         self.value = content_with_tags
         self.disabled = True
         self.update()
-        if self.on_change:
-            self.on_change(self.value)
+        await call_handler(self.on_change, self.value)
 
 
 class images_display(ft.Row):
     def __init__(
         self,
+        thumbnail_cache=None,
+        data_layer=None,
     ):
         super().__init__()
         self.is_isolated = True
+        self.thumbnail_cache = thumbnail_cache  # thumbnails.ThumbnailCache，给出时 load_resources 先显示缩略图
+        self.data_layer = data_layer  # async_data.AsyncDataLayer，给出时在其后台线程中读取缩略图和原图
+        self._load_generation = 0  # 每次 load_resources 加一，丢弃切换 memo 之前发起的读取结果
 
     def build(self):
         self.scroll = "always"
@@ -207,18 +238,235 @@ class images_display(ft.Row):
             self.visible = True
         self.update()
 
+    def _read_thumbnails(self, resources: list) -> List[tuple]:
+        """在后台线程中读取已缓存的缩略图，返回图片 resource 与其缩略图 base64（未缓存时为 None）的列表"""
+        thumbnails = []
+        for resource in resources:
+            if not ThumbnailCache.is_image(resource):
+                continue
+            thumbnail_path = self.thumbnail_cache.get(resource) if self.thumbnail_cache is not None else None
+            thumbnail = ThumbnailCache.to_base64(thumbnail_path.read_bytes()) if thumbnail_path is not None else None
+            thumbnails.append((resource, thumbnail))
+        return thumbnails
+
+    async def load_resources(
+            self,
+            resources: list = [],
+    ):
+        """
+        显示 memo 的图片 resource：有缓存的缩略图直接显示，其余在后台生成后再显示，点击时才加载原图；
+        没有缩略图（没有 thumbnail_cache 或没有 Pillow）时，本地文件直接显示，其余显示占位图标，点击后再加载原图。
+        缓存的缩略图在后台线程中读取，事件循环上只更新控件
+
+        :param resources: resource 记录的列表，格式同 MemoCursor 记录中的 resources
+        """
+        self._load_generation += 1
+        generation = self._load_generation
+        if self.data_layer is not None:
+            thumbnails = await self.data_layer.run_in_background(self._read_thumbnails, resources)
+        else:
+            thumbnails = await asyncio.to_thread(self._read_thumbnails, resources)
+        if generation != self._load_generation:
+            return
+
+        self.controls = []
+        pending = []  # 需要在后台生成缩略图的 (container, resource)
+        for resource, thumbnail in thumbnails:
+            image = ft.Image(height=self.height, fit=ft.ImageFit.CONTAIN)
+            container = ft.Container(content=image, on_click=partial(self.on_image_click, resource))
+            if thumbnail is not None:
+                image.src_base64 = thumbnail
+            elif self.thumbnail_cache is not None and self.thumbnail_cache.enabled:
+                image.visible = False
+                pending.append((container, resource))
+            else:
+                container.content = self._fallback_image(image, resource)
+            self.controls.append(container)
+        self.visible = bool(self.controls)
+        self.update()
+        # 控件挂到页面上之后再请求：缩略图已生成时回调会立即执行，此前请求会因 image.page 为 None 而不显示
+        for container, resource in pending:
+            self.thumbnail_cache.request(
+                resource,
+                lambda path, container=container, resource=resource: self._show_thumbnail(container, resource, path),
+            )
+
+    def _fallback_image(self, image: ft.Image, resource: dict) -> ft.Control:
+        """
+        没有缩略图时图片栏中显示的控件：本地文件用 src 交给界面加载，其余显示占位图标，不读取原图
+
+        :return control: 设置了 src 的 image，或占位图标
+        """
+        local_path = ThumbnailCache.local_path(resource)
+        if local_path:
+            image.src = local_path
+            return image
+        return ft.Icon(ft.icons.IMAGE, size=self.height / 2, tooltip=resource.get("filename", ""))
+
+    def _show_thumbnail(self, container: ft.Container, resource: dict, path):
+        """在缩略图线程中调用，控件已被替换（切换了 memo）时不更新；生成失败时退回到 _fallback_image"""
+        image = container.content
+        if container.page is None:
+            return
+        if path is None:
+            container.content = self._fallback_image(image, resource)
+        else:
+            image.src_base64 = ThumbnailCache.to_base64(path.read_bytes())
+        image.visible = True
+        container.update()
+
+    def _set_full_image(self, image: ft.Image, resource: dict):
+        """读取原图，只在 show_full_image 的后台线程中调用"""
+        local_path = ThumbnailCache.local_path(resource)
+        if local_path:
+            image.src = local_path
+            return
+        # 没有 thumbnail_cache 时只能使用记录中已有的 blob
+        if self.thumbnail_cache is not None:
+            original = self.thumbnail_cache.read_original(resource)
+        else:
+            original = resource.get("blob")
+        if original:
+            image.src_base64 = ThumbnailCache.to_base64(original)
+
+    async def on_image_click(self, resource: dict, e):
+        await self.show_full_image(resource)
+
+    async def show_full_image(self, resource: dict):
+        """在对话框中显示原图，原图在后台线程中读取"""
+        image = ft.Image(fit=ft.ImageFit.CONTAIN)
+        if self.data_layer is not None:
+            await self.data_layer.run_in_background(self._set_full_image, image, resource)
+        else:
+            await asyncio.to_thread(self._set_full_image, image, resource)
+        self.page.dialog = ft.AlertDialog(content=image, open=True)
+        self.page.update()
+
+
+class search_box(ft.Column):
+    def __init__(
+        self,
+        data_layer=None,
+        on_select=None,
+    ):
+        """
+        :param data_layer: async_data.AsyncDataLayer，在其全文索引中搜索
+        :param on_select: 点击搜索结果时调用，参数为 memo_id
+        """
+        super().__init__()
+        self.is_isolated = True
+        self.data_layer = data_layer
+        self.on_select = on_select
+
+    def build(self):
+        self.search_textfield = ft.TextField(
+            label="search",
+            value="",
+            expand=True,
+            on_submit=self.search,
+        )
+        self.search_button = ft.IconButton(
+            icon=ft.icons.SEARCH,
+            tooltip="Search",
+            on_click=self.search,
+        )
+        self.results_view = ft.ListView(height=200, visible=False)
+        self.controls = [
+            ft.Row(controls=[self.search_textfield, self.search_button]),
+            self.results_view,
+        ]
+
+    async def search(self, e=None):
+        results = []
+        if self.data_layer is not None:
+            results = await self.data_layer.search_memos(self.search_textfield.value)
+        self.results_view.controls = [
+            ft.ListTile(
+                title=ft.Text(snippet, max_lines=2),
+                subtitle=ft.Text(f"memo_id: {memo_id}"),
+                on_click=partial(self.on_result_click, memo_id),
+            ) for memo_id, snippet in results
+        ]
+        self.results_view.visible = bool(results)
+        self.update()
+
+    async def on_result_click(self, memo_id: int, e):
+        self.results_view.visible = False
+        self.update()
+        await call_handler(self.on_select, memo_id)
+
+
+class migration_panel(ft.Column):
+    def __init__(
+        self,
+        data_layer=None,
+        on_done=None,
+    ):
+        """
+        :param data_layer: async_data.AsyncDataLayer，在其子进程中运行迁移
+        :param on_done: 迁移成功后调用
+        """
+        super().__init__()
+        self.is_isolated = True
+        self.data_layer = data_layer
+        self.on_done = on_done
+
+    def build(self):
+        self.migrate_button = ft.IconButton(
+            icon=ft.icons.SYNC,
+            tooltip="Migrate",
+            on_click=self.migrate,
+            disabled=self.data_layer is None,
+        )
+        self.progress_text = ft.Text(value="", max_lines=1, expand=True)
+        self.controls = [
+            ft.Row(controls=[self.migrate_button, self.progress_text]),
+        ]
+
+    def show_progress(self, line: str):
+        """显示迁移子进程输出的最新一行日志（进度和指标）"""
+        self.progress_text.value = line
+        self.update()
+
+    async def migrate(self, e=None):
+        self.migrate_button.disabled = True
+        self.update()
+        try:
+            await self.data_layer.run_migration(progress=self.show_progress)
+        except RuntimeError:
+            self.progress_text.value = "Migration failed."
+        else:
+            await call_handler(self.on_done)
+        finally:
+            self.migrate_button.disabled = False
+            self.update()
+
 
 class interact_buttons(ft.Row):
     def __init__(
         self,
         on_change=None,
         on_prev=None,
+        memo_cursor=None,
+        data_layer=None,
+        on_load=None,
     ):
+        """
+        :param on_change: 点击提交时调用
+        :param on_prev: 点击上一条时调用
+        :param memo_cursor: memo_cursor.MemoCursor，提交后使当前 memo 的缓存失效
+        :param data_layer: async_data.AsyncDataLayer，与 memo_cursor 同时给出时，提交后和点击上一条时
+            在其后台线程中移动 memo_cursor，再以移动到的 memo 记录调用 on_load
+        :param on_load: 移动 memo_cursor 后调用，参数为 memo 记录
+        """
         super().__init__()
         self.is_isolated = True
         self.saved_bool = False
         self.on_change = on_change
         self.on_prev = on_prev
+        self.memo_cursor = memo_cursor
+        self.data_layer = data_layer
+        self.on_load = on_load
 
     def build(self):
         self.prev_button = ft.IconButton(
@@ -256,16 +504,28 @@ class interact_buttons(ft.Row):
         self.submit_button.disabled = not self.saved_bool
         self.update()
 
-    def on_submit_click(self, e=None):
-        if self.on_change:
-            self.on_change()
+    async def on_submit_click(self, e=None):
+        await call_handler(self.on_change)
+        if self.memo_cursor is not None:
+            self.memo_cursor.invalidate(self.memo_cursor.current_memo_id)
         self._clear()
+        await self._move_cursor(forward=True)
 
-    def on_prev_click(self, e=None):
+    async def on_prev_click(self, e=None):
         if self.saved_bool:
             self._clear()
         else:
-            self.on_prev()
+            await call_handler(self.on_prev)
+            await self._move_cursor(forward=False)
+
+    async def _move_cursor(self, forward: bool):
+        """在数据层的后台线程中移动 memo_cursor，已到尽头时不调用 on_load"""
+        if self.memo_cursor is None or self.data_layer is None:
+            return
+        move = self.memo_cursor.next if forward else self.memo_cursor.prev
+        record = await self.data_layer.run_in_background(move)
+        if record is not None:
+            await call_handler(self.on_load, record)
 
     def _clear(self):
         self.saved_bool = False
@@ -276,48 +536,87 @@ class interact_buttons(ft.Row):
 
 
 if __name__ == "__main__":
-    def on_tags_change(value):
-        print(f"Tags changed to: {value}")
-        pass
+    from async_data import AsyncDataLayer
+    from memo_cursor import MemoCursor
+    from memo_search import open_search_index
+    from submit_queue import SubmitQueue
+
+    # 数据库访问都经过 data_layer，事件处理函数只 await 它，不在事件循环中执行阻塞的 I/O
+    search_index = open_search_index()
+    submit_queue = SubmitQueue(search_index=search_index)
+    data_layer = AsyncDataLayer(submit_queue=submit_queue, search_index=search_index)
+    thumbnail_cache = ThumbnailCache()
+    memo_cursor = MemoCursor()
+
+    async def main(page: ft.Page):
+        def on_tags_change(value):
+            print(f"Tags changed to: {value}")
+
+        async def on_content_change(value):
+            record = await data_layer.run_in_background(memo_cursor.current)
+            await data_layer.submit_memo(record["memo_id"], record["created_ts"], record["updated_ts"], value)
+
+        async def on_buttons_change():
+            content_editor_view.saved()
+            await content_editor_view.to_submit(tags_selector_view.tags_textfield.value)
+
+        async def on_load(record: dict):
+            content_editor_view.value = record["content"]
+            content_editor_view.disabled = False
+            content_editor_view.editing()
+            await images_display_view.load_resources(record["resources"])
+
+        async def on_search_select(memo_id: int):
+            await on_load(await data_layer.run_in_background(memo_cursor.jump_to, memo_id))
+
+        def on_migration_done():
+            print("Migration finished.")
 
-    def on_content_change(value):
-        print(f"Content changed to: {value}")
-        pass
-
-    def on_buttons_change():
-        print("Submit clicked.")
-        pass
-
-    def on_prev_click():
-        print("Previous clicked.")
-        pass
-
-    def main(page: ft.Page):
         tags_selector_view = tags_selector(
             on_change=on_tags_change,
+            data_layer=data_layer,
         )
         content_editor_view = content_editor(
             on_change=on_content_change,
         )
-        images_display_view = images_display()
+        images_display_view = images_display(
+            thumbnail_cache=thumbnail_cache,
+            data_layer=data_layer,
+        )
+        search_view = search_box(
+            data_layer=data_layer,
+            on_select=on_search_select,
+        )
+        migration_view = migration_panel(
+            data_layer=data_layer,
+            on_done=on_migration_done,
+        )
         interact_view = interact_buttons(
             on_change=on_buttons_change,
-            on_prev=on_prev_click,
+            memo_cursor=memo_cursor,
+            data_layer=data_layer,
+            on_load=on_load,
         )
         page.add(
+            migration_view,
+            search_view,
             tags_selector_view,
             content_editor_view,
             images_display_view,
             interact_view,
         )
-        images_display_view.load(
-            image_list=[
-                "/assets/icon.png",
-                "/resource/2020/08/step_1626517240759_1620_1080.png"
-            ]
-        )
+        await on_load(await data_layer.run_in_background(memo_cursor.current))
 
-    ft.app(
-        target=main,
-        assets_dir="/Users/krdw/Desktop/code-to-learn/python/learn_flet/memos_rollback"
-    )
+    try:
+        ft.app(
+            target=main,
+            assets_dir="/Users/krdw/Desktop/code-to-learn/python/learn_flet/memos_rollback"
+        )
+    finally:
+        # 先写完队列中的提交，再关闭各自的线程和连接
+        submit_queue.close()
+        data_layer.close()
+        memo_cursor.close()
+        thumbnail_cache.close()
+        if search_index is not None:
+            search_index.close()
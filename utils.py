@@ -1,6 +1,13 @@
+import threading
+import time
 from pathlib import Path
+from typing import Dict, Optional
 from loguru import logger
-from config import log_path
+from config import log_path, log_enqueue, log_sample_interval_s
+
+# 已添加的日志文件 sink：日志文件路径 -> sink id，保证每个文件只添加一次
+_log_sinks: Dict[str, int] = {}
+_log_sinks_lock = threading.Lock()
 
 
 def is_file_exists(file_path: str) -> bool:
@@ -22,19 +29,86 @@ def ensure_directory_exists_for_file(file_path: str) -> None:
 
 
 def get_configured_logger(log_folder=log_path, log_file_prefix="log"):
-    # 确保日志文件夹存在
-    log_folder_path = Path(log_folder)
-    log_folder_path.mkdir(parents=True, exist_ok=True)
+    """
+    获取配置好的日志记录器，多次调用只会为同一个日志文件添加一次 sink
 
+    :param log_folder: 日志文件夹，默认为 config.log_path
+    :param log_file_prefix: 日志文件名前缀，默认为 "log"
+    :return logger: loguru 的 logger
+    """
     # 创建日志文件路径，使用每日轮转
+    log_folder_path = Path(log_folder)
     log_file = log_folder_path / f"{log_file_prefix}_{{time:YYYY_MM_DD}}.log"
+    sink_key = str(log_file.resolve())
 
-    # 配置日志记录器
-    logger.add(log_file, rotation="00:00", retention=None)
+    with _log_sinks_lock:
+        if sink_key in _log_sinks:
+            return logger
+
+        # 确保日志文件夹存在
+        log_folder_path.mkdir(parents=True, exist_ok=True)
+
+        # 配置日志记录器；enqueue 时由后台线程写文件，调用方不必等待磁盘 I/O
+        _log_sinks[sink_key] = logger.add(
+            log_file, rotation="00:00", retention=None, enqueue=log_enqueue
+        )
 
     return logger
 
 
+class SampledLogger:
+    """
+    限流的日志记录器，用于逐条记录的热循环
+
+    同一个 key 在 interval_s 秒内最多输出一条日志，其余的只计数，
+    下一次输出时附上被省略的条数。
+    """
+
+    def __init__(self, interval_s: float = log_sample_interval_s, log=None):
+        """
+        :param interval_s: 同一个 key 两次输出之间的最短间隔（秒），默认为 config.log_sample_interval_s；为 0 时不限流
+        :param log: 日志记录器，默认为 get_configured_logger()
+        """
+        self.interval_s = interval_s
+        self.log = log if log is not None else get_configured_logger()
+        self._last_time: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, level: str, message: str, key: Optional[str] = None) -> bool:
+        """
+        按限流规则输出一条日志
+
+        :param level: 日志级别，如 "DEBUG"、"INFO"
+        :param message: 日志内容
+        :param key: 限流的分组，默认为 level
+        :return bool: 实际输出时返回 True；被省略时返回 False。
+        """
+        key = key if key is not None else level
+        now = time.monotonic()
+        with self._lock:
+            last_time = self._last_time.get(key)
+            if last_time is not None and now - last_time < self.interval_s:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last_time[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+
+        if suppressed:
+            message = f"{message}（此前 {self.interval_s:g} 秒内省略 {suppressed} 条）"
+        self.log.log(level, message)
+        return True
+
+    def debug(self, message: str, key: Optional[str] = None) -> bool:
+        return self.emit("DEBUG", message, key)
+
+    def info(self, message: str, key: Optional[str] = None) -> bool:
+        return self.emit("INFO", message, key)
+
+    def warning(self, message: str, key: Optional[str] = None) -> bool:
+        return self.emit("WARNING", message, key)
+
+
 if __name__ == '__main__':
     config_file_path = './config.py'
     if is_file_exists(config_file_path):
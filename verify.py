@@ -0,0 +1,266 @@
+"""
+校验迁移结果：比较旧数据库 (v0.21.0) 与新数据库 (v0.17.1) 的 memo 和 resource 是否一致
+
+把 id 划分为若干区间，在两边并行计算每个区间的聚合哈希（行数与逐行哈希之和），
+只对哈希不同的区间继续细分，直到区间足够小时逐行比较，给出不一致的 id。
+
+用法示例：
+    python verify.py --workers 4 --ranges 64 --json ./log/verify.json
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from config import old_database_path_v0210, new_database_path_v0171, resource_dedup_dir, migrate_blob_chunk_size
+from database import connect_read_only, iter_resource_blob, RESOURCE_EXTERNAL_LINK_SQL
+from resource_pipeline import sniff_resource_type
+from utils import get_configured_logger
+
+log = get_configured_logger()
+
+HASH_MODULUS = 1 << 128
+SOURCE, TARGET = "source", "target"
+# 每个表在两边读取的列；resource 的 blob 只读长度，内容另外分块计算哈希
+ROW_SQL = {
+    ("memo", SOURCE): "SELECT id, created_ts, updated_ts, content FROM memo",
+    ("memo", TARGET): "SELECT id, created_ts, updated_ts, content FROM memo",
+    ("resource", SOURCE): (
+        f"SELECT id, memo_id, filename, type, size, {RESOURCE_EXTERNAL_LINK_SQL}, length(blob), '' FROM resource"
+    ),
+    ("resource", TARGET): (
+        "SELECT id, memo_id, filename, type, size, external_link, length(blob), internal_path FROM resource"
+    ),
+}
+
+
+class RangeVerifier:
+    """
+    按 id 区间比较两个数据库中的同一张表
+
+    每个工作线程使用自己的只读连接；区间的聚合哈希与行的顺序无关，也不需要在内存中保存逐行的哈希。
+    """
+
+    def __init__(
+        self,
+        old_db_path: str = old_database_path_v0210,
+        new_db_path: str = new_database_path_v0171,
+        workers: int = 4,
+        leaf_rows: int = 256,
+        split_count: int = 8,
+        dedup_dir: str = resource_dedup_dir,
+    ):
+        """
+        :param old_db_path: 旧数据库的路径，默认为 old_database_path_v0210。
+        :param new_db_path: 新数据库的路径，默认为 new_database_path_v0171。
+        :param workers: 并行计算区间哈希的线程数，默认为 4。
+        :param leaf_rows: 区间的行数不超过该值时不再细分，直接逐行比较，默认为 256。
+        :param split_count: 每次细分的子区间数量，默认为 8。
+        :param dedup_dir: 去重后的 blob 文件目录，默认在 config.py 给出；新数据库中 blob 为 NULL 且
+            internal_path 指向该目录时，比较文件的内容。
+        """
+        if workers <= 0 or leaf_rows <= 0 or split_count < 2:
+            log.error(f"Invalid workers: {workers}, leaf_rows: {leaf_rows} or split_count: {split_count}")
+            raise ValueError("Invalid workers, leaf_rows or split_count.")
+        self.db_paths = {SOURCE: old_db_path, TARGET: new_db_path}
+        self.leaf_rows = leaf_rows
+        self.split_count = split_count
+        self.dedup_dir = Path(dedup_dir).resolve() if dedup_dir else None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="verify")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+    def _get_connection(self, side: str) -> sqlite3.Connection:
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if side not in connections:
+            connections[side] = connect_read_only(self.db_paths[side])
+            with self._connections_lock:
+                self._connections.append(connections[side])
+        return connections[side]
+
+    def _content_digest(self, side: str, row: tuple) -> Tuple[str, bytes]:
+        """resource 内容的 sha256 和开头若干字节：blob 分块读取；去重后的 blob 读取文件。"""
+        db_connection = self._get_connection(side)
+        resource_id, blob_size, internal_path = row[0], row[6], row[7]
+        sha256 = hashlib.sha256()
+        head = b""
+        if blob_size:
+            for data in iter_resource_blob(db_connection, resource_id, blob_size, migrate_blob_chunk_size):
+                head = head or data[:16]
+                sha256.update(data)
+        elif internal_path and self.dedup_dir is not None and Path(internal_path).resolve().is_relative_to(self.dedup_dir):
+            with open(internal_path, "rb") as f:
+                while data := f.read(migrate_blob_chunk_size):
+                    head = head or data[:16]
+                    sha256.update(data)
+        else:
+            return "", head
+        return sha256.hexdigest(), head
+
+    def _iter_row_digests(self, table: str, side: str, low: int, high: int):
+        """逐行产出 (id, 行哈希)，区间为 (low, high]。"""
+        cursor = self._get_connection(side).execute(
+            f"{ROW_SQL[(table, side)]} WHERE id > ? AND id <= ?", (low, high)
+        )
+        for row in cursor:
+            if table == "resource":
+                digest, head = self._content_digest(side, row)
+                # 并行和分片迁移会为空的 type 推断类型，两边都按同样的方式补全后再比较
+                resource_type = row[3] or sniff_resource_type(head, row[2])
+                values = row[:3] + (resource_type,) + row[4:6] + (digest,)
+            else:
+                values = row
+            digest = hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+            yield row[0], int.from_bytes(digest, "big")
+
+    def _range_hash(self, table: str, side: str, low: int, high: int) -> Tuple[int, int]:
+        count = 0
+        total = 0
+        for _, digest in self._iter_row_digests(table, side, low, high):
+            count += 1
+            total = (total + digest) % HASH_MODULUS
+        return count, total
+
+    def _row_hashes(self, table: str, side: str, low: int, high: int) -> Dict[int, int]:
+        return dict(self._iter_row_digests(table, side, low, high))
+
+    def _id_bounds(self, table: str) -> Tuple[int, int]:
+        low, high = 0, 0
+        for side in (SOURCE, TARGET):
+            min_id, max_id = self._get_connection(side).execute(
+                f"SELECT IFNULL(MIN(id), 1), IFNULL(MAX(id), 0) FROM {table}"
+            ).fetchone()
+            low = min(low, min_id - 1)
+            high = max(high, max_id)
+        return low, high
+
+    @staticmethod
+    def _split(low: int, high: int, count: int) -> List[Tuple[int, int]]:
+        span = max(1, -(-(high - low) // count))
+        return [(start, min(start + span, high)) for start in range(low, high, span)]
+
+    def verify_table(self, table: str, range_count: int = 64) -> dict:
+        """
+        比较一张表
+
+        :param table: "memo" 或 "resource"
+        :param range_count: 第一轮划分的区间数量，默认为 64
+        :return dict: 包含区间数量 ranges、计算哈希的区间总数 hashed_ranges、
+            只在旧数据库中存在的 missing_ids、只在新数据库中存在的 extra_ids 和内容不同的 mismatched_ids 的字典。
+        """
+        if (table, SOURCE) not in ROW_SQL:
+            log.error(f"Invalid table: {table}")
+            raise ValueError("Invalid table.")
+
+        low, high = self._id_bounds(table)
+        pending = self._split(low, high, range_count)
+        result = {"ranges": len(pending), "hashed_ranges": 0, "missing_ids": [], "extra_ids": [], "mismatched_ids": []}
+
+        while pending:
+            futures = [
+                (id_range, self._executor.submit(self._range_hash, table, SOURCE, *id_range),
+                 self._executor.submit(self._range_hash, table, TARGET, *id_range))
+                for id_range in pending
+            ]
+            result["hashed_ranges"] += len(futures)
+            pending = []
+            leaves = []
+            for id_range, source_future, target_future in futures:
+                source_hash, target_hash = source_future.result(), target_future.result()
+                if source_hash == target_hash:
+                    continue
+                range_low, range_high = id_range
+                if max(source_hash[0], target_hash[0]) <= self.leaf_rows or range_high - range_low <= 1:
+                    leaves.append(id_range)
+                else:
+                    pending.extend(self._split(range_low, range_high, self.split_count))
+
+            leaf_futures = [
+                (self._executor.submit(self._row_hashes, table, SOURCE, *id_range),
+                 self._executor.submit(self._row_hashes, table, TARGET, *id_range))
+                for id_range in leaves
+            ]
+            for source_future, target_future in leaf_futures:
+                source_rows, target_rows = source_future.result(), target_future.result()
+                result["missing_ids"].extend(sorted(source_rows.keys() - target_rows.keys()))
+                result["extra_ids"].extend(sorted(target_rows.keys() - source_rows.keys()))
+                result["mismatched_ids"].extend(sorted(
+                    record_id for record_id in source_rows.keys() & target_rows.keys()
+                    if source_rows[record_id] != target_rows[record_id]
+                ))
+
+        for key in ("missing_ids", "extra_ids", "mismatched_ids"):
+            result[key].sort()
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._connections_lock:
+            for db_connection in self._connections:
+                db_connection.close()
+            self._connections.clear()
+
+
+def verify_migration(
+    old_db_path: str = old_database_path_v0210,
+    new_db_path: str = new_database_path_v0171,
+    workers: int = 4,
+    range_count: int = 64,
+    leaf_rows: int = 256,
+) -> dict:
+    """
+    比较旧数据库与新数据库的 memo 和 resource
+
+    :return report: 以表名为键的 verify_table 结果，另有 ok（全部一致时为 True）和 elapsed_s（秒）。
+    """
+    start_time = time.perf_counter()
+    verifier = RangeVerifier(old_db_path, new_db_path, workers=workers, leaf_rows=leaf_rows)
+    try:
+        report = {table: verifier.verify_table(table, range_count) for table in ("memo", "resource")}
+    finally:
+        verifier.close()
+
+    report["ok"] = not any(
+        report[table][key] for table in ("memo", "resource") for key in ("missing_ids", "extra_ids", "mismatched_ids")
+    )
+    report["elapsed_s"] = time.perf_counter() - start_time
+    for table in ("memo", "resource"):
+        table_report = report[table]
+        log.info(
+            f"[{table}] 比较 {table_report['hashed_ranges']} 个区间：缺少 {len(table_report['missing_ids'])} 条，"
+            f"多出 {len(table_report['extra_ids'])} 条，不一致 {len(table_report['mismatched_ids'])} 条。"
+        )
+    if report["ok"]:
+        log.info(f"校验通过，用时 {report['elapsed_s']:.2f} 秒。")
+    else:
+        log.error(f"校验未通过，用时 {report['elapsed_s']:.2f} 秒。")
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="校验 v0.17.1 数据库与 v0.21.0 数据库的 memo 和 resource 是否一致。")
+    parser.add_argument("--old", default=old_database_path_v0210, help="旧数据库 (v0.21.0) 的路径")
+    parser.add_argument("--new", default=new_database_path_v0171, help="新数据库 (v0.17.1) 的路径")
+    parser.add_argument("--workers", type=int, default=4, help="并行计算哈希的线程数")
+    parser.add_argument("--ranges", type=int, default=64, help="第一轮划分的 id 区间数量")
+    parser.add_argument("--leaf-rows", type=int, default=256, help="区间行数不超过该值时逐行比较")
+    parser.add_argument("--json", default="", help="把校验结果写入该 JSON 文件")
+    args = parser.parse_args(argv)
+
+    report = verify_migration(args.old, args.new, args.workers, args.ranges, args.leaf_rows)
+    if args.json:
+        Path(args.json).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())